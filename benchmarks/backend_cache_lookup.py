@@ -0,0 +1,65 @@
+# Copyright 2019 Novartis Institutes for BioMedical Research Inc. Licensed
+# under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at http://www.apache.org/licenses/LICENSE-2.0. Unless
+# required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+# Measures BackendCache.check_path and check_entry as the number of entries
+# grows. With the indexes the cost per lookup should stay roughly flat.
+#
+# usage: python benchmarks/backend_cache_lookup.py
+
+import timeit
+
+from cellxgene_gateway.backend_cache import BackendCache
+from cellxgene_gateway.cache_entry import CacheEntry, CacheEntryStatus
+from cellxgene_gateway.cache_key import CacheKey
+from cellxgene_gateway.items.file.fileitem import FileItem
+from cellxgene_gateway.items.file.fileitem_source import FileItemSource
+from cellxgene_gateway.items.item import ItemType
+
+source = FileItemSource("/data", "local")
+
+
+def make_key(i):
+    return CacheKey(
+        FileItem(
+            f"project{i % 20}/run{i}", name=f"dataset{i}.h5ad", type=ItemType.h5ad
+        ),
+        source,
+    )
+
+
+def make_cache(size):
+    cache = BackendCache()
+    entries = []
+    for i in range(size):
+        entry = CacheEntry.for_key(make_key(i), 8000 + i)
+        # half of the entries are terminated, as after a day of use
+        entry.status = CacheEntryStatus.terminated if i % 2 else CacheEntryStatus.loaded
+        entries.append(entry)
+    cache.entry_list = entries
+    cache.index  # build the index up front, outside of the timed lookups
+    return cache
+
+
+def main(number=2000):
+    print(f"{'entries':>8} {'check_path (us)':>16} {'check_entry (us)':>17}")
+    for size in [10, 100, 1000, 10000]:
+        cache = make_cache(size)
+        key = make_key(size - 2)
+        path = key.descriptor + "/api/v0.2/layout/obs"
+        check_path = timeit.timeit(
+            lambda: cache.check_path(source, path), number=number
+        )
+        check_entry = timeit.timeit(lambda: cache.check_entry(key), number=number)
+        print(
+            f"{size:>8} {check_path / number * 1e6:>16.2f} {check_entry / number * 1e6:>17.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
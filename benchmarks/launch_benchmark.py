@@ -0,0 +1,91 @@
+# Copyright 2019 Novartis Institutes for BioMedical Research Inc. Licensed
+# under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at http://www.apache.org/licenses/LICENSE-2.0. Unless
+# required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+# Measures the time until a dataset is served when cellxgene is started
+# directly and when it is forked from the zygote. The zygote is started
+# before the first timed launch, as it would be by an earlier request.
+#
+# Needs cellxgene, see CELLXGENE_LOCATION.
+#
+# usage: python benchmarks/launch_benchmark.py <h5ad file> [launches]
+
+import os
+import signal
+import socket
+import statistics
+import sys
+import time
+from threading import Thread
+
+from cellxgene_gateway import env
+from cellxgene_gateway.cache_entry import CacheEntry, CacheEntryStatus
+from cellxgene_gateway.cache_key import CacheKey
+from cellxgene_gateway.items.file.fileitem import FileItem
+from cellxgene_gateway.items.file.fileitem_source import FileItemSource
+from cellxgene_gateway.items.item import ItemType
+from cellxgene_gateway.process_exception import ProcessException
+from cellxgene_gateway.subprocess_backend import SubprocessBackend
+from cellxgene_gateway.zygote_backend import ZygoteBackend
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def launch_once(backend, key):
+    entry = CacheEntry.for_key(key, free_port())
+
+    def run():
+        try:
+            backend.launch(env.cellxgene_location, [], entry)
+        except ProcessException:
+            pass
+
+    thread = Thread(target=run)
+    thread.start()
+    while entry.status == CacheEntryStatus.loading:
+        time.sleep(0.05)
+    if entry.status != CacheEntryStatus.loaded:
+        raise SystemExit(f"launch failed: {entry.message}\n{entry.all_output}")
+    os.killpg(entry.pid, signal.SIGTERM)
+    thread.join()
+    return entry.time_to_ready
+
+
+def measure(backend, key, launches):
+    return [launch_once(backend, key) for _ in range(launches)]
+
+
+def main(file_path, launches=5):
+    directory, file_name = os.path.split(os.path.abspath(file_path))
+    name, ext = os.path.splitext(file_name)
+    key = CacheKey(
+        FileItem("", ext=ext, name=name, type=ItemType.h5ad),
+        FileItemSource(directory, "local"),
+    )
+    zygote = ZygoteBackend()
+    zygote.start_zygote(env.cellxgene_location)
+    try:
+        results = {
+            "subprocess": measure(SubprocessBackend(), key, launches),
+            "zygote": measure(zygote, key, launches),
+        }
+    finally:
+        zygote.zygote.kill()
+    print(f"{'launcher':>10} {'mean (s)':>9} {'median (s)':>11} {'max (s)':>8}")
+    for launcher, times in results.items():
+        print(
+            f"{launcher:>10} {statistics.mean(times):>9.2f} {statistics.median(times):>11.2f} {max(times):>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], *[int(a) for a in sys.argv[2:3]])
@@ -7,18 +7,37 @@
 # OR CONDITIONS OF ANY KIND, either express or implied. See the License for
 # the specific language governing permissions and limitations under the License.
 
-import time
+import logging
+from collections import deque
+from contextlib import contextmanager
+from functools import partial
 from http import HTTPStatus
-from threading import Thread
+from threading import Lock, RLock
 from typing import List
 
 from cellxgene_gateway import env
 from cellxgene_gateway.cache_entry import CacheEntry, CacheEntryStatus
 from cellxgene_gateway.cache_key import CacheKey
 from cellxgene_gateway.cellxgene_exception import CellxgeneException
+from cellxgene_gateway.entry_index import EntryIndex
+from cellxgene_gateway.failure_cache import FailureCache
+from cellxgene_gateway.launch_scheduler import LaunchScheduler
+from cellxgene_gateway.port_allocator import PortAllocator
+from cellxgene_gateway.readiness import is_serving
+from cellxgene_gateway.registry import (
+    apply_row,
+    is_backend,
+    reap,
+    touch_interval_seconds,
+)
 from cellxgene_gateway.subprocess_backend import SubprocessBackend
+from cellxgene_gateway.termination import TerminationExecutor
+from cellxgene_gateway.util import current_time_stamp
+from cellxgene_gateway.zygote_backend import ZygoteBackend
 
-process_backend = SubprocessBackend()
+logger = logging.getLogger(__name__)
+
+process_backend = ZygoteBackend() if env.launcher == "zygote" else SubprocessBackend()
 
 
 def is_port_in_use(port):
@@ -28,73 +47,396 @@ def is_port_in_use(port):
         return s.connect_ex(("localhost", port)) == 0
 
 
+def is_stopped(entry):
+    return entry.status in [CacheEntryStatus.terminating, CacheEntryStatus.terminated]
+
+
+def first_replica(candidates, name):
+    # the lowest numbered replica, if the entries are replicas of one dataset
+    matches = [c for c in candidates if not is_stopped(c)]
+    if len(matches) == 0:
+        return None
+    if len({c.key.identity for c in matches}) > 1 or len(
+        {c.replica for c in matches}
+    ) < len(matches):
+        raise CellxgeneException(
+            HTTPStatus.INTERNAL_SERVER_ERROR,
+            f"Found {len(matches)} for {name}",
+        )
+    return min(matches, key=lambda c: c.replica)
+
+
 class BackendCache:
-    def __init__(self):
-        self.entry_list = []
+    def __init__(self, registry=None):
+        self.lock = RLock()
+        self._entry_list = []
+        self._index = EntryIndex()
+        self.key_locks = {}
+        self.admission_queue = deque()
+        self.port_allocator = PortAllocator(env.port_range_start, env.port_range_end)
+        self.terminator = TerminationExecutor()
+        self.scheduler = LaunchScheduler()
+        self.failures = FailureCache()
+        self.creation_listeners = []
+        # shared with the other workers of this host, see registry.py
+        self.registry = registry
+
+    @property
+    def entry_list(self):
+        return self._entry_list
+
+    @entry_list.setter
+    def entry_list(self, entries):
+        with self.lock:
+            self._entry_list = entries
+            self._index = None
+
+    @property
+    def index(self):
+        # rebuilt lazily after entry_list is replaced wholesale
+        with self.lock:
+            if self._index is None:
+                self._index = EntryIndex(self._entry_list)
+            return self._index
 
     def get_ports(self):
         contents = self.entry_list
         return [c.port for c in contents]
 
     def check_path(self, source, path):
-        contents = self.entry_list
-        matches = [
-            c
-            for c in contents
-            if c.key.source.name == source.name
-            and path.startswith(c.key.descriptor)
-            and c.status != CacheEntryStatus.terminated
-        ]
-
-        if len(matches) == 0:
-            return None
-        elif len(matches) == 1:
-            return matches[0]
-        else:
-            raise CellxgeneException(
-                HTTPStatus.INTERNAL_SERVER_ERROR,
-                "Found " + str(len(matches)) + " for " + path,
-            )
+        with self.lock:
+            candidates = self.index.matching_path(source.name, path)
+        return first_replica(candidates, path)
 
     def check_entry(self, key):
-        contents = self.entry_list
-        matches = [
+        with self.lock:
+            candidates = self.index.matching_key(key)
+        return first_replica(candidates, key.descriptor)
+
+    def replicas(self, key):
+        with self.lock:
+            candidates = self.index.matching_key(key)
+        return sorted(
+            [c for c in candidates if not is_stopped(c)], key=lambda c: c.replica
+        )
+
+    def route(self, entry, scripts, affinity=None):
+        """Returns the replica of entry's dataset to send a request to: the
+        one numbered affinity if it is loaded, otherwise the loaded one with
+        the fewest requests in flight. Launches more replicas first if there
+        are fewer than GATEWAY_REPLICAS, or if all of them are busy.
+        """
+        replicas = self.replicas(entry.key)
+        if len(replicas) == 0:
+            return entry
+        if len(replicas) < self.wanted_replicas(replicas):
+            self.add_replica(entry.key, scripts, len(replicas))
+        loaded = [r for r in replicas if r.status == CacheEntryStatus.loaded]
+        for replica in loaded:
+            if replica.replica == affinity:
+                return replica
+        if len(loaded) == 0:
+            return entry
+        return min(loaded, key=lambda r: (r.in_flight, r.replica))
+
+    def wanted_replicas(self, replicas):
+        # replicas are not shared between the workers of a registry
+        if self.registry is not None:
+            return 1
+        wanted = max(env.replicas, 1)
+        loaded = [r for r in replicas if r.status == CacheEntryStatus.loaded]
+        # one more if every replica is busy, but none is starting or failed
+        if (
+            env.replica_in_flight > 0
+            and len(loaded) == len(replicas)
+            and sum(r.in_flight for r in loaded) >= env.replica_in_flight * len(loaded)
+            and (env.max_backends <= 0 or self.live_count() < env.max_backends)
+        ):
+            wanted = max(wanted, len(replicas) + 1)
+        return min(wanted, max(env.replicas, env.max_replicas, 1))
+
+    def add_replica(self, key, scripts, count):
+        # count is the number of replicas the caller saw, so that concurrent
+        # requests launch only one more
+        with self.key_lock(key):
+            replicas = self.replicas(key)
+            if len(replicas) != count:
+                return None
+            used = {r.replica for r in replicas}
+            number = min(n for n in range(len(replicas) + 1) if n not in used)
+            logger.info(f"launching replica {number} of {key.descriptor}")
+            return self.create_entry(key, scripts, replica=number)
+
+    def create_entry(self, key: CacheKey, scripts: List[str], warm=False, replica=0):
+        entry = CacheEntry.for_key(key, None)
+        entry.warm = warm
+        entry.replica = replica
+        failure = self.failures.open_failure(key)
+        if failure is not None:
+            return self.add_failed(entry, failure)
+        if self.registry is not None:
+            row = self.registry.claim(entry)
+            if row is not None:
+                return self.adopt(entry, row)
+            entry.on_status = self.registry.update
+
+        with self.lock:
+            admitted, evicted = self.admit()
+            if not admitted:
+                entry.status = CacheEntryStatus.queued
+                self.admission_queue.append((entry, scripts))
+            self.entry_list.append(entry)
+            self.index.add(entry)
+
+        for victim in evicted:
+            logger.info(f"evicting {victim.key.descriptor} to admit {key.descriptor}")
+            self.retire(victim)
+        if admitted:
+            self.launch(entry, scripts)
+        for listener in self.creation_listeners:
+            listener(entry)
+
+        return entry
+
+    def add_failed(self, entry, failure):
+        # served the error of its last launch, without launching it again
+        failure.apply(entry)
+        with self.lock:
+            self.entry_list.append(entry)
+            self.index.add(entry)
+        for listener in self.creation_listeners:
+            listener(entry)
+        return entry
+
+    def expire_failure(self, entry):
+        # a failed launch whose backoff is over is stopped, to be launched again
+        if entry.status != CacheEntryStatus.error or not self.failures.may_retry(
+            entry.key
+        ):
+            return False
+        self.terminate(entry)
+        return True
+
+    def adopt(self, entry, row):
+        # a backend launched by another worker
+        apply_row(entry, row)
+        entry.on_status = self.registry.update
+        with self.lock:
+            self.entry_list.append(entry)
+            self.index.add(entry)
+        for listener in self.creation_listeners:
+            listener(entry)
+        return entry
+
+    def recover(self, key_for_row):
+        """Reattaches to the backends left running by gateway processes that
+        are gone, and stops those that no longer serve their dataset.
+
+        key_for_row returns the CacheKey of a registry row, or None if its
+        dataset can no longer be found.
+        """
+        if self.registry is None:
+            return []
+        recovered = []
+        for row in self.registry.orphans():
+            if not self.registry.take_over(row):
+                continue  # recovered by another worker
+            key = key_for_row(row)
+            if (
+                key is None
+                or row.status != CacheEntryStatus.loaded.name
+                or not is_backend(row)
+                or not is_serving(row.port)
+            ):
+                reap(row)
+                self.registry.remove(row.claim)
+                continue
+            with self.key_lock(key):
+                match = self.check_entry(key)
+                if match is None:
+                    match = self.adopt(CacheEntry.for_key(key, None), row)
+            logger.info(f"recovered {key.descriptor} on port {row.port}")
+            recovered.append(match)
+        return recovered
+
+    def sync(self, entry, touch=False):
+        # updates entry from the registry; returns False if it no longer exists
+        if self.registry is None or entry.claim is None:
+            return True
+        row = self.registry.get(entry.claim)
+        if row is None:
+            self.forget(entry)
+            return False
+        apply_row(entry, row)
+        if touch:
+            timestamp = current_time_stamp()
+            if timestamp - row.last_used >= touch_interval_seconds:
+                self.registry.touch(entry, timestamp)
+        return True
+
+    def forget(self, entry):
+        # the backend was stopped by another worker
+        with self.lock:
+            try:
+                self.remove(entry)
+            except ValueError:
+                pass
+            self.dequeue(entry)
+            if self._index is not None:
+                self._index.remove(entry)
+        entry.set_status(CacheEntryStatus.terminated, notify=False)
+        entry.close_session()
+        self.port_allocator.release(entry.port, entry)
+
+    def allocate_port(self, entry):
+        entry.port = self.port_allocator.allocate(entry)
+        # ports of backends launched by other workers are skipped like ports in use
+        while self.registry is not None and not self.registry.reserve_port(entry):
+            self.port_allocator.release(entry.port, entry, in_use=True)
+            entry.port = self.port_allocator.allocate(entry)
+
+    def launch(self, entry, scripts):
+        try:
+            self.allocate_port(entry)
+        except CellxgeneException as e:
+            entry.set_error(e.message, "", e.http_status)
+            return
+
+        entry.start_listeners.append(self.failures.launch_finished)
+        # started on a thread of the scheduler once other launches are done
+        self.scheduler.submit(
+            entry,
+            partial(
+                process_backend.launch,
+                env.cellxgene_location,
+                scripts,
+                entry,
+                self.port_allocator,
+            ),
+        )
+
+    def live_count(self):
+        return len(
+            [
+                c
+                for c in self.entry_list
+                if c.status in [CacheEntryStatus.loading, CacheEntryStatus.loaded]
+            ]
+        )
+
+    def idle_entries(self):
+        # loaded entries that may be evicted to make room for others
+        cutoff = current_time_stamp() - env.evict_min_idle_seconds
+        return [
             c
-            for c in contents
-            if c.key.equals(key) and c.status != CacheEntryStatus.terminated
+            for c in self.entry_list
+            if c.status == CacheEntryStatus.loaded
+            and c.in_flight == 0
+            and c.last_used <= cutoff
         ]
 
-        if len(matches) == 0:
-            return None
-        elif len(matches) == 1:
-            return matches[0]
-        else:
-            raise CellxgeneException(
-                HTTPStatus.INTERNAL_SERVER_ERROR,
-                "Found " + str(len(matches)) + " for " + key.dataset,
-            )
+    def least_recently_used_idle(self):
+        return min(self.idle_entries(), key=lambda c: c.last_used, default=None)
 
-    def create_entry(self, key: CacheKey, scripts: List[str]):
-        port = 8000
-        existing_ports = self.get_ports()
+    def admit(self):
+        # must be called with self.lock held; returns whether a new backend may
+        # be launched, and the entries that were evicted to make room for it
+        if env.max_backends <= 0 or self.live_count() < env.max_backends:
+            return True, []
+        victim = self.least_recently_used_idle()
+        if victim is None:
+            return False, []
+        self.remove(victim)
+        return True, [victim]
 
-        while (port in existing_ports) or is_port_in_use(port):
-            port += 1
+    def admit_queued(self):
+        launches = []
+        evicted = []
+        with self.lock:
+            while len(self.admission_queue) > 0:
+                admitted, victims = self.admit()
+                evicted.extend(victims)
+                if not admitted:
+                    break
+                entry, scripts = self.admission_queue.popleft()
+                entry.status = CacheEntryStatus.loading
+                launches.append((entry, scripts))
 
-        entry = CacheEntry.for_key(key, port)
+        for victim in evicted:
+            logger.info(f"evicting {victim.key.descriptor} to admit queued entries")
+            self.retire(victim)
+        for entry, scripts in launches:
+            self.launch(entry, scripts)
 
-        background_thread = Thread(
-            target=process_backend.launch,
-            args=(env.cellxgene_location, scripts, entry),
-        )
-        background_thread.start()
+    def queue_position(self, entry):
+        # entries waiting for admission are behind those waiting to start
+        with self.lock:
+            for position, (queued, _) in enumerate(self.admission_queue, 1):
+                if queued is entry:
+                    return len(self.scheduler) + position
+        return self.scheduler.position(entry)
 
-        self.entry_list.append(entry)
+    def dequeue(self, entry):
+        # must be called with self.lock held
+        self.scheduler.cancel(entry)
+        for queued in self.admission_queue:
+            if queued[0] is entry:
+                self.admission_queue.remove(queued)
+                break
 
-        time.sleep(1)  # Automatic refresh is too fast, needs a second to pause
+    @contextmanager
+    def key_lock(self, key: CacheKey):
+        # one lock per dataset, so that launches of different datasets don't
+        # wait on each other; dropped again once nobody holds or waits for it
+        identity = key.identity
+        with self.lock:
+            holder = self.key_locks.setdefault(identity, [Lock(), 0])
+            holder[1] += 1
+        try:
+            with holder[0]:
+                yield
+        finally:
+            with self.lock:
+                holder[1] -= 1
+                if holder[1] == 0:
+                    del self.key_locks[identity]
 
-        return entry
+    def get_or_create_entry(self, key: CacheKey, scripts: List[str], warm=False):
+        match = self.check_entry(key)
+        if match is not None and (not self.sync(match) or self.expire_failure(match)):
+            match = None
+        if match is None:
+            with self.key_lock(key):
+                match = self.check_entry(key)
+                if match is None:
+                    match = self.create_entry(key, scripts, warm)
+        return match
+
+    def terminate(self, entry):
+        # terminated entries stay listed until pruned, but are no longer matched
+        with self.lock:
+            self.dequeue(entry)
+            if self._index is not None:
+                self._index.remove(entry)
+        self.retire(entry)
+        self.admit_queued()
+
+    def remove(self, entry):
+        # must be called with self.lock held
+        self.entry_list.remove(entry)
+        self.dequeue(entry)
+        if self._index is not None:
+            self._index.remove(entry)
+
+    def retire(self, entry):
+        # returns at once; the port is released when the backend has exited
+        return self.terminator.submit(entry, self.release_port)
+
+    def release_port(self, entry):
+        self.port_allocator.release(entry.port, entry)
 
     def prune(self, process):
-        self.entry_list.remove(process)
-        process.terminate()
+        with self.lock:
+            self.remove(process)
+        self.retire(process)
+        self.admit_queued()
@@ -8,26 +8,54 @@
 # the specific language governing permissions and limitations under the License.
 import datetime
 import logging
+import os
 import re
+import signal
 from enum import Enum
+from http import HTTPStatus
+from threading import Lock
 
 import psutil
 from flask import make_response, render_template, request
 from flask.wrappers import Response
-from requests import get, post, put
+from requests import Session
+from requests.adapters import HTTPAdapter
 
 from cellxgene_gateway import env
 from cellxgene_gateway.cellxgene_exception import CellxgeneException
+from cellxgene_gateway.compression import compress_response, upstream_accept_encoding
 from cellxgene_gateway.flask_util import querystring
+from cellxgene_gateway.log_pump import OutputBuffer
 from cellxgene_gateway.util import current_time_stamp
 
 logger = logging.getLogger(__name__)
 
 
+def raise_body_too_large(max_bytes):
+    raise CellxgeneException(
+        f"Request body exceeds the maximum of {max_bytes} bytes",
+        HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+    )
+
+
+def stream_body(stream, chunk_size, max_bytes):
+    received = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        received += len(chunk)
+        if max_bytes and received > max_bytes:
+            raise_body_too_large(max_bytes)
+        yield chunk
+
+
 class CacheEntryStatus(Enum):
     loaded = "loaded"
     loading = "loading"
+    queued = "queued"
     error = "error"
+    terminating = "terminating"
     terminated = "terminated"
 
 
@@ -45,6 +73,14 @@ class CacheEntry:
         stderr,
         http_status,
     ):
+        self.on_status = None
+        self.claim = None
+        # started once the backend is ready, or failed or was stopped before
+        self.started = False
+        self.start_listeners = []
+        self.start_lock = Lock()
+        self.launch_queued_at = None
+        self.launch_wait_seconds = None
         self.pid = pid
         self.key = key
         self.port = port
@@ -52,9 +88,25 @@ class CacheEntry:
         self.timestamp = timestamp
         self.status = status
         self.message = message
+        self.output = OutputBuffer()
+        self.error_output = OutputBuffer()
         self.all_output = all_output
         self.stderr = stderr
         self.http_status = http_status
+        self.session = None
+        self.session_lock = Lock()
+        self.hits = 0
+        # launched by the warm pool rather than by a user
+        self.warm = False
+        # one of several backends serving the same dataset, see BackendCache.route
+        self.replica = 0
+        self.in_flight = 0
+        self.last_activity = None
+        self.activity_lock = Lock()
+        self.loaded_at = None
+        self.time_to_ready = None
+        self.memory_bytes = None
+        self.memory_sampled_at = None
 
     @classmethod
     def for_key(cls, key, port):
@@ -71,12 +123,64 @@ class CacheEntry:
             None,
         )
 
+    @property
+    def status(self):
+        return self._status
+
+    @status.setter
+    def status(self, status):
+        self.set_status(status)
+
+    def set_status(self, status, notify=True):
+        self._status = status
+        if status not in [CacheEntryStatus.loading, CacheEntryStatus.queued]:
+            self.set_started()
+        if notify and self.on_status is not None:
+            self.on_status(self)
+
+    def set_started(self):
+        with self.start_lock:
+            if self.started:
+                return
+            self.started = True
+        for listener in self.start_listeners:
+            listener(self)
+
     @property
     def source_name(self):
         return self.key.source_name
 
+    @property
+    def load_seconds(self):
+        if self.loaded_at is None:
+            return None
+        return self.loaded_at - self.launchtime
+
+    @property
+    def last_used(self):
+        # the later of the last view and the last byte proxied for any request
+        if self.last_activity is None or self.last_activity < self.timestamp:
+            return self.timestamp
+        return self.last_activity
+
+    def begin_request(self):
+        with self.activity_lock:
+            self.in_flight += 1
+            self.last_activity = current_time_stamp()
+        finished = []
+
+        def end_request():
+            with self.activity_lock:
+                if len(finished) == 0:
+                    finished.append(True)
+                    self.in_flight -= 1
+                    self.last_activity = current_time_stamp()
+
+        return end_request
+
     def set_loaded(self, pid):
         self.pid = pid
+        self.loaded_at = current_time_stamp()
         self.status = CacheEntryStatus.loaded
 
     def set_error(self, message, stderr, http_status):
@@ -85,35 +189,101 @@ class CacheEntry:
         self.http_status = http_status
         self.status = CacheEntryStatus.error
 
+    @property
+    def all_output(self):
+        return self.output.text()
+
+    @all_output.setter
+    def all_output(self, all_output):
+        self.output.clear()
+        if all_output is not None:
+            self.output.append(all_output)
+
+    @property
+    def stderr(self):
+        return self.error_output.text()
+
+    @stderr.setter
+    def stderr(self, stderr):
+        self.error_output.clear()
+        if stderr is not None:
+            self.error_output.append(stderr)
+
     def append_output(self, output):
-        if self.all_output == None:
-            self.all_output = output
-        else:
-            self.all_output += output
+        self.output.append(output)
 
     def terminate(self):
+        # only signals the backend, wait_terminated waits for it to exit
         pid = self.pid
-        if pid != None and self.status != CacheEntryStatus.terminated:
-            terminated = []
-
-            def on_terminate(p):
-                terminated.append(p.pid)
-
-            p = psutil.Process(pid)
-            children = p.children()
-            for child in children:
-                child.terminate()
-            psutil.wait_procs(children, callback=on_terminate)
-            # the parent process may automatically die once its children have --
+        if pid != None and self.status not in [
+            CacheEntryStatus.terminating,
+            CacheEntryStatus.terminated,
+        ]:
+            # the backend leads its own process group, see SubprocessBackend
             try:
-                p.terminate()
-                psutil.wait_procs([p], callback=on_terminate)
-            except psutil.NoSuchProcess:
-                pass
+                os.killpg(pid, signal.SIGTERM)
+                self.status = CacheEntryStatus.terminating
+            except ProcessLookupError:
+                self.status = CacheEntryStatus.terminated
+        elif self.status != CacheEntryStatus.terminating:
+            self.status = CacheEntryStatus.terminated
+        self.close_session()
 
-            logger.info(f"terminated {terminated}")
+    def wait_terminated(self, grace_seconds):
+        pid = self.pid
+        if self.status != CacheEntryStatus.terminating:
+            return
+        try:
+            process = psutil.Process(pid)
+            try:
+                process.wait(grace_seconds)
+            except psutil.TimeoutExpired:
+                logger.warning(f"{pid} still running after {grace_seconds}s, killing")
+                os.killpg(pid, signal.SIGKILL)
+                process.wait()
+        except (ProcessLookupError, psutil.NoSuchProcess):
+            pass
+        logger.info(f"terminated {pid}")
         self.status = CacheEntryStatus.terminated
 
+    def http_session(self):
+        # one keep-alive connection pool per backend, so that the many small
+        # api calls made by the cellxgene client reuse their tcp connections
+        with self.session_lock:
+            if self.session is None:
+                session = Session()
+                session.mount(
+                    "http://",
+                    HTTPAdapter(pool_connections=1, pool_maxsize=env.backend_pool_size),
+                )
+                self.session = session
+            return self.session
+
+    def close_session(self):
+        with self.session_lock:
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+
+    def connection_stats(self):
+        with self.session_lock:
+            session = self.session
+        if session is None:
+            return {"requests": 0, "connections": 0, "reused": 0}
+        pools = session.get_adapter(self.cellxgene_basepath()).poolmanager.pools
+        num_requests = 0
+        num_connections = 0
+        for pool_key in pools.keys():
+            pool = pools.get(pool_key)
+            if pool is not None:
+                num_requests += pool.num_requests
+                num_connections += pool.num_connections
+        return {
+            "requests": num_requests,
+            "connections": num_connections,
+            "reused": max(num_requests - num_connections, 0),
+        }
+
     def rewrite_text_content(self, cellxgene_content):
         # for v0.16.0 compatibility, see issue #24
         gateway_content = (
@@ -130,28 +300,37 @@ class CacheEntry:
     def cellxgene_basepath(self):
         return f"http://127.0.0.1:{self.port}"
 
-    def serve_content(self, path):
+    def serve_content(self, path, queue_position=None):
         gateway_basepath = self.key.gateway_basepath()
         subpath = path[len(self.key.descriptor) :]  # noqa: E203
         if len(subpath) == 0:
             r = make_response(f"Redirect to {gateway_basepath}\n", 302)
             r.headers["location"] = gateway_basepath + querystring()
             return r
-        elif self.status == CacheEntryStatus.loading:
+        elif self.status in [CacheEntryStatus.loading, CacheEntryStatus.queued]:
             launch_time = datetime.datetime.fromtimestamp(self.launchtime)
-            return render_template(
-                "loading.html",
-                launchtime=launch_time,
-                all_output=self.all_output,
+            r = make_response(
+                render_template(
+                    "loading.html",
+                    launchtime=launch_time,
+                    all_output=self.all_output,
+                    queue_position=queue_position,
+                    status=self.status.name,
+                )
             )
+            # polled by the loading page to reload as soon as the backend serves
+            r.headers["x-gateway-status"] = self.status.name
+            r.headers["cache-control"] = "no-store"
+            return r
 
         headers = {}
         copy_headers = [
             "accept",
-            # "accept-encoding" - removed: let requests library handle compression/decompression
+            # "accept-encoding" - negotiated separately, see upstream_accept_encoding
             "accept-language",
             "cache-control",
-            "connection",
+            # "connection" - removed: keep-alive is managed per hop, see http_session
+            "content-encoding",
             "content-length",
             "content-type",
             "cookie",
@@ -166,45 +345,120 @@ class CacheEntry:
         for h in copy_headers:
             if h in request.headers:
                 headers[h] = request.headers[h]
+        if not env.backend_keepalive:
+            headers["connection"] = "close"
+        client_accept_encoding = request.headers.get("accept-encoding", "")
+        if env.enable_compression:
+            headers["accept-encoding"] = upstream_accept_encoding(
+                client_accept_encoding
+            )
+        else:
+            headers["accept-encoding"] = "identity"
 
         full_path = self.cellxgene_basepath() + subpath + querystring()
+        session = self.http_session()
         cellxgene_response = None
+        end_request = self.begin_request()
         try:
+            # always stream from the backend, so that binary bodies can be passed
+            # through without being decoded
             if request.method in ["GET", "HEAD", "OPTIONS"]:
-                cellxgene_response = get(full_path, headers=headers)
+                cellxgene_response = session.get(
+                    full_path, headers=headers, stream=True
+                )
             elif request.method == "PUT":
-                cellxgene_response = put(
+                cellxgene_response = session.put(
                     full_path,
                     headers=headers,
-                    data=request.data,
+                    data=self.request_body(headers),
+                    stream=True,
                 )
             elif request.method == "POST":
-                cellxgene_response = post(
+                cellxgene_response = session.post(
                     full_path,
                     headers=headers,
-                    data=request.data,
+                    data=self.request_body(headers),
+                    stream=True,
                 )
             else:
                 raise CellxgeneException(f"Unexpected method {request.method}", 400)
-            content_type = cellxgene_response.headers["content-type"]
-            if "text" in content_type:
-                gateway_content = self.rewrite_text_content(
-                    cellxgene_response.content.decode()
-                )
-            else:
-                gateway_content = cellxgene_response.content
 
             resp_headers = {}
             for h in copy_headers:
                 if h in cellxgene_response.headers:
                     resp_headers[h] = cellxgene_response.headers[h]
 
-            gateway_response = make_response(
-                gateway_content,
-                cellxgene_response.status_code,
-                resp_headers,
-            )
+            content_type = cellxgene_response.headers.get("content-type", "")
+            if "text" in content_type:
+                # requests decodes the body, and its length changes when rewritten
+                resp_headers.pop("content-encoding", None)
+                resp_headers.pop("content-length", None)
+                gateway_response = compress_response(
+                    make_response(
+                        self.rewrite_text_content(cellxgene_response.content.decode()),
+                        cellxgene_response.status_code,
+                        resp_headers,
+                    ),
+                    client_accept_encoding,
+                    static="/static/" in subpath,
+                )
+            elif env.stream_responses:
+                gateway_response = self.stream_response(
+                    cellxgene_response, resp_headers, end_request
+                )
+                # closed by the gateway response once the body has been sent
+                cellxgene_response = None
+                end_request = None
+            else:
+                gateway_response = make_response(
+                    cellxgene_response.raw.read(decode_content=False),
+                    cellxgene_response.status_code,
+                    resp_headers,
+                )
+            if "content-encoding" in resp_headers:
+                gateway_response.vary.add("Accept-Encoding")
         finally:
             if cellxgene_response is not None:
                 cellxgene_response.close()
+            if end_request is not None:
+                end_request()
+        return gateway_response
+
+    def request_body(self, headers):
+        max_bytes = env.max_request_body_bytes
+        if max_bytes and (request.content_length or 0) > max_bytes:
+            raise_body_too_large(max_bytes)
+        if not env.stream_requests:
+            data = request.data
+            if max_bytes and len(data) > max_bytes:
+                raise_body_too_large(max_bytes)
+            return data
+
+        # a generator body makes requests use chunked transfer encoding, so the
+        # client's content-length must not be forwarded alongside it
+        headers.pop("content-length", None)
+        return stream_body(request.stream, env.stream_chunk_size, max_bytes)
+
+    def stream_response(self, cellxgene_response, resp_headers, end_request=None):
+        def generate():
+            try:
+                # compressed bodies are passed through untouched
+                for chunk in cellxgene_response.raw.stream(
+                    env.stream_chunk_size, decode_content=False
+                ):
+                    self.last_activity = current_time_stamp()
+                    yield chunk
+            finally:
+                cellxgene_response.close()
+
+        gateway_response = Response(
+            generate(),
+            status=cellxgene_response.status_code,
+            headers=resp_headers,
+            direct_passthrough=True,
+        )
+        # also release the connection if the body is never iterated, e.g. for HEAD
+        gateway_response.call_on_close(cellxgene_response.close)
+        if end_request is not None:
+            gateway_response.call_on_close(end_request)
         return gateway_response
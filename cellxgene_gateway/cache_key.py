@@ -60,13 +60,17 @@ class CacheKey:
         else:
             return self.annotation_item.descriptor
 
-    def equals(self, other):
+    @property
+    def identity(self):
         return (
-            (self.source.name == other.source.name)
-            and (self.h5ad_item.descriptor == other.h5ad_item.descriptor)
-            and (self.annotation_descriptor == other.annotation_descriptor)
+            self.source.name,
+            self.h5ad_item.descriptor,
+            self.annotation_descriptor,
         )
 
+    def equals(self, other):
+        return self.identity == other.identity
+
     def __init__(
         self, h5ad_item: Item, source: ItemSource, annotation_item: Item = None
     ):
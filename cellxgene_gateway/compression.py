@@ -0,0 +1,142 @@
+# Copyright 2019 Novartis Institutes for BioMedical Research Inc. Licensed
+# under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at http://www.apache.org/licenses/LICENSE-2.0. Unless
+# required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+import gzip
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+
+from cellxgene_gateway import env
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# cached static assets are compressed once, so they can afford a higher level
+gzip_level = 6
+gzip_static_level = 9
+brotli_quality = 4
+brotli_static_quality = 9
+
+
+def supported_encodings():
+    if brotli is None:
+        return ["gzip"]
+    else:
+        return ["br", "gzip"]
+
+
+def decodable_encodings():
+    # encodings that the requests library can decode for the text rewrite path
+    return supported_encodings() + ["deflate"]
+
+
+def parse_accept_encoding(accept_encoding):
+    qualities = {}
+    for part in (accept_encoding or "").split(","):
+        fields = part.strip().split(";")
+        coding = fields[0].strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in fields[1:]:
+            name, _, value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+    return qualities
+
+
+def accepts(qualities, coding):
+    return qualities.get(coding, qualities.get("*", 0.0)) > 0
+
+
+def choose_encoding(accept_encoding):
+    qualities = parse_accept_encoding(accept_encoding)
+    candidates = [c for c in supported_encodings() if accepts(qualities, c)]
+    if len(candidates) == 0:
+        return None
+    # supported_encodings is in order of preference, which breaks ties
+    return max(candidates, key=lambda c: qualities.get(c, qualities.get("*", 0.0)))
+
+
+def upstream_accept_encoding(accept_encoding):
+    qualities = parse_accept_encoding(accept_encoding)
+    codings = [c for c in decodable_encodings() if accepts(qualities, c)]
+    return ", ".join(codings) if len(codings) > 0 else "identity"
+
+
+def compress(body, encoding, static=False):
+    if encoding == "gzip":
+        return gzip.compress(body, gzip_static_level if static else gzip_level)
+    elif encoding == "br" and brotli is not None:
+        return brotli.compress(
+            body, quality=brotli_static_quality if static else brotli_quality
+        )
+    else:
+        raise ValueError(f"Unsupported encoding {encoding}")
+
+
+class CompressionCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def compress(self, body, encoding):
+        # keyed on the content itself, so a rewritten asset never serves stale data
+        cache_key = (encoding, hashlib.sha1(body).digest())
+        with self.lock:
+            compressed = self.entries.get(cache_key)
+            if compressed is not None:
+                self.entries.move_to_end(cache_key)
+                self.hits += 1
+                return compressed
+            self.misses += 1
+
+        compressed = compress(body, encoding, static=True)
+        if len(compressed) > self.max_bytes:
+            return compressed
+
+        with self.lock:
+            if cache_key not in self.entries:
+                self.entries[cache_key] = compressed
+                self.size += len(compressed)
+                while self.size > self.max_bytes:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.size -= len(evicted)
+        return compressed
+
+
+compression_cache = CompressionCache(env.compression_cache_bytes)
+
+
+def compress_response(response, accept_encoding, static=False):
+    response.vary.add("Accept-Encoding")
+    if not env.enable_compression or "content-encoding" in response.headers:
+        return response
+    encoding = choose_encoding(accept_encoding)
+    body = response.get_data()
+    if encoding is None or len(body) < env.compression_min_bytes:
+        return response
+
+    if static:
+        compressed = compression_cache.compress(body, encoding)
+    else:
+        compressed = compress(body, encoding)
+    response.set_data(compressed)
+    response.headers["content-encoding"] = encoding
+    return response
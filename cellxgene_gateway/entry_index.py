@@ -0,0 +1,104 @@
+# Copyright 2019 Novartis Institutes for BioMedical Research Inc. Licensed
+# under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at http://www.apache.org/licenses/LICENSE-2.0. Unless
+# required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+# Lookup structures for BackendCache, so that finding the entry for a request
+# does not depend on the number of entries in the cache:
+# * by key: a dict keyed on (source name, dataset, annotation)
+# * by path: a character trie of descriptors per source, walked along the
+#   requested path to find every descriptor that is a prefix of it
+
+_values = None  # trie node key holding the values stored at that node
+
+
+class DescriptorTrie:
+    def __init__(self):
+        self.root = {}
+
+    def __len__(self):
+        return len(self.root)
+
+    def add(self, descriptor, value):
+        node = self.root
+        for char in descriptor:
+            node = node.setdefault(char, {})
+        node.setdefault(_values, []).append(value)
+
+    def remove(self, descriptor, value):
+        path = [self.root]
+        for char in descriptor:
+            node = path[-1].get(char)
+            if node is None:
+                return
+            path.append(node)
+        values = path[-1].get(_values, [])
+        if value in values:
+            values.remove(value)
+        if len(values) == 0:
+            path[-1].pop(_values, None)
+        # drop nodes that no longer lead to any value
+        for depth in range(len(descriptor), 0, -1):
+            if len(path[depth]) > 0:
+                break
+            del path[depth - 1][descriptor[depth - 1]]
+
+    def prefixes_of(self, path):
+        matches = list(self.root.get(_values, []))
+        node = self.root
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                break
+            matches.extend(node.get(_values, []))
+        return matches
+
+
+class EntryIndex:
+    def __init__(self, entries=()):
+        self.by_key = {}
+        self.by_source = {}
+        self.indexed = {}
+        for entry in entries:
+            self.add(entry)
+
+    def __contains__(self, entry):
+        return entry in self.indexed
+
+    def add(self, entry):
+        if entry in self.indexed:
+            return
+        key = entry.key
+        identity = key.identity
+        source_name = key.source.name
+        descriptor = key.descriptor
+        self.indexed[entry] = (identity, source_name, descriptor)
+        self.by_key.setdefault(identity, []).append(entry)
+        self.by_source.setdefault(source_name, DescriptorTrie()).add(descriptor, entry)
+
+    def remove(self, entry):
+        indexed = self.indexed.pop(entry, None)
+        if indexed is None:
+            return
+        identity, source_name, descriptor = indexed
+        matches = self.by_key[identity]
+        matches.remove(entry)
+        if len(matches) == 0:
+            del self.by_key[identity]
+        trie = self.by_source[source_name]
+        trie.remove(descriptor, entry)
+        if len(trie) == 0:
+            del self.by_source[source_name]
+
+    def matching_key(self, key):
+        return list(self.by_key.get(key.identity, []))
+
+    def matching_path(self, source_name, path):
+        trie = self.by_source.get(source_name)
+        if trie is None:
+            return []
+        return trie.prefixes_of(path)
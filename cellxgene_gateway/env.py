@@ -35,6 +35,79 @@ enable_backed_mode = os.environ.get("GATEWAY_ENABLE_BACKED_MODE", "").lower() in
     "1",
 ]
 log_level = logging.getLevelName(os.environ.get("GATEWAY_LOG_LEVEL", "INFO"))
+backend_pool_size = int(os.environ.get("GATEWAY_BACKEND_POOL_SIZE", "10"))
+backend_keepalive = os.environ.get("GATEWAY_BACKEND_KEEPALIVE", "true").lower() in [
+    "true",
+    "1",
+]
+stream_responses = os.environ.get("GATEWAY_STREAM_RESPONSES", "true").lower() in [
+    "true",
+    "1",
+]
+stream_chunk_size = int(os.environ.get("GATEWAY_STREAM_CHUNK_SIZE", "65536"))
+stream_requests = os.environ.get("GATEWAY_STREAM_REQUESTS", "true").lower() in [
+    "true",
+    "1",
+]
+max_request_body_bytes = int(os.environ.get("GATEWAY_MAX_REQUEST_BODY_BYTES", "0"))
+enable_compression = os.environ.get("GATEWAY_ENABLE_COMPRESSION", "true").lower() in [
+    "true",
+    "1",
+]
+compression_min_bytes = int(os.environ.get("GATEWAY_COMPRESSION_MIN_BYTES", "1024"))
+compression_cache_bytes = int(
+    os.environ.get("GATEWAY_COMPRESSION_CACHE_BYTES", str(64 * 1024 * 1024))
+)
+port_range_start = int(os.environ.get("GATEWAY_PORT_RANGE_START", "8000"))
+port_range_end = int(os.environ.get("GATEWAY_PORT_RANGE_END", "8999"))
+port_retries = int(os.environ.get("GATEWAY_PORT_RETRIES", "5"))
+max_backends = int(os.environ.get("GATEWAY_MAX_BACKENDS", "0"))
+evict_min_idle_seconds = int(os.environ.get("GATEWAY_EVICT_MIN_IDLE_SECONDS", "60"))
+memory_sample_seconds = int(os.environ.get("GATEWAY_MEMORY_SAMPLE_SECONDS", "30"))
+memory_budget_bytes = int(os.environ.get("GATEWAY_MEMORY_BUDGET_BYTES", "0"))
+memory_high_watermark = float(os.environ.get("GATEWAY_MEMORY_HIGH_WATERMARK", "0.9"))
+memory_use_cgroup = os.environ.get("GATEWAY_MEMORY_USE_CGROUP", "true").lower() in [
+    "true",
+    "1",
+]
+output_buffer_lines = int(os.environ.get("GATEWAY_OUTPUT_BUFFER_LINES", "1000"))
+backend_log_dir = os.environ.get("GATEWAY_BACKEND_LOG_DIR", None)
+backend_log_bytes = int(
+    os.environ.get("GATEWAY_BACKEND_LOG_BYTES", str(10 * 1024 * 1024))
+)
+backend_log_backups = int(os.environ.get("GATEWAY_BACKEND_LOG_BACKUPS", "3"))
+launch_timeout_seconds = int(os.environ.get("GATEWAY_LAUNCH_TIMEOUT_SECONDS", "300"))
+readiness_path = os.environ.get("GATEWAY_READINESS_PATH", "/health")
+termination_grace_seconds = int(
+    os.environ.get("GATEWAY_TERMINATION_GRACE_SECONDS", "10")
+)
+termination_workers = int(os.environ.get("GATEWAY_TERMINATION_WORKERS", "8"))
+max_lifetime_seconds = int(os.environ.get("GATEWAY_MAX_LIFETIME_SECONDS", "0"))
+registry_path = os.environ.get("GATEWAY_REGISTRY_PATH", None)
+warm_datasets = os.environ.get("GATEWAY_WARM_DATASETS", None)
+warm_top_n = int(os.environ.get("GATEWAY_WARM_TOP_N", "0"))
+warm_schedule = os.environ.get("GATEWAY_WARM_SCHEDULE", None)
+max_parallel_launches = int(os.environ.get("GATEWAY_MAX_PARALLEL_LAUNCHES", "4"))
+launch_order = os.environ.get("GATEWAY_LAUNCH_ORDER", "fifo")
+health_check_seconds = int(os.environ.get("GATEWAY_HEALTH_CHECK_SECONDS", "15"))
+health_check_failures = int(os.environ.get("GATEWAY_HEALTH_CHECK_FAILURES", "3"))
+health_relaunch = os.environ.get("GATEWAY_HEALTH_RELAUNCH", "true").lower() in [
+    "true",
+    "1",
+]
+failure_backoff_seconds = int(os.environ.get("GATEWAY_FAILURE_BACKOFF_SECONDS", "60"))
+failure_backoff_max_seconds = int(
+    os.environ.get("GATEWAY_FAILURE_BACKOFF_MAX_SECONDS", "3600")
+)
+launcher = os.environ.get("GATEWAY_LAUNCHER", "subprocess")
+zygote_python = os.environ.get("GATEWAY_ZYGOTE_PYTHON", None)
+zygote_entry_point = os.environ.get("GATEWAY_ZYGOTE_ENTRY_POINT", "cellxgene")
+zygote_preload = os.environ.get(
+    "GATEWAY_ZYGOTE_PRELOAD", "numpy,pandas,scipy,anndata,scanpy,flask"
+)
+replicas = int(os.environ.get("GATEWAY_REPLICAS", "1"))
+max_replicas = int(os.environ.get("GATEWAY_MAX_REPLICAS", "1"))
+replica_in_flight = int(os.environ.get("GATEWAY_REPLICA_IN_FLIGHT", "4"))
 
 env_vars = {
     "CELLXGENE_LOCATION": cellxgene_location,
@@ -56,6 +129,51 @@ optional_env_vars = {
     "GATEWAY_ENABLE_ANNOTATIONS": enable_annotations,
     "GATEWAY_ENABLE_BACKED_MODE": enable_backed_mode,
     "GATEWAY_LOG_LEVEL": log_level,
+    "GATEWAY_BACKEND_POOL_SIZE": backend_pool_size,
+    "GATEWAY_BACKEND_KEEPALIVE": backend_keepalive,
+    "GATEWAY_STREAM_RESPONSES": stream_responses,
+    "GATEWAY_STREAM_CHUNK_SIZE": stream_chunk_size,
+    "GATEWAY_STREAM_REQUESTS": stream_requests,
+    "GATEWAY_MAX_REQUEST_BODY_BYTES": max_request_body_bytes,
+    "GATEWAY_ENABLE_COMPRESSION": enable_compression,
+    "GATEWAY_COMPRESSION_MIN_BYTES": compression_min_bytes,
+    "GATEWAY_COMPRESSION_CACHE_BYTES": compression_cache_bytes,
+    "GATEWAY_PORT_RANGE_START": port_range_start,
+    "GATEWAY_PORT_RANGE_END": port_range_end,
+    "GATEWAY_PORT_RETRIES": port_retries,
+    "GATEWAY_MAX_BACKENDS": max_backends,
+    "GATEWAY_EVICT_MIN_IDLE_SECONDS": evict_min_idle_seconds,
+    "GATEWAY_MEMORY_SAMPLE_SECONDS": memory_sample_seconds,
+    "GATEWAY_MEMORY_BUDGET_BYTES": memory_budget_bytes,
+    "GATEWAY_MEMORY_HIGH_WATERMARK": memory_high_watermark,
+    "GATEWAY_MEMORY_USE_CGROUP": memory_use_cgroup,
+    "GATEWAY_OUTPUT_BUFFER_LINES": output_buffer_lines,
+    "GATEWAY_BACKEND_LOG_DIR": backend_log_dir,
+    "GATEWAY_BACKEND_LOG_BYTES": backend_log_bytes,
+    "GATEWAY_BACKEND_LOG_BACKUPS": backend_log_backups,
+    "GATEWAY_LAUNCH_TIMEOUT_SECONDS": launch_timeout_seconds,
+    "GATEWAY_READINESS_PATH": readiness_path,
+    "GATEWAY_TERMINATION_GRACE_SECONDS": termination_grace_seconds,
+    "GATEWAY_TERMINATION_WORKERS": termination_workers,
+    "GATEWAY_MAX_LIFETIME_SECONDS": max_lifetime_seconds,
+    "GATEWAY_REGISTRY_PATH": registry_path,
+    "GATEWAY_WARM_DATASETS": warm_datasets,
+    "GATEWAY_WARM_TOP_N": warm_top_n,
+    "GATEWAY_WARM_SCHEDULE": warm_schedule,
+    "GATEWAY_MAX_PARALLEL_LAUNCHES": max_parallel_launches,
+    "GATEWAY_LAUNCH_ORDER": launch_order,
+    "GATEWAY_HEALTH_CHECK_SECONDS": health_check_seconds,
+    "GATEWAY_HEALTH_CHECK_FAILURES": health_check_failures,
+    "GATEWAY_HEALTH_RELAUNCH": health_relaunch,
+    "GATEWAY_FAILURE_BACKOFF_SECONDS": failure_backoff_seconds,
+    "GATEWAY_FAILURE_BACKOFF_MAX_SECONDS": failure_backoff_max_seconds,
+    "GATEWAY_LAUNCHER": launcher,
+    "GATEWAY_ZYGOTE_PYTHON": zygote_python,
+    "GATEWAY_ZYGOTE_ENTRY_POINT": zygote_entry_point,
+    "GATEWAY_ZYGOTE_PRELOAD": zygote_preload,
+    "GATEWAY_REPLICAS": replicas,
+    "GATEWAY_MAX_REPLICAS": max_replicas,
+    "GATEWAY_REPLICA_IN_FLIGHT": replica_in_flight,
     "CELLXGENE_ARGS": cellxgene_args,
     "CELLXGENE_DATA": cellxgene_data,
     "PROXY_FIX_FOR": proxy_fix_for,
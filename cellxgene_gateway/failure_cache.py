@@ -0,0 +1,135 @@
+# Copyright 2019 Novartis Institutes for BioMedical Research Inc. Licensed
+# under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at http://www.apache.org/licenses/LICENSE-2.0. Unless
+# required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+import logging
+import os
+from collections import OrderedDict
+from threading import Lock
+
+from cellxgene_gateway import env
+from cellxgene_gateway.cache_entry import CacheEntryStatus
+from cellxgene_gateway.util import current_time_stamp
+
+logger = logging.getLogger(__name__)
+
+# datasets whose failures are remembered, the oldest are forgotten first
+max_failures = 1000
+
+
+def fingerprint(key):
+    # changes when the dataset is replaced; None if it is not a local file
+    try:
+        stat = os.stat(key.file_path)
+        return (stat.st_mtime, stat.st_size)
+    except (OSError, ValueError):
+        return None
+
+
+class Failure:
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.count = 0
+        self.retry_at = None
+        self.message = None
+        self.all_output = None
+        self.stderr = None
+        self.http_status = None
+
+    def record(self, entry):
+        self.count += 1
+        backoff = min(
+            env.failure_backoff_seconds * 2 ** (self.count - 1),
+            env.failure_backoff_max_seconds,
+        )
+        self.retry_at = current_time_stamp() + backoff
+        self.message = entry.message
+        self.all_output = entry.all_output
+        self.stderr = entry.stderr
+        self.http_status = entry.http_status
+
+    @property
+    def is_open(self):
+        return current_time_stamp() < self.retry_at
+
+    def apply(self, entry):
+        entry.all_output = self.all_output
+        entry.set_error(self.message, self.stderr, self.http_status)
+
+
+class FailureCache:
+    """Remembers datasets that failed to launch, so that they are not launched
+    again until their file changes or their backoff is over.
+
+    Each failure in a row doubles the backoff. While it runs, the circuit is
+    open and the error is served without launching cellxgene; once it is over,
+    the circuit is half open and the next request launches the dataset. A
+    launch that succeeds closes the circuit again.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.failures = OrderedDict()
+
+    def launch_finished(self, entry):
+        if entry.status == CacheEntryStatus.error:
+            self.record(entry)
+        elif entry.status == CacheEntryStatus.loaded:
+            with self.lock:
+                self.failures.pop(entry.key.identity, None)
+
+    def record(self, entry):
+        identity = entry.key.identity
+        current = fingerprint(entry.key)
+        with self.lock:
+            failure = self.failures.pop(identity, None)
+            if failure is None or failure.fingerprint != current:
+                failure = Failure(current)
+            failure.record(entry)
+            self.failures[identity] = failure
+            while len(self.failures) > max_failures:
+                self.failures.popitem(last=False)
+        logger.warning(
+            f"{entry.key.descriptor} failed to launch {failure.count} times in a row, not retrying before {failure.retry_at:.0f}"
+        )
+
+    def open_failure(self, key):
+        # the failure to serve instead of launching key, if its circuit is open
+        with self.lock:
+            failure = self.failures.get(key.identity)
+        if failure is None or not failure.is_open:
+            return None
+        if failure.fingerprint != fingerprint(key):
+            with self.lock:
+                self.failures.pop(key.identity, None)
+            return None
+        return failure
+
+    def may_retry(self, key):
+        # whether key failed to launch, but may be launched again now
+        with self.lock:
+            failure = self.failures.get(key.identity)
+        return failure is not None and (
+            not failure.is_open or failure.fingerprint != fingerprint(key)
+        )
+
+    def status(self):
+        with self.lock:
+            failures = list(self.failures.items())
+        return [
+            {
+                "source_name": source_name,
+                "dataset": dataset,
+                "annotation_file": annotation,
+                "failures": failure.count,
+                "state": "open" if failure.is_open else "half_open",
+                "retry_at": failure.retry_at,
+                "message": failure.message,
+            }
+            for (source_name, dataset, annotation), failure in failures
+        ]
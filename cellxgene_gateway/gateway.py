@@ -31,13 +31,18 @@ from cellxgene_gateway.cache_key import CacheKey
 from cellxgene_gateway.cellxgene_exception import CellxgeneException
 from cellxgene_gateway.extra_scripts import get_extra_scripts
 from cellxgene_gateway.filecrawl import render_item_source
+from cellxgene_gateway.health_checker import HealthChecker
+from cellxgene_gateway.memory_sampler import MemorySampler
 from cellxgene_gateway.process_exception import ProcessException
 from cellxgene_gateway.prune_process_cache import PruneProcessCache
+from cellxgene_gateway.registry import Registry
 from cellxgene_gateway.util import current_time_stamp
+from cellxgene_gateway.warm_pool import AccessHistory, WarmPool
 
 app = Flask(__name__)
 
 item_sources = []
+item_sources_by_name = {}
 default_item_source = None
 
 # Guard for lazy initialization so tests can import this module without
@@ -111,6 +116,7 @@ def _init_on_first_wsgi_request(wsgi_app):
                         default_item_source = item_sources[0]
 
                     data_sources_initialized = True
+                    start_startup_thread()
         return wsgi_app(environ, start_response)
 
     return middleware
@@ -121,7 +127,10 @@ def _init_on_first_wsgi_request(wsgi_app):
 # initialize_data_sources() directly.
 app.wsgi_app = _init_on_first_wsgi_request(app.wsgi_app)
 
-cache = BackendCache()
+cache = BackendCache(Registry(env.registry_path) if env.registry_path else None)
+memory_sampler = MemorySampler(cache)
+health_checker = HealthChecker(cache)
+access_history = AccessHistory(cache.registry)
 
 
 # Initialize data sources - this is defined later in the file but called here
@@ -145,7 +154,7 @@ def initialize_data_sources():
         from cellxgene_gateway.items.s3.s3item_source import S3ItemSource
 
         s3_source = S3ItemSource(cellxgene_bucket, name="s3")
-        item_sources.append(s3_source)
+        add_item_source(s3_source)
         default_item_source = s3_source
         logger.info("Initialized S3 data source")
         logger.debug(f"S3 bucket: {cellxgene_bucket}")
@@ -153,7 +162,7 @@ def initialize_data_sources():
         from cellxgene_gateway.items.file.fileitem_source import FileItemSource
 
         file_source = FileItemSource(cellxgene_data, name="local")
-        item_sources.append(file_source)
+        add_item_source(file_source)
         default_item_source = file_source
         logger.info("Initialized local file data source")
         logger.debug(f"Data directory: {cellxgene_data}")
@@ -162,6 +171,13 @@ def initialize_data_sources():
     flask_util.include_source_in_url = len(item_sources) > 1
 
 
+def add_item_source(item_source):
+    if item_source.name in item_sources_by_name:
+        raise Exception(f"Duplicate item source name {item_source.name}")
+    item_sources.append(item_source)
+    item_sources_by_name[item_source.name] = item_source
+
+
 @app.errorhandler(CellxgeneException)
 def handle_invalid_usage(error):
     message = f"{error.http_status} Error : {error.message}"
@@ -249,19 +265,25 @@ def filecrawl(path=None):
     return resp
 
 
-entry_lock = Lock()
-
-
 def matching_source(source_name):
     if source_name is None and default_item_source is not None:
         source_name = default_item_source.name
-    matching = [i for i in item_sources if i.name == source_name]
-    if len(matching) != 1:
+    source = item_sources_by_name.get(source_name)
+    if source is None:
         raise Exception(f"Could not find matching item source {source_name}")
-    source = matching[0]
     return source
 
 
+replica_cookie = "cxg_gateway_replica"
+
+
+def affinity(cookie):
+    try:
+        return int(cookie)
+    except (TypeError, ValueError):
+        return None
+
+
 @app.route(
     "/source/<path:source_name>/view/<path:path>",
     methods=["GET", "PUT", "POST"],
@@ -270,6 +292,10 @@ def matching_source(source_name):
 def do_view(path, source_name=None):
     source = matching_source(source_name)
     match = cache.check_path(source, path)
+    if match is not None and (
+        not cache.sync(match, touch=True) or cache.expire_failure(match)
+    ):
+        match = None
 
     if match is None:
         lookup = source.lookup(path)
@@ -282,20 +308,38 @@ def do_view(path, source_name=None):
         print(
             f"view path={path}, source_name={source_name}, dataset={key.file_path}, annotation_file= {key.annotation_file_path}, key={key.descriptor}, source={key.source_name}"
         )
-        with entry_lock:
-            match = cache.check_entry(key)
-            if match is None:
-                uascripts = get_extra_scripts()
-                match = cache.create_entry(key, uascripts)
+        match = cache.get_or_create_entry(key, get_extra_scripts())
+    match = cache.route(
+        match, get_extra_scripts(), affinity(request.cookies.get(replica_cookie))
+    )
 
     match.timestamp = current_time_stamp()
-
-    if (
-        match.status == CacheEntryStatus.loaded
-        or match.status == CacheEntryStatus.loading
-    ):
+    if request.method != "HEAD":
+        match.hits += 1
+    if request.method == "GET" and path.rstrip("/") == match.key.descriptor:
+        access_history.record(match.key)
+    if match.status == CacheEntryStatus.queued:
+        cache.admit_queued()
+
+    if match.status in [
+        CacheEntryStatus.loaded,
+        CacheEntryStatus.loading,
+        CacheEntryStatus.queued,
+    ]:
         if source.is_authorized(match.key.descriptor):
-            return match.serve_content(path)
+            response = match.serve_content(
+                path, queue_position=cache.queue_position(match)
+            )
+            if request.method == "PUT" and max(env.replicas, env.max_replicas) > 1:
+                # annotations are written by one replica, so the client sticks
+                # to it for its later requests to this dataset
+                response.set_cookie(
+                    replica_cookie,
+                    str(match.replica),
+                    path=match.key.gateway_basepath(),
+                    httponly=True,
+                )
+            return response
         else:
             raise CellxgeneException("User not authorized to access this data", 403)
     elif match.status == CacheEntryStatus.error:
@@ -312,6 +356,7 @@ def do_GET_status():
     return render_template(
         "cache_status.html",
         entry_list=cache.entry_list,
+        failures=cache.failures.status(),
         extra_scripts=get_extra_scripts(),
     )
 
@@ -326,12 +371,28 @@ def do_GET_status_json():
             "annotation_file": annotation_file,
             "launchtime": entry.launchtime,
             "last_access": entry.timestamp,
+            "last_activity": entry.last_activity,
+            "in_flight": entry.in_flight,
             "status": entry.status.name,
+            "connections": entry.connection_stats(),
+            "hits": entry.hits,
+            "time_to_ready": entry.time_to_ready,
+            "load_seconds": entry.load_seconds,
+            "memory_bytes": entry.memory_bytes,
+            "memory_sampled_at": entry.memory_sampled_at,
+            "warm": entry.warm,
+            "launch_wait_seconds": entry.launch_wait_seconds,
+            "replica": entry.replica,
         }
 
     return json.dumps(
         {
             "launchtime": app.extensions.get("cellxgene_gateway", {}).get("launchtime"),
+            "admission_queue": len(cache.admission_queue),
+            "launch_queue": cache.scheduler.status(),
+            "memory": memory_sampler.status(),
+            "warm_pool": warm_pool.status(),
+            "failures": cache.failures.status(),
             "entry_list": [map_entry(entry) for entry in cache.entry_list],
         }
     )
@@ -352,9 +413,8 @@ def get_cache_key(path):
 @app.route("/relaunch/<path:path>", methods=["GET"])
 def do_relaunch(path):
     key = get_cache_key(path)
-    match = cache.check_entry(key)
-    if not match is None:
-        match.terminate()
+    for match in cache.replicas(key):
+        cache.terminate(match)
     return redirect(
         key.view_url,
         code=302,
@@ -364,9 +424,8 @@ def do_relaunch(path):
 @app.route("/terminate/<path:path>", methods=["GET"])
 def do_terminate(path):
     key = get_cache_key(path)
-    match = cache.check_entry(key)
-    if not match is None:
-        match.terminate()
+    for match in cache.replicas(key):
+        cache.terminate(match)
     return redirect(url_for("do_GET_status"), code=302)
 
 
@@ -385,8 +444,59 @@ def start_pruner_thread():
     background_thread.start()
 
 
+def key_for(source_name, descriptor):
+    source = (
+        default_item_source
+        if source_name is None
+        else item_sources_by_name.get(source_name)
+    )
+    if source is None:
+        return None
+    lookup = source.lookup(descriptor)
+    if lookup is None:
+        return None
+    return CacheKey.for_lookup(source, lookup)
+
+
+def key_for_row(row):
+    return key_for(row.source_name, row.annotation or row.dataset)
+
+
+warm_pool = WarmPool(cache, key_for, get_extra_scripts, access_history, memory_sampler)
+
+
+def startup():
+    # backends are recovered first, so that they are not warmed again
+    if cache.registry is not None:
+        try:
+            cache.recover(key_for_row)
+        except Exception:
+            logging.getLogger(__name__).exception("failed to recover backends")
+    if env.warm_datasets or env.warm_top_n > 0:
+        warm_pool()
+
+
+def start_startup_thread():
+    background_thread = Thread(target=startup, daemon=True)
+    background_thread.start()
+
+
+def start_memory_sampler_thread():
+    background_thread = Thread(target=memory_sampler, daemon=True)
+    background_thread.start()
+
+
+def start_health_checker_thread():
+    background_thread = Thread(target=health_checker, daemon=True)
+    background_thread.start()
+
+
 def launch():
     start_pruner_thread()
+    if env.memory_sample_seconds > 0:
+        start_memory_sampler_thread()
+    if env.health_check_seconds > 0:
+        start_health_checker_thread()
 
     app.extensions.setdefault("cellxgene_gateway", {})[
         "launchtime"
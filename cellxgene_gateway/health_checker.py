@@ -0,0 +1,96 @@
+# Copyright 2019 Novartis Institutes for BioMedical Research Inc. Licensed
+# under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at http://www.apache.org/licenses/LICENSE-2.0. Unless
+# required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+import logging
+import os
+import signal
+import time
+from http import HTTPStatus
+
+from cellxgene_gateway import env
+from cellxgene_gateway.cache_entry import CacheEntryStatus
+from cellxgene_gateway.readiness import is_serving
+from cellxgene_gateway.registry import is_alive
+
+logger = logging.getLogger(__name__)
+
+exited = "Cellxgene exited unexpectedly."
+not_responding = "Cellxgene stopped responding."
+
+
+class HealthChecker:
+    """Detects loaded backends that crashed or stopped answering.
+
+    A backend whose process is gone fails at once; one that does not answer
+    the readiness probe fails after health_check_failures checks in a row.
+    Backends with requests in flight are only checked for their process, as
+    a busy cellxgene may be slow to answer. Failed backends are removed, so
+    that the next request launches the dataset again, or are kept with an
+    error if GATEWAY_HEALTH_RELAUNCH is off.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.failures = {}
+
+    def __call__(self):
+        while True:
+            time.sleep(env.health_check_seconds)
+            try:
+                self.check()
+            except Exception:
+                logger.exception("failed to check backend health")
+
+    def check(self):
+        loaded = [
+            entry
+            for entry in list(self.cache.entry_list)
+            if entry.status == CacheEntryStatus.loaded
+        ]
+        # entries that were removed in the meantime are forgotten
+        self.failures = {
+            entry: self.failures[entry] for entry in loaded if entry in self.failures
+        }
+        for entry in loaded:
+            reason = self.probe(entry)
+            if reason is None:
+                self.failures.pop(entry, None)
+            else:
+                self.failures[entry] = self.failures.get(entry, 0) + 1
+                if (
+                    reason == exited
+                    or self.failures[entry] >= env.health_check_failures
+                ):
+                    self.fail(entry, reason)
+
+    def probe(self, entry):
+        # returns why entry is unhealthy, or None
+        if entry.pid is None or not is_alive(entry.pid):
+            return exited
+        if entry.in_flight == 0 and not is_serving(entry.port):
+            return not_responding
+        return None
+
+    def fail(self, entry, reason):
+        logger.warning(f"{reason} {entry.pid} ({entry.key.descriptor})")
+        self.failures.pop(entry, None)
+        if env.health_relaunch:
+            try:
+                self.cache.prune(entry)
+            except ValueError:
+                pass  # already pruned by someone else
+            return
+        # the backend leads its own process group, see SubprocessBackend
+        if entry.pid is not None:
+            try:
+                os.killpg(entry.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        entry.set_error(reason, entry.stderr, HTTPStatus.INTERNAL_SERVER_ERROR)
+        self.cache.release_port(entry)
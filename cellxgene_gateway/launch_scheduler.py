@@ -0,0 +1,136 @@
+# Copyright 2019 Novartis Institutes for BioMedical Research Inc. Licensed
+# under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at http://www.apache.org/licenses/LICENSE-2.0. Unless
+# required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+import itertools
+import logging
+import time
+from collections import deque
+from threading import Lock, Thread
+
+from cellxgene_gateway import env
+
+logger = logging.getLogger(__name__)
+
+# number of recent launches that wait times are reported for
+recent_launches = 100
+
+
+def priority(item):
+    # datasets users are waiting for go before warm ones, the most viewed first
+    sequence, entry, _ = item
+    return (entry.warm, -entry.hits, sequence)
+
+
+class LaunchScheduler:
+    """Limits how many backends load their dataset at the same time.
+
+    Launches are queued and started once fewer than max_parallel backends are
+    starting up. A backend stops counting against the limit as soon as it is
+    ready or failed, while the thread that launched it keeps running until it
+    exits. With order "priority", launches for datasets users are waiting
+    for are started before those of the warm pool, otherwise first come,
+    first served.
+    """
+
+    def __init__(self, max_parallel=None, order=None):
+        self.max_parallel = (
+            env.max_parallel_launches if max_parallel is None else max_parallel
+        )
+        self.order = order or env.launch_order
+        self.lock = Lock()
+        self.queue = []
+        self.sequence = itertools.count()
+        self.starting = 0
+        self.waits = deque(maxlen=recent_launches)
+
+    def submit(self, entry, launch):
+        entry.launch_queued_at = time.monotonic()
+        with self.lock:
+            self.queue.append((next(self.sequence), entry, launch))
+        self.dispatch()
+
+    def dispatch(self):
+        started = []
+        with self.lock:
+            while len(self.queue) > 0 and (
+                self.max_parallel <= 0 or self.starting < self.max_parallel
+            ):
+                item = (
+                    min(self.queue, key=priority)
+                    if self.order == "priority"
+                    else self.queue[0]
+                )
+                self.queue.remove(item)
+                self.starting += 1
+                started.append(item)
+        for _, entry, launch in started:
+            Thread(target=self.run, args=(entry, launch)).start()
+
+    def run(self, entry, launch):
+        entry.launch_wait_seconds = time.monotonic() - entry.launch_queued_at
+        with self.lock:
+            self.waits.append(entry.launch_wait_seconds)
+        with entry.start_lock:
+            stopped = entry.started
+            if not stopped:
+                entry.start_listeners.append(self.release)
+        if stopped:
+            # stopped while it was waiting to be launched
+            self.release(entry)
+            return
+        try:
+            launch()
+        finally:
+            entry.set_started()
+
+    def release(self, entry):
+        with self.lock:
+            self.starting -= 1
+        self.dispatch()
+
+    def cancel(self, entry):
+        # returns whether entry was still waiting to be launched
+        with self.lock:
+            for item in self.queue:
+                if item[1] is entry:
+                    self.queue.remove(item)
+                    return True
+        return False
+
+    def position(self, entry):
+        with self.lock:
+            queue = (
+                sorted(self.queue, key=priority)
+                if self.order == "priority"
+                else self.queue
+            )
+            for position, item in enumerate(queue, 1):
+                if item[1] is entry:
+                    return position
+        return None
+
+    def __len__(self):
+        return len(self.queue)
+
+    def status(self):
+        now = time.monotonic()
+        with self.lock:
+            waits = list(self.waits)
+            oldest = min(
+                (item[1].launch_queued_at for item in self.queue), default=None
+            )
+            return {
+                "max_parallel": self.max_parallel or None,
+                "order": self.order,
+                "starting": self.starting,
+                "queued": len(self.queue),
+                "oldest_wait_seconds": None if oldest is None else now - oldest,
+                "mean_wait_seconds": sum(waits) / len(waits) if waits else None,
+                "max_wait_seconds": max(waits, default=None),
+            }
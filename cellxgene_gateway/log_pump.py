@@ -0,0 +1,123 @@
+# Copyright 2019 Novartis Institutes for BioMedical Research Inc. Licensed
+# under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at http://www.apache.org/licenses/LICENSE-2.0. Unless
+# required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+import logging
+import os
+import re
+from collections import deque
+from logging.handlers import RotatingFileHandler
+from threading import Lock, Thread
+
+from cellxgene_gateway import env
+
+logger = logging.getLogger(__name__)
+
+# a process that never prints a newline must not grow a single line unbounded
+max_line_bytes = 64 * 1024
+
+
+class OutputBuffer:
+    """Keeps the last lines written by a backend, dropping the oldest ones."""
+
+    def __init__(self, max_lines=None):
+        self.lines = deque(maxlen=max_lines or env.output_buffer_lines)
+        self.dropped = 0
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.lines)
+
+    def append(self, line):
+        with self.lock:
+            if len(self.lines) == self.lines.maxlen:
+                self.dropped += 1
+            self.lines.append(line)
+
+    def clear(self):
+        with self.lock:
+            self.lines.clear()
+            self.dropped = 0
+
+    def text(self):
+        with self.lock:
+            if len(self.lines) == 0:
+                return None
+            text = "".join(self.lines)
+            if self.dropped > 0:
+                text = f"[{self.dropped} earlier lines omitted]\n" + text
+            return text
+
+
+def backend_log_handler(cache_entry):
+    if env.backend_log_dir is None:
+        return None
+    name = re.sub(
+        r"[^A-Za-z0-9_.-]+",
+        "_",
+        f"{cache_entry.source_name}_{cache_entry.key.descriptor}",
+    ).strip("_")
+    handler = RotatingFileHandler(
+        os.path.join(env.backend_log_dir, f"{name}.log"),
+        maxBytes=env.backend_log_bytes,
+        backupCount=env.backend_log_backups,
+    )
+    handler.setFormatter(logging.Formatter("%(asctime)s %(stream)s %(message)s"))
+    return handler
+
+
+class LogPump:
+    """Drains stdout and stderr of a backend process on background threads.
+
+    Reading both pipes continuously keeps a chatty backend from blocking on a
+    full pipe, while only the last lines are kept in the cache entry.
+    """
+
+    def __init__(self, process, cache_entry):
+        self.cache_entry = cache_entry
+        self.handler = backend_log_handler(cache_entry)
+        self.threads = [
+            Thread(
+                target=self.pump,
+                args=(process.stdout, cache_entry.output, "stdout"),
+                daemon=True,
+            ),
+            Thread(
+                target=self.pump,
+                args=(process.stderr, cache_entry.error_output, "stderr"),
+                daemon=True,
+            ),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def pump(self, stream, buffer, stream_name):
+        try:
+            for data in iter(lambda: stream.readline(max_line_bytes), b""):
+                line = data.decode(errors="replace")
+                buffer.append(line)
+                logger.debug(f"cellxgene {stream_name}:{line.rstrip()}")
+                if self.handler is not None:
+                    self.write_log(stream_name, line)
+        except (OSError, ValueError):
+            logger.exception(f"failed to read cellxgene {stream_name}")
+        finally:
+            stream.close()
+
+    def write_log(self, stream_name, line):
+        record = logging.LogRecord(
+            __name__, logging.INFO, "", 0, line.rstrip("\n"), None, None
+        )
+        record.stream = stream_name
+        self.handler.handle(record)
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+        if self.handler is not None:
+            self.handler.close()
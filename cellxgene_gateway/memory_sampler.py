@@ -0,0 +1,153 @@
+# Copyright 2019 Novartis Institutes for BioMedical Research Inc. Licensed
+# under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at http://www.apache.org/licenses/LICENSE-2.0. Unless
+# required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+import logging
+import time
+
+import psutil
+
+from cellxgene_gateway import env
+from cellxgene_gateway.cache_entry import CacheEntryStatus
+from cellxgene_gateway.util import current_time_stamp
+
+logger = logging.getLogger(__name__)
+
+cgroup_files = [
+    # cgroup v2
+    ("/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory.max"),
+    # cgroup v1
+    (
+        "/sys/fs/cgroup/memory/memory.usage_in_bytes",
+        "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+    ),
+]
+
+# cgroup v1 reports "no limit" as a huge number rather than "max"
+unlimited_cgroup = 2**60
+
+
+def process_memory(process):
+    try:
+        # pss splits shared pages between processes, so forked workers that
+        # share most of their memory are not counted several times
+        info = process.memory_full_info()
+        return getattr(info, "pss", info.rss)
+    except psutil.AccessDenied:
+        return process.memory_info().rss
+
+
+def process_tree_memory(pid):
+    try:
+        root = psutil.Process(pid)
+        processes = [root] + root.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return None
+    total = 0
+    for process in processes:
+        try:
+            total += process_memory(process)
+        except psutil.NoSuchProcess:
+            pass
+    return total
+
+
+def read_cgroup_memory():
+    for usage_path, limit_path in cgroup_files:
+        try:
+            with open(usage_path) as f:
+                usage = int(f.read().strip())
+            with open(limit_path) as f:
+                limit = f.read().strip()
+        except (OSError, ValueError):
+            continue
+        if limit == "max" or int(limit) >= unlimited_cgroup:
+            return usage, None
+        return usage, int(limit)
+    return None, None
+
+
+def gdsf_priority(entry, clock):
+    # greedy-dual-size-frequency: datasets that are used often and were slow
+    # to load are worth keeping, large ones are the cheapest way to free memory
+    cost = max(entry.load_seconds or 1.0, 1.0)
+    size = max(entry.memory_bytes or 1, 1)
+    return clock + (entry.hits + 1) * cost / size
+
+
+class MemorySampler:
+    def __init__(self, cache):
+        self.cache = cache
+        self.clock = 0.0
+        self.cgroup_usage = None
+        self.cgroup_limit = None
+
+    def __call__(self):
+        while True:
+            time.sleep(env.memory_sample_seconds)
+            try:
+                self.sample()
+                self.relieve_pressure()
+            except Exception:
+                logger.exception("failed to sample backend memory")
+
+    def sample(self):
+        for entry in list(self.cache.entry_list):
+            if entry.status == CacheEntryStatus.loaded and entry.pid is not None:
+                entry.memory_bytes = process_tree_memory(entry.pid)
+                entry.memory_sampled_at = current_time_stamp()
+        if env.memory_use_cgroup:
+            self.cgroup_usage, self.cgroup_limit = read_cgroup_memory()
+
+    def backend_memory(self):
+        return sum(
+            entry.memory_bytes or 0
+            for entry in self.cache.entry_list
+            if entry.status == CacheEntryStatus.loaded
+        )
+
+    def excess_bytes(self):
+        excess = 0
+        watermark = env.memory_high_watermark
+        if env.memory_budget_bytes > 0:
+            excess = self.backend_memory() - env.memory_budget_bytes * watermark
+        if self.cgroup_usage is not None and self.cgroup_limit is not None:
+            excess = max(excess, self.cgroup_usage - self.cgroup_limit * watermark)
+        return excess
+
+    def relieve_pressure(self):
+        excess = self.excess_bytes()
+        while excess > 0:
+            candidates = [
+                c for c in self.cache.idle_entries() if c.memory_bytes is not None
+            ]
+            if len(candidates) == 0:
+                logger.warning(
+                    f"memory {excess:.0f} bytes over budget, but no idle backend to evict"
+                )
+                return
+            victim = min(candidates, key=lambda c: gdsf_priority(c, self.clock))
+            self.clock = gdsf_priority(victim, self.clock)
+            logger.info(
+                f"evicting {victim.key.descriptor} ({victim.memory_bytes} bytes) under memory pressure"
+            )
+            try:
+                self.cache.prune(victim)
+            except ValueError:
+                pass  # already pruned by someone else
+            excess -= victim.memory_bytes
+            if self.cgroup_usage is not None:
+                self.cgroup_usage -= victim.memory_bytes
+
+    def status(self):
+        return {
+            "backends": self.backend_memory(),
+            "budget": env.memory_budget_bytes or None,
+            "cgroup_usage": self.cgroup_usage,
+            "cgroup_limit": self.cgroup_limit,
+        }
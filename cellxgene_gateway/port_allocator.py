@@ -0,0 +1,66 @@
+# Copyright 2019 Novartis Institutes for BioMedical Research Inc. Licensed
+# under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at http://www.apache.org/licenses/LICENSE-2.0. Unless
+# required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+from http import HTTPStatus
+from threading import Lock
+
+from cellxgene_gateway.cellxgene_exception import CellxgeneException
+from cellxgene_gateway.util import current_time_stamp
+
+
+class PortAllocator:
+    """Hands out ports from a fixed range without probing them.
+
+    Ports are handed out round-robin so that a port is not reused right after
+    it was released. A port that another process turned out to hold is
+    quarantined for a while instead of being probed again.
+    """
+
+    def __init__(self, start, end, quarantine_seconds=60):
+        if end < start:
+            raise ValueError(f"Invalid port range {start}-{end}")
+        self.start = start
+        self.end = end
+        self.quarantine_seconds = quarantine_seconds
+        self.next_port = start
+        self.allocated = {}
+        self.quarantined = {}
+        self.lock = Lock()
+
+    def allocate(self, owner):
+        with self.lock:
+            now = current_time_stamp()
+            for _ in range(self.end - self.start + 1):
+                port = self.next_port
+                self.next_port = port + 1 if port < self.end else self.start
+                if port in self.allocated:
+                    continue
+                if self.quarantined.get(port, 0) > now:
+                    continue
+                self.quarantined.pop(port, None)
+                self.allocated[port] = owner
+                return port
+        raise CellxgeneException(
+            f"No free port in range {self.start}-{self.end}",
+            HTTPStatus.SERVICE_UNAVAILABLE,
+        )
+
+    def release(self, port, owner, in_use=False):
+        with self.lock:
+            # a port may have been handed to a new owner since
+            if port in self.allocated and self.allocated[port] is owner:
+                del self.allocated[port]
+                if in_use:
+                    self.quarantined[port] = (
+                        current_time_stamp() + self.quarantine_seconds
+                    )
+
+    def allocated_ports(self):
+        with self.lock:
+            return sorted(self.allocated)
@@ -7,41 +7,97 @@
 # OR CONDITIONS OF ANY KIND, either express or implied. See the License for
 # the specific language governing permissions and limitations under the License.
 
+import heapq
+import itertools
 import logging
-import time
+from threading import Condition
 
 from cellxgene_gateway import env, util
 
 logger = logging.getLogger(__name__)
 
+busy_recheck_seconds = 5
+
 
 class PruneProcessCache:
+    """Expires cache entries that were idle for expire_seconds, or that were
+    launched more than max_lifetime_seconds ago. Entries with requests in
+    flight are never expired.
+
+    Entries are kept in a heap ordered by the deadline they had when they
+    were scheduled. Activity on an entry does not touch the heap; an entry
+    found to be still in use when its deadline comes up is pushed again with
+    its new deadline.
+    """
+
     def __init__(self, cache):
         self.cache = cache
         self.expire_seconds = env.expire_seconds
+        self.max_lifetime_seconds = env.max_lifetime_seconds
+        self.deadlines = []
+        self.sequence = itertools.count()
+        self.condition = Condition()
+        for entry in list(cache.entry_list):
+            self.schedule(entry)
+        cache.creation_listeners.append(self.schedule)
 
     def __call__(self):
         while True:
-            time.sleep(60)
+            with self.condition:
+                self.condition.wait(self.next_delay())
             self.prune()
 
-    def prune(self):
-        timestamp = util.current_time_stamp()
-        cutoff = timestamp - self.expire_seconds
-        processes_to_delete = [p for p in self.cache.entry_list if p.timestamp < cutoff]
-        processes_to_keep = [
-            p for p in self.cache.entry_list if not p.timestamp < cutoff
-        ]
+    def deadline(self, entry):
+        deadline = entry.last_used + self.expire_seconds
+        if self.max_lifetime_seconds > 0:
+            deadline = min(deadline, entry.launchtime + self.max_lifetime_seconds)
+        return deadline
 
-        logger.debug(
-            f"Cutoff {cutoff} = timestamp {timestamp} - expire seconds {self.expire_seconds} , keeping {processes_to_keep}, pruning {processes_to_delete}"
-        )
+    def schedule(self, entry):
+        with self.condition:
+            deadline = self.deadline(entry)
+            earliest = len(self.deadlines) == 0 or deadline < self.deadlines[0][0]
+            heapq.heappush(self.deadlines, (deadline, next(self.sequence), entry))
+            if earliest:
+                self.condition.notify()
 
-        for process in processes_to_delete:
+    def next_delay(self):
+        # must be called with self.condition held; None waits until scheduled
+        if len(self.deadlines) == 0:
+            return None
+        return max(self.deadlines[0][0] - util.current_time_stamp(), 0)
+
+    def expired(self):
+        timestamp = util.current_time_stamp()
+        expired = []
+        with self.condition:
+            while len(self.deadlines) > 0 and self.deadlines[0][0] <= timestamp:
+                _, _, entry = heapq.heappop(self.deadlines)
+                if not self.cache.sync(entry):
+                    continue  # stopped by another worker
+                deadline = self.deadline(entry)
+                if deadline <= timestamp and entry.in_flight > 0:
+                    # checked again soon after its requests have completed
+                    heapq.heappush(
+                        self.deadlines,
+                        (timestamp + busy_recheck_seconds, next(self.sequence), entry),
+                    )
+                elif deadline <= timestamp:
+                    expired.append(entry)
+                else:
+                    heapq.heappush(
+                        self.deadlines, (deadline, next(self.sequence), entry)
+                    )
+        return expired
+
+    def prune(self):
+        for process in self.expired():
             try:
-                logger.info(f"pruning process {process.pid} ({process.key.descriptor})")
                 self.cache.prune(process)
+                logger.info(f"pruned process {process.pid} ({process.key.descriptor})")
+            except ValueError:
+                pass  # already removed, for example evicted or pruned
             except Exception:
                 logger.exception(
-                    "failed to prune process {process.pid} ({process.key.descriptor})"
+                    f"failed to prune process {process.pid} ({process.key.descriptor})"
                 )
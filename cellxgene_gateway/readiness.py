@@ -0,0 +1,55 @@
+# Copyright 2019 Novartis Institutes for BioMedical Research Inc. Licensed
+# under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at http://www.apache.org/licenses/LICENSE-2.0. Unless
+# required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+import http.client
+import time
+from enum import Enum
+
+from cellxgene_gateway import env
+
+initial_delay = 0.05
+max_delay = 1.0
+backoff_factor = 1.5
+probe_timeout = 2.0
+
+
+class Readiness(Enum):
+    ready = "ready"
+    exited = "exited"
+    timed_out = "timed_out"
+
+
+def is_serving(port, path=None):
+    # any response at all means the http server is accepting requests; older
+    # cellxgene versions answer the health path with a 404
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=probe_timeout)
+    try:
+        connection.request("GET", path or env.readiness_path)
+        return connection.getresponse().status < 500
+    except (OSError, http.client.HTTPException):
+        return False
+    finally:
+        connection.close()
+
+
+def wait_until_ready(process, port, timeout=None):
+    timeout = env.launch_timeout_seconds if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
+        # checked first: another process may be serving on the same port
+        if process.poll() is not None:
+            return Readiness.exited
+        if is_serving(port):
+            return Readiness.ready
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return Readiness.timed_out
+        time.sleep(min(delay, remaining))
+        delay = min(delay * backoff_factor, max_delay)
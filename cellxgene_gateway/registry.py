@@ -0,0 +1,277 @@
+# Copyright 2019 Novartis Institutes for BioMedical Research Inc. Licensed
+# under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at http://www.apache.org/licenses/LICENSE-2.0. Unless
+# required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+# Backends shared between the worker processes of one host, so that any
+# gunicorn/uwsgi worker can route to a backend launched by another one.
+# The registry is a SQLite database in WAL mode; each launch is identified by
+# a claim, and only one worker can hold the claim for a dataset at a time.
+
+import logging
+import os
+import signal
+import sqlite3
+import threading
+import uuid
+from collections import namedtuple
+
+import psutil
+
+from cellxgene_gateway.cache_entry import CacheEntryStatus
+
+logger = logging.getLogger(__name__)
+
+schema = """
+CREATE TABLE IF NOT EXISTS backends (
+    claim TEXT PRIMARY KEY,
+    source_name TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    annotation TEXT NOT NULL,
+    port INTEGER UNIQUE,
+    pid INTEGER,
+    status TEXT NOT NULL,
+    launchtime REAL NOT NULL,
+    last_used REAL NOT NULL,
+    owner INTEGER NOT NULL,
+    UNIQUE (source_name, dataset, annotation)
+)
+"""
+
+access_schema = """
+CREATE TABLE IF NOT EXISTS access (
+    source_name TEXT NOT NULL,
+    descriptor TEXT NOT NULL,
+    hits INTEGER NOT NULL,
+    PRIMARY KEY (source_name, descriptor)
+)
+"""
+
+columns = [
+    "claim",
+    "source_name",
+    "dataset",
+    "annotation",
+    "port",
+    "pid",
+    "status",
+    "launchtime",
+    "last_used",
+    "owner",
+]
+Row = namedtuple("Row", columns)
+select = f"SELECT {', '.join(columns)} FROM backends"
+
+# last_used is written at most this often per entry
+touch_interval_seconds = 5
+
+
+def key_columns(key):
+    source_name, dataset, annotation = key.identity
+    return source_name, dataset, annotation or ""
+
+
+def is_alive(pid):
+    try:
+        return psutil.pid_exists(pid) and (
+            psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+        )
+    except psutil.NoSuchProcess:
+        return False
+
+
+def is_backend(row):
+    # guards against a pid that was reused after the backend exited
+    if row.pid is None:
+        return False
+    try:
+        cmdline = psutil.Process(row.pid).cmdline()
+        return os.getpgid(row.pid) == row.pid and str(row.port) in cmdline
+    except (ProcessLookupError, psutil.Error):
+        return False
+
+
+def reap(row):
+    if is_backend(row):
+        logger.info(f"killing stale backend {row.pid} on port {row.port}")
+        try:
+            os.killpg(row.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def is_stale(row):
+    # left behind by a worker that died, or by a backend that is gone
+    if row.pid is not None:
+        return not is_alive(row.pid)
+    return row.status in ["loading", "queued"] and not is_alive(row.owner)
+
+
+class Registry:
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        with self.transaction() as connection:
+            connection.execute(schema)
+            connection.execute(access_schema)
+
+    def connection(self):
+        # sqlite connections can be shared by neither threads nor forked workers
+        connection = getattr(self.local, "connection", None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def transaction(self):
+        return Transaction(self.connection())
+
+    def claim(self, entry):
+        """Claims the launch of entry's dataset for this worker.
+
+        Returns None if the claim succeeded, or the row of the backend that
+        another worker already launched for it.
+        """
+        entry.claim = uuid.uuid4().hex
+        source_name, dataset, annotation = key_columns(entry.key)
+        with self.transaction() as connection:
+            row = self.fetch_one(
+                connection,
+                f"{select} WHERE source_name = ? AND dataset = ? AND annotation = ?",
+                (source_name, dataset, annotation),
+            )
+            if row is not None and not is_stale(row):
+                return row
+            if row is not None:
+                logger.info(f"removing stale registry entry {row}")
+                connection.execute("DELETE FROM backends WHERE claim = ?", (row.claim,))
+            connection.execute(
+                "INSERT INTO backends VALUES (?, ?, ?, ?, NULL, NULL, ?, ?, ?, ?)",
+                (
+                    entry.claim,
+                    source_name,
+                    dataset,
+                    annotation,
+                    entry.status.name,
+                    entry.launchtime,
+                    entry.timestamp,
+                    os.getpid(),
+                ),
+            )
+        return None
+
+    def reserve_port(self, entry):
+        try:
+            with self.transaction() as connection:
+                connection.execute(
+                    "UPDATE backends SET port = ? WHERE claim = ?",
+                    (entry.port, entry.claim),
+                )
+            return True
+        except sqlite3.IntegrityError:
+            return False  # held by a backend of another worker
+
+    def update(self, entry):
+        try:
+            with self.transaction() as connection:
+                if entry.status == CacheEntryStatus.terminated:
+                    connection.execute(
+                        "DELETE FROM backends WHERE claim = ?", (entry.claim,)
+                    )
+                else:
+                    connection.execute(
+                        "UPDATE backends SET status = ?, pid = ?, port = ? WHERE claim = ?",
+                        (entry.status.name, entry.pid, entry.port, entry.claim),
+                    )
+        except sqlite3.Error:
+            logger.exception(f"failed to update registry for {entry.key.descriptor}")
+
+    def get(self, claim):
+        return self.fetch_one(self.connection(), f"{select} WHERE claim = ?", (claim,))
+
+    def touch(self, entry, timestamp):
+        with self.transaction() as connection:
+            connection.execute(
+                "UPDATE backends SET last_used = MAX(last_used, ?) WHERE claim = ?",
+                (timestamp, entry.claim),
+            )
+
+    def orphans(self):
+        # backends of gateway processes that are gone, e.g. before a restart
+        return [
+            row
+            for row in self.rows()
+            if row.owner != os.getpid() and not is_alive(row.owner)
+        ]
+
+    def take_over(self, row):
+        # returns False if another worker took over the row first
+        with self.transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE backends SET owner = ? WHERE claim = ? AND owner = ?",
+                (os.getpid(), row.claim, row.owner),
+            )
+            return cursor.rowcount == 1
+
+    def remove(self, claim):
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM backends WHERE claim = ?", (claim,))
+
+    def record_access(self, source_name, descriptor):
+        with self.transaction() as connection:
+            connection.execute(
+                "INSERT INTO access VALUES (?, ?, 1) ON CONFLICT (source_name, descriptor) DO UPDATE SET hits = hits + 1",
+                (source_name, descriptor),
+            )
+
+    def most_accessed(self, n):
+        return (
+            self.connection()
+            .execute(
+                "SELECT source_name, descriptor FROM access ORDER BY hits DESC, descriptor LIMIT ?",
+                (n,),
+            )
+            .fetchall()
+        )
+
+    def rows(self):
+        return [Row(*r) for r in self.connection().execute(select).fetchall()]
+
+    def fetch_one(self, connection, query, parameters):
+        result = connection.execute(query, parameters).fetchone()
+        return None if result is None else Row(*result)
+
+
+class Transaction:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        # take the write lock up front, so that concurrent claims serialize
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.connection.execute("COMMIT")
+        else:
+            self.connection.execute("ROLLBACK")
+        return False
+
+
+def apply_row(entry, row):
+    # copies what other workers know about a backend, without writing it back
+    entry.claim = row.claim
+    entry.port = row.port
+    entry.pid = row.pid
+    entry.launchtime = row.launchtime
+    entry.set_status(CacheEntryStatus(row.status), notify=False)
+    if row.last_used > entry.timestamp:
+        entry.timestamp = row.last_used
@@ -8,16 +8,30 @@
 # the specific language governing permissions and limitations under the License.
 
 import logging
+import os
+import shlex
+import signal
 import subprocess
+import time
 from http import HTTPStatus
 
-from cellxgene_gateway.cache_entry import CacheEntryStatus
+from cellxgene_gateway import env
 from cellxgene_gateway.dir_util import make_annotations
 from cellxgene_gateway.env import cellxgene_args, enable_annotations, enable_backed_mode
+from cellxgene_gateway.log_pump import LogPump
 from cellxgene_gateway.process_exception import ProcessException
+from cellxgene_gateway.readiness import Readiness, wait_until_ready
 
 logger = logging.getLogger(__name__)
 
+# enough for every confirmation prompt of cellxgene launch
+confirm_answers = 16
+port_conflict_messages = ["is in use", "Address already in use"]
+
+
+def is_port_conflict(stderr):
+    return any(m in stderr for m in port_conflict_messages)
+
 
 class SubprocessBackend:
     def __init__(self):
@@ -26,68 +40,120 @@ class SubprocessBackend:
     def create_cmd(self, cellxgene_loc, file_path, port, scripts, annotation_file_path):
         if enable_annotations and not annotation_file_path is None:
             if annotation_file_path == "":
-                extra_args = f" --annotations-dir {make_annotations(file_path)}"
+                extra_args = ["--annotations-dir", make_annotations(file_path)]
             else:
-                extra_args = f" --annotations-file {annotation_file_path}"
                 gene_sets_file_path = annotation_file_path[:-4] + "_gene_sets.csv"
-                extra_args += f" --gene-sets-file {gene_sets_file_path}"
+                extra_args = [
+                    "--annotations-file",
+                    annotation_file_path,
+                    "--gene-sets-file",
+                    gene_sets_file_path,
+                ]
         else:
-            extra_args = " --disable-annotations"
-            extra_args += " --disable-gene-sets-save"
+            extra_args = ["--disable-annotations", "--disable-gene-sets-save"]
         if enable_backed_mode:
-            extra_args += " --backed"
+            extra_args.append("--backed")
         if not cellxgene_args is None:
-            extra_args += f" {cellxgene_args}"
+            extra_args += shlex.split(cellxgene_args)
 
         cmd = (
-            f"yes | {cellxgene_loc} launch {file_path}"
-            + f" --port {port}"
-            + " --host 127.0.0.1"
+            shlex.split(cellxgene_loc)
+            + ["launch", file_path]
+            + ["--port", str(port)]
+            + ["--host", "127.0.0.1"]
             + extra_args
         )
 
         for s in scripts:
-            cmd += f" --scripts {s}"
+            cmd += ["--scripts", s]
 
         return cmd
 
-    def launch(self, cellxgene_loc, scripts, cache_entry):
-        cmd = self.create_cmd(
-            cellxgene_loc,
-            cache_entry.key.file_path,
-            cache_entry.port,
-            scripts,
-            cache_entry.key.annotation_file_path,
-        )
-        logger.info(f"launching {cmd}")
-        process = subprocess.Popen(
-            [cmd], stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True
-        )
-
-        while True:
-            output = process.stdout.readline().decode()
-            if output == "[cellxgene] Type CTRL-C at any time to exit.\n":
+    def launch(self, cellxgene_loc, scripts, cache_entry, port_allocator=None):
+        attempts = 1 if port_allocator is None else 1 + env.port_retries
+        for attempt in range(attempts):
+            cmd = self.create_cmd(
+                cellxgene_loc,
+                cache_entry.key.file_path,
+                cache_entry.port,
+                scripts,
+                cache_entry.key.annotation_file_path,
+            )
+            logger.info(f"launching {shlex.join(cmd)}")
+            cache_entry.all_output = None
+            cache_entry.stderr = None
+            started = time.monotonic()
+            process = self.spawn(cmd, cellxgene_loc)
+            self.confirm_prompts(process)
+            pump = LogPump(process, cache_entry)
+            readiness = wait_until_ready(process, cache_entry.port)
+            if readiness == Readiness.ready:
                 break
-            elif output == "":
-                stderr = process.stderr.read().decode()
-                if (
-                    "Error while loading file" in stderr
-                    or "Could not open file" in stderr
-                ):
-                    message = "File was invalid."
-                    http_status = HTTPStatus.BAD_REQUEST
-                else:
-                    message = "Cellxgene failed to launch dataset."
-                    http_status = HTTPStatus.INTERNAL_SERVER_ERROR
-
-                cache_entry.status = CacheEntryStatus.error
-                cache_entry.set_error(message, stderr, http_status)
-
-                raise ProcessException.from_cache_entry(cache_entry)
+
+            if readiness == Readiness.timed_out:
+                self.kill(process)
+            process.wait()
+            pump.join()
+            stderr = cache_entry.stderr or ""
+            if (
+                readiness == Readiness.exited
+                and attempt + 1 < attempts
+                and is_port_conflict(stderr)
+            ):
+                # another process took the port after it was allocated
+                port = cache_entry.port
+                port_allocator.release(port, cache_entry, in_use=True)
+                cache_entry.port = port_allocator.allocate(cache_entry)
+                logger.warning(
+                    f"port {port} in use, retrying on port {cache_entry.port}"
+                )
+                continue
+
+            if readiness == Readiness.timed_out:
+                message = f"Cellxgene did not start within {env.launch_timeout_seconds} seconds."
+                http_status = HTTPStatus.GATEWAY_TIMEOUT
+            elif (
+                "Error while loading file" in stderr or "Could not open file" in stderr
+            ):
+                message = "File was invalid."
+                http_status = HTTPStatus.BAD_REQUEST
             else:
-                cache_entry.append_output(output)
+                message = "Cellxgene failed to launch dataset."
+                http_status = HTTPStatus.INTERNAL_SERVER_ERROR
+
+            cache_entry.set_error(message, cache_entry.stderr, http_status)
 
+            raise ProcessException.from_cache_entry(cache_entry)
+
+        cache_entry.time_to_ready = time.monotonic() - started
+        logger.info(f"ready after {cache_entry.time_to_ready:.1f}s: {shlex.join(cmd)}")
         cache_entry.set_loaded(process.pid)
-        for output in process.communicate():
-            logger.debug(f"cellxgene:{output}")
-        logger.info(f"exiting {cmd}")
+        # the pump keeps draining output until the process exits
+        process.wait()
+        pump.join()
+        logger.info(f"exiting {shlex.join(cmd)}")
+
+    def spawn(self, cmd, cellxgene_loc):
+        # a session of its own makes cellxgene the leader of a process
+        # group, so that it and its workers are stopped with one signal
+        return subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+        )
+
+    def confirm_prompts(self, process):
+        # answers the confirmations cellxgene may ask for, as "yes |" used to
+        try:
+            process.stdin.write(b"y\n" * confirm_answers)
+            process.stdin.close()
+        except OSError:
+            pass  # exited before reading its input, reported by the readiness probe
+
+    def kill(self, process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
@@ -0,0 +1,42 @@
+# Copyright 2019 Novartis Institutes for BioMedical Research Inc. Licensed
+# under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at http://www.apache.org/licenses/LICENSE-2.0. Unless
+# required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from cellxgene_gateway import env
+
+logger = logging.getLogger(__name__)
+
+
+class TerminationExecutor:
+    """Stops backends off the calling thread, several at a time.
+
+    The backend is sent SIGTERM right away; waiting for it to exit, and
+    killing it once the grace period is over, happens on a worker thread.
+    """
+
+    def __init__(self, max_workers=None):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or env.termination_workers,
+            thread_name_prefix="terminate",
+        )
+
+    def submit(self, entry, on_exit=None):
+        entry.terminate()
+        return self.executor.submit(self.wait, entry, on_exit)
+
+    def wait(self, entry, on_exit):
+        try:
+            entry.wait_terminated(env.termination_grace_seconds)
+        except Exception:
+            logger.exception(f"failed to terminate {entry.pid}")
+        finally:
+            if on_exit is not None:
+                on_exit(entry)
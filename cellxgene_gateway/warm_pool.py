@@ -0,0 +1,168 @@
+# Copyright 2019 Novartis Institutes for BioMedical Research Inc. Licensed
+# under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at http://www.apache.org/licenses/LICENSE-2.0. Unless
+# required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+import datetime
+import logging
+import sqlite3
+import time
+from collections import Counter
+from threading import Lock
+
+from cellxgene_gateway import env
+from cellxgene_gateway.cache_entry import CacheEntryStatus
+from cellxgene_gateway.util import current_time_stamp
+
+logger = logging.getLogger(__name__)
+
+poll_seconds = 1
+
+
+def parse_schedule(schedule):
+    # "07:00,13:30": local times of day at which the pool is warmed again
+    return sorted(
+        datetime.datetime.strptime(item.strip(), "%H:%M").time()
+        for item in (schedule or "").split(",")
+        if item.strip() != ""
+    )
+
+
+def next_run(times, now):
+    for t in times:
+        candidate = datetime.datetime.combine(now.date(), t)
+        if candidate > now:
+            return candidate
+    tomorrow = now.date() + datetime.timedelta(days=1)
+    return datetime.datetime.combine(tomorrow, times[0])
+
+
+def parse_datasets(datasets):
+    # descriptors of the default item source, comma separated
+    return [
+        (None, item.strip())
+        for item in (datasets or "").split(",")
+        if item.strip() != ""
+    ]
+
+
+class AccessHistory:
+    """Counts how often each dataset was opened. The counts are kept in the
+    registry if there is one, so that they survive restarts."""
+
+    def __init__(self, registry=None):
+        self.registry = registry
+        self.counts = Counter()
+        self.lock = Lock()
+
+    def record(self, key):
+        if self.registry is not None:
+            try:
+                self.registry.record_access(key.source_name, key.descriptor)
+            except sqlite3.Error:
+                logger.exception(f"failed to record access to {key.descriptor}")
+        else:
+            with self.lock:
+                self.counts[(key.source_name, key.descriptor)] += 1
+
+    def most_accessed(self, n):
+        if n <= 0:
+            return []
+        if self.registry is not None:
+            return [tuple(row) for row in self.registry.most_accessed(n)]
+        with self.lock:
+            return [name for name, _ in self.counts.most_common(n)]
+
+
+class WarmPool:
+    """Launches the configured and the most accessed datasets ahead of their
+    users, at startup and then at the times of GATEWAY_WARM_SCHEDULE.
+
+    Datasets are launched one at a time, and only while a backend can be
+    launched without evicting another one or exceeding the memory budget.
+    """
+
+    def __init__(self, cache, key_for, get_scripts, history, memory_sampler=None):
+        # key_for returns the CacheKey of a source name and a descriptor
+        self.cache = cache
+        self.key_for = key_for
+        self.get_scripts = get_scripts
+        self.history = history
+        self.memory_sampler = memory_sampler
+        self.entries = []
+        self.launched = 0
+        self.used = 0
+        self.last_run = None
+
+    def __call__(self):
+        times = parse_schedule(env.warm_schedule)
+        while True:
+            try:
+                self.warm()
+            except Exception:
+                logger.exception("failed to warm backends")
+            if len(times) == 0:
+                return
+            now = datetime.datetime.now()
+            time.sleep((next_run(times, now) - now).total_seconds())
+
+    def targets(self):
+        targets = []
+        for target in parse_datasets(env.warm_datasets) + self.history.most_accessed(
+            env.warm_top_n
+        ):
+            if target not in targets:
+                targets.append(target)
+        return targets
+
+    def has_capacity(self):
+        if env.max_backends > 0 and self.cache.live_count() >= env.max_backends:
+            return False
+        if self.memory_sampler is not None:
+            self.memory_sampler.sample()
+            if self.memory_sampler.excess_bytes() > 0:
+                return False
+        return True
+
+    def warm(self):
+        self.last_run = current_time_stamp()
+        self.used += self.used_count()
+        self.entries = []
+        for source_name, descriptor in self.targets():
+            key = self.key_for(source_name, descriptor)
+            if key is None:
+                logger.warning(f"could not find {descriptor} to warm")
+                continue
+            if self.cache.check_entry(key) is not None:
+                continue
+            if not self.has_capacity():
+                logger.info(f"no capacity left, not warming {descriptor}")
+                break
+            logger.info(f"warming {descriptor}")
+            entry = self.cache.get_or_create_entry(key, self.get_scripts(), warm=True)
+            self.entries.append(entry)
+            self.launched += 1
+            self.wait_loaded(entry)
+
+    def wait_loaded(self, entry):
+        # synced, since the backend may have been launched by another worker
+        while self.cache.sync(entry) and entry.status in [
+            CacheEntryStatus.loading,
+            CacheEntryStatus.queued,
+        ]:
+            time.sleep(poll_seconds)
+
+    def used_count(self):
+        # warm backends that served a request before they were replaced
+        return len([e for e in self.entries if e.hits > 0])
+
+    def status(self):
+        return {
+            "launched": self.launched,
+            "used": self.used + self.used_count(),
+            "last_run": self.last_run,
+        }
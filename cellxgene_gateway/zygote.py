@@ -0,0 +1,160 @@
+# Copyright 2019 Novartis Institutes for BioMedical Research Inc. Licensed
+# under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at http://www.apache.org/licenses/LICENSE-2.0. Unless
+# required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+# A long-lived process that imports cellxgene once, and then forks a child
+# for every dataset to launch, so that the children start without paying for
+# the interpreter and the imports again. See ZygoteBackend.
+#
+# It is run by the python interpreter cellxgene is installed in, which need
+# not have the gateway installed; this module must only use the standard
+# library.
+#
+# usage: python zygote.py <socket path> <entry point> [<module to preload>...]
+#
+# The entry point is the name of a console script, usually cellxgene, or a
+# module:function to call.
+#
+# A launch is one connection on the unix socket: the gateway sends the
+# arguments of the cellxgene command as a JSON line together with the file
+# descriptors for stdin, stdout and stderr. The zygote answers with a JSON
+# line holding the pid of the child, and another one holding its exit code
+# once the child has exited.
+
+import importlib
+import json
+import os
+import selectors
+import socket
+import sys
+import traceback
+from importlib.metadata import entry_points
+
+max_message_bytes = 1024 * 1024
+poll_seconds = 0.2
+
+
+def load_entry_point(name):
+    if ":" in name:
+        module, function = name.split(":", 1)
+        return getattr(importlib.import_module(module), function)
+    scripts = entry_points()
+    if hasattr(scripts, "select"):
+        matches = scripts.select(group="console_scripts", name=name)
+    else:
+        matches = [s for s in scripts.get("console_scripts", []) if s.name == name]
+    (entry_point,) = matches
+    return entry_point.load()
+
+
+def preload(modules):
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except Exception:
+            print(f"zygote: could not preload {module}", file=sys.stderr)
+
+
+def receive(connection):
+    data, fds, _, _ = socket.recv_fds(connection, max_message_bytes, 3)
+    return json.loads(data), fds
+
+
+class Zygote:
+    def __init__(self, path, main):
+        self.main = main
+        self.parent = os.getppid()
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.listener.listen()
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        # connections of children that have not exited yet, by pid
+        self.children = {}
+
+    def serve(self):
+        # single threaded, since forking a process with threads is unsafe
+        while os.getppid() == self.parent:
+            for _ in self.selector.select(poll_seconds):
+                connection, _ = self.listener.accept()
+                try:
+                    self.launch(connection)
+                except Exception:
+                    traceback.print_exc()
+                    connection.close()
+            self.reap()
+
+    def launch(self, connection):
+        request, fds = receive(connection)
+        pid = os.fork()
+        if pid == 0:
+            self.run_child(request["argv"], fds, connection)
+        for fd in fds:
+            os.close(fd)
+        self.children[pid] = connection
+        connection.sendall(json.dumps({"pid": pid}).encode() + b"\n")
+
+    def run_child(self, argv, fds, connection):
+        # the child leads a process group of its own, like a backend started
+        # with start_new_session by SubprocessBackend
+        try:
+            os.setsid()
+            self.selector.close()
+            self.listener.close()
+            for c in [connection] + list(self.children.values()):
+                c.close()
+            for target, fd in enumerate(fds):
+                os.dup2(fd, target)
+                os.close(fd)
+            sys.stdin = open(0, "r", closefd=False)
+            sys.stdout = open(1, "w", buffering=1, closefd=False)
+            sys.stderr = open(2, "w", buffering=1, closefd=False)
+            sys.argv = ["cellxgene"] + argv
+            self.main()
+            code = 0
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+    def reap(self):
+        while len(self.children) > 0:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            connection = self.children.pop(pid, None)
+            if connection is not None:
+                code = os.waitstatus_to_exitcode(status)
+                try:
+                    connection.sendall(
+                        json.dumps({"returncode": code}).encode() + b"\n"
+                    )
+                except OSError:
+                    pass  # the gateway went away
+                connection.close()
+
+
+def main():
+    path, entry_point = sys.argv[1:3]
+    cellxgene = load_entry_point(entry_point)
+    preload(sys.argv[3:])
+    zygote = Zygote(path, cellxgene)
+    # tells the gateway that the imports are done
+    print("zygote ready", flush=True)
+    zygote.serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+# Copyright 2019 Novartis Institutes for BioMedical Research Inc. Licensed
+# under the Apache License, Version 2.0 (the "License"); you may not use
+# this file except in compliance with the License. You may obtain a copy
+# of the License at http://www.apache.org/licenses/LICENSE-2.0. Unless
+# required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES
+# OR CONDITIONS OF ANY KIND, either express or implied. See the License for
+# the specific language governing permissions and limitations under the License.
+
+import json
+import logging
+import os
+import select
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from threading import Lock
+
+import psutil
+
+from cellxgene_gateway import env, zygote
+from cellxgene_gateway.subprocess_backend import SubprocessBackend
+
+logger = logging.getLogger(__name__)
+
+
+def default_python(cellxgene_loc):
+    # the interpreter of the cellxgene script, so that the zygote imports the
+    # same installation that CELLXGENE_LOCATION would run
+    path = shutil.which(shlex.split(cellxgene_loc)[0])
+    try:
+        with open(path, "rb") as f:
+            line = f.readline(1024)
+    except (OSError, TypeError):
+        return sys.executable
+    if line.startswith(b"#!") and b"python" in line:
+        return shlex.split(line[2:].decode())[0]
+    return sys.executable
+
+
+def receive_line(connection):
+    # byte by byte, so that nothing after the line is read ahead of time
+    line = b""
+    while not line.endswith(b"\n"):
+        data = connection.recv(1)
+        if len(data) == 0:
+            break
+        line += data
+    return line
+
+
+class ZygoteProcess:
+    """The part of subprocess.Popen that SubprocessBackend uses, for a
+    backend forked by the zygote. The zygote reports its exit code on the
+    connection it was launched through."""
+
+    def __init__(self, pid, connection, stdin, stdout, stderr):
+        self.pid = pid
+        self.connection = connection
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None and self.connection is not None:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            if len(readable) > 0:
+                self.read_returncode()
+        if self.returncode is None and self.connection is None:
+            # the zygote is gone, the backend was left to init
+            if not psutil.pid_exists(self.pid):
+                self.returncode = -1
+        return self.returncode
+
+    def wait(self):
+        if self.returncode is None and self.connection is not None:
+            self.read_returncode()
+        while self.poll() is None:
+            time.sleep(1)
+        return self.returncode
+
+    def read_returncode(self):
+        line = receive_line(self.connection)
+        if len(line) > 0:
+            self.returncode = json.loads(line)["returncode"]
+        self.connection.close()
+        self.connection = None
+
+
+class ZygoteBackend(SubprocessBackend):
+    """Launches cellxgene by forking a zygote process that imported it once,
+    instead of starting a new interpreter for every dataset. Falls back to
+    starting cellxgene directly if the zygote cannot be used.
+    """
+
+    def __init__(self, python=None, entry_point=None, preload=None):
+        super().__init__()
+        self.python = python or env.zygote_python
+        self.entry_point = entry_point or env.zygote_entry_point
+        self.preload = (
+            [m.strip() for m in env.zygote_preload.split(",") if m.strip() != ""]
+            if preload is None
+            else preload
+        )
+        self.lock = Lock()
+        self.zygote = None
+        self.path = None
+        self.owner = None
+
+    def spawn(self, cmd, cellxgene_loc):
+        try:
+            path = self.start_zygote(cellxgene_loc)
+            return self.fork(path, cmd[len(shlex.split(cellxgene_loc)) :])
+        except (OSError, ValueError) as e:
+            logger.warning(f"zygote unavailable, starting cellxgene directly: {e}")
+            return super().spawn(cmd, cellxgene_loc)
+
+    def start_zygote(self, cellxgene_loc):
+        with self.lock:
+            # a forked gateway worker starts a zygote of its own
+            if (
+                self.zygote is not None
+                and self.zygote.poll() is None
+                and self.owner == os.getpid()
+            ):
+                return self.path
+            directory = tempfile.mkdtemp(prefix="cellxgene-zygote-")
+            path = os.path.join(directory, "zygote.sock")
+            python = self.python or default_python(cellxgene_loc)
+            process = subprocess.Popen(
+                [python, zygote.__file__, path, self.entry_point] + self.preload,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+            )
+            # the zygote says it is ready once it has imported cellxgene
+            readable, _, _ = select.select(
+                [process.stdout], [], [], env.launch_timeout_seconds
+            )
+            line = process.stdout.readline() if len(readable) > 0 else b""
+            process.stdout.close()
+            if line.strip() != b"zygote ready":
+                process.kill()
+                process.wait()
+                raise OSError(f"zygote did not start with {python}")
+            logger.info(f"zygote {process.pid} ready on {path}")
+            self.zygote = process
+            self.path = path
+            self.owner = os.getpid()
+            return path
+
+    def fork(self, path, argv):
+        stdin_read, stdin_write = os.pipe()
+        stdout_read, stdout_write = os.pipe()
+        stderr_read, stderr_write = os.pipe()
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(path)
+            request = json.dumps({"argv": argv}).encode() + b"\n"
+            socket.send_fds(
+                connection, [request], [stdin_read, stdout_write, stderr_write]
+            )
+            reply = json.loads(receive_line(connection))
+        except (OSError, ValueError):
+            connection.close()
+            for fd in [stdin_write, stdout_read, stderr_read]:
+                os.close(fd)
+            raise
+        finally:
+            # the ends of the child are in the zygote now
+            for fd in [stdin_read, stdout_write, stderr_write]:
+                os.close(fd)
+        return ZygoteProcess(
+            reply["pid"],
+            connection,
+            os.fdopen(stdin_write, "wb"),
+            os.fdopen(stdout_read, "rb"),
+            os.fdopen(stderr_read, "rb"),
+        )
@@ -38,10 +38,11 @@ if [ -z "$CELLXGENE_DATA" ] && [ -z "$CELLXGENE_BUCKET" ]; then
 fi
 
 # Gunicorn configuration
-# WARNING: Multi-worker mode has cache synchronization issues (see plans/002-shared-cache-implementation.md)
-# Each worker maintains its own in-memory cache, causing 404s for static assets when different
-# workers handle requests for the same dataset. Use GUNICORN_WORKERS=1 until shared cache is implemented.
+# The workers share the running cellxgene servers through a registry (see
+# GATEWAY_REGISTRY_PATH), so that a dataset launched by one worker is served by all
+# of them, and servers still running after a restart are reattached.
 WORKERS=${GUNICORN_WORKERS:-1}
+export GATEWAY_REGISTRY_PATH=${GATEWAY_REGISTRY_PATH:-$SCRIPT_DIR/.gateway_registry.sqlite}
 BIND=${GATEWAY_IP:-0.0.0.0}:${GATEWAY_PORT:-5005}
 TIMEOUT=${GUNICORN_TIMEOUT:-120}
 WORKER_CLASS=${GUNICORN_WORKER_CLASS:-sync}
@@ -68,6 +69,7 @@ echo "  Timeout: ${TIMEOUT}s"
 echo "  Keepalive: ${KEEPALIVE}s"
 echo "  Log level: $LOG_LEVEL"
 echo "  Backed mode: ${GATEWAY_ENABLE_BACKED_MODE}"
+echo "  Registry: ${GATEWAY_REGISTRY_PATH:-none}"
 echo ""
 
 cd "$SCRIPT_DIR"
@@ -38,10 +38,11 @@ if [ -z "$CELLXGENE_DATA" ] && [ -z "$CELLXGENE_BUCKET" ]; then
 fi
 
 # uWSGI configuration
-# WARNING: Multi-worker mode has cache synchronization issues (see plans/002-shared-cache-implementation.md)
-# Each worker maintains its own in-memory cache, causing 404s for static assets when different
-# workers handle requests for the same dataset. Use UWSGI_WORKERS=1 until shared cache is implemented.
+# The workers share the running cellxgene servers through a registry (see
+# GATEWAY_REGISTRY_PATH), so that a dataset launched by one worker is served by all
+# of them, and servers still running after a restart are reattached.
 WORKERS=${UWSGI_WORKERS:-1}
+export GATEWAY_REGISTRY_PATH=${GATEWAY_REGISTRY_PATH:-$SCRIPT_DIR/.gateway_registry.sqlite}
 HOST=${GATEWAY_IP:-0.0.0.0}
 PORT=${GATEWAY_PORT:-5005}
 TIMEOUT=${UWSGI_TIMEOUT:-120}
@@ -64,6 +65,7 @@ else
     echo "  Threads: $THREADS"
     echo "  Timeout: ${TIMEOUT}s"
     echo "  Backed mode: ${GATEWAY_ENABLE_BACKED_MODE}"
+    echo "  Registry: ${GATEWAY_REGISTRY_PATH:-none}"
     echo ""
 
     cd "$SCRIPT_DIR"
@@ -1,5 +1,7 @@
+import time
 import unittest
 from http import HTTPStatus
+from threading import Thread
 from unittest.mock import MagicMock, Mock, patch, call
 from freezegun import freeze_time
 
@@ -7,6 +9,7 @@ from cellxgene_gateway.backend_cache import BackendCache, is_port_in_use
 from cellxgene_gateway.cache_entry import CacheEntry, CacheEntryStatus
 from cellxgene_gateway.cache_key import CacheKey
 from cellxgene_gateway.cellxgene_exception import CellxgeneException
+from cellxgene_gateway.util import current_time_stamp
 
 
 class TestIsPortInUse(unittest.TestCase):
@@ -213,11 +216,13 @@ class TestBackendCacheCheckEntry(unittest.TestCase):
     def test_GIVEN_no_matching_entry_THEN_check_entry_returns_none(self):
         """check_entry should return None when no entries match the key."""
         key = Mock()
+        key.identity = ("test_source", "/data", None)
 
         cache_entry = Mock()
         cache_entry.status = CacheEntryStatus.loaded
         cache_entry.key = Mock()
-        cache_entry.key.equals.return_value = False
+        cache_entry.key.identity = ("test_source", "/other", None)
+        cache_entry.key.descriptor = "/other"
 
         self.cache.entry_list = [cache_entry]
 
@@ -227,11 +232,13 @@ class TestBackendCacheCheckEntry(unittest.TestCase):
     def test_GIVEN_terminated_entry_THEN_check_entry_ignores_it(self):
         """check_entry should ignore entries with terminated status."""
         key = Mock()
+        key.identity = ("test_source", "/data", None)
 
         cache_entry = Mock()
         cache_entry.status = CacheEntryStatus.terminated
         cache_entry.key = Mock()
-        cache_entry.key.equals.return_value = True
+        cache_entry.key.identity = ("test_source", "/data", None)
+        cache_entry.key.descriptor = "/data"
 
         self.cache.entry_list = [cache_entry]
 
@@ -241,11 +248,13 @@ class TestBackendCacheCheckEntry(unittest.TestCase):
     def test_GIVEN_single_matching_entry_THEN_check_entry_returns_it(self):
         """check_entry should return the matching entry when exactly one matches."""
         key = Mock()
+        key.identity = ("test_source", "/data", None)
 
         cache_entry = Mock()
         cache_entry.status = CacheEntryStatus.loaded
         cache_entry.key = Mock()
-        cache_entry.key.equals.return_value = True
+        cache_entry.key.identity = ("test_source", "/data", None)
+        cache_entry.key.descriptor = "/data"
 
         self.cache.entry_list = [cache_entry]
 
@@ -255,17 +264,23 @@ class TestBackendCacheCheckEntry(unittest.TestCase):
     def test_GIVEN_multiple_matching_entries_THEN_check_entry_raises_exception(self):
         """check_entry should raise exception when multiple entries match."""
         key = Mock()
+        key.identity = ("test_source", "/data", None)
         key.dataset = "test_dataset"
 
         cache_entry1 = Mock()
         cache_entry1.status = CacheEntryStatus.loaded
         cache_entry1.key = Mock()
-        cache_entry1.key.equals.return_value = True
+        cache_entry1.key.identity = ("test_source", "/data", None)
+        cache_entry1.key.descriptor = "/data"
 
         cache_entry2 = Mock()
         cache_entry2.status = CacheEntryStatus.loaded
         cache_entry2.key = Mock()
-        cache_entry2.key.equals.return_value = True
+        cache_entry2.key.identity = ("test_source", "/data", None)
+        cache_entry2.key.descriptor = "/data"
+        # both claim to be the first replica
+        cache_entry1.replica = 0
+        cache_entry2.replica = 0
 
         self.cache.entry_list = [cache_entry1, cache_entry2]
 
@@ -281,24 +296,28 @@ class TestBackendCacheCheckEntry(unittest.TestCase):
     ):
         """check_entry should correctly filter by key equality and status."""
         key = Mock()
+        key.identity = ("test_source", "/data", None)
 
         # Terminated entry - should be ignored
         terminated_entry = Mock()
         terminated_entry.status = CacheEntryStatus.terminated
         terminated_entry.key = Mock()
-        terminated_entry.key.equals.return_value = True
+        terminated_entry.key.identity = ("test_source", "/data", None)
+        terminated_entry.key.descriptor = "/data"
 
         # Non-matching entry - should be ignored
         non_matching_entry = Mock()
         non_matching_entry.status = CacheEntryStatus.loaded
         non_matching_entry.key = Mock()
-        non_matching_entry.key.equals.return_value = False
+        non_matching_entry.key.identity = ("test_source", "/other", None)
+        non_matching_entry.key.descriptor = "/other"
 
         # Matching entry - should be returned
         matching_entry = Mock()
         matching_entry.status = CacheEntryStatus.loaded
         matching_entry.key = Mock()
-        matching_entry.key.equals.return_value = True
+        matching_entry.key.identity = ("test_source", "/data", None)
+        matching_entry.key.descriptor = "/data"
 
         self.cache.entry_list = [terminated_entry, non_matching_entry, matching_entry]
 
@@ -360,3 +379,255 @@ class TestBackendCachePrune(unittest.TestCase):
 
         with self.assertRaises(ValueError):
             cache.prune(entry_mock)
+
+
+class TestBackendCacheIndex(unittest.TestCase):
+    def setUp(self):
+        from cellxgene_gateway.items.file.fileitem import FileItem
+        from cellxgene_gateway.items.file.fileitem_source import FileItemSource
+        from cellxgene_gateway.items.item import ItemType
+
+        self.source = FileItemSource("/tmp", "local")
+        self.key = CacheKey(
+            FileItem("czi", name="pbmc3k.h5ad", type=ItemType.h5ad), self.source
+        )
+
+    @patch("cellxgene_gateway.backend_cache.process_backend")
+    def test_GIVEN_create_terminate_prune_THEN_index_stays_consistent(self, backend):
+        cache = BackendCache()
+        entry = cache.create_entry(self.key, [])
+        self.assertIs(entry, cache.check_entry(self.key))
+        self.assertIs(entry, cache.check_path(self.source, "czi/pbmc3k.h5ad/api"))
+
+        with patch.object(entry, "terminate") as terminate:
+            cache.terminate(entry)
+            terminate.assert_called_once()
+        self.assertIsNone(cache.check_entry(self.key))
+        self.assertIsNone(cache.check_path(self.source, "czi/pbmc3k.h5ad/api"))
+        self.assertIn(entry, cache.entry_list)
+
+        with patch.object(entry, "terminate"):
+            cache.prune(entry)
+        self.assertEqual([], cache.entry_list)
+        self.assertNotIn(entry, cache.index)
+
+    @patch("cellxgene_gateway.backend_cache.process_backend")
+    def test_GIVEN_pruned_entry_THEN_port_reused(self, backend):
+        cache = BackendCache()
+        cache.port_allocator.start = cache.port_allocator.next_port = 9000
+        cache.port_allocator.end = 9001
+        first = cache.create_entry(self.key, [])
+        self.assertEqual([9000], cache.port_allocator.allocated_ports())
+        with patch.object(first, "terminate"):
+            cache.prune(first)
+        self.assertEqual([], cache.port_allocator.allocated_ports())
+        second = cache.create_entry(self.key, [])
+        third = cache.create_entry(self.key, [])
+        self.assertEqual((9001, 9000), (second.port, third.port))
+
+    def test_GIVEN_entry_list_replaced_THEN_index_rebuilt(self):
+        cache = BackendCache()
+        entry = CacheEntry.for_key(self.key, 8000)
+        cache.entry_list = [entry]
+        self.assertIs(entry, cache.check_entry(self.key))
+        cache.entry_list = []
+        self.assertIsNone(cache.check_entry(self.key))
+
+
+def make_key(i):
+    from cellxgene_gateway.items.file.fileitem import FileItem
+    from cellxgene_gateway.items.file.fileitem_source import FileItemSource
+    from cellxgene_gateway.items.item import ItemType
+
+    return CacheKey(
+        FileItem("czi", name=f"dataset{i}.h5ad", type=ItemType.h5ad),
+        FileItemSource("/tmp", "local"),
+    )
+
+
+def slow_launch(cellxgene_loc, scripts, entry, port_allocator=None):
+    time.sleep(0.5)
+    entry.set_loaded(1)
+
+
+class TestBackendCacheGetOrCreateEntry(unittest.TestCase):
+    def run_in_parallel(self, cache, keys):
+        results = [None] * len(keys)
+
+        def view(i):
+            results[i] = cache.get_or_create_entry(keys[i], [])
+
+        threads = [Thread(target=view, args=(i,)) for i in range(len(keys))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    @patch("cellxgene_gateway.backend_cache.process_backend.launch", new=slow_launch)
+    @patch("cellxgene_gateway.env.max_parallel_launches", new=0)
+    def test_GIVEN_different_datasets_in_parallel_THEN_launched_concurrently(self):
+        cache = BackendCache()
+        start = time.monotonic()
+        entries = self.run_in_parallel(cache, [make_key(i) for i in range(10)])
+        returned = time.monotonic() - start
+
+        while any(e.status != CacheEntryStatus.loaded for e in entries):
+            time.sleep(0.01)
+        elapsed = time.monotonic() - start
+
+        self.assertLess(returned, 0.5)
+        self.assertEqual(10, len({e.port for e in entries}))
+        # ten launches take about as long as one, not ten times as long
+        self.assertLess(elapsed, 1.5)
+
+    @patch("cellxgene_gateway.backend_cache.process_backend.launch", new=slow_launch)
+    def test_GIVEN_same_dataset_in_parallel_THEN_launched_once(self):
+        cache = BackendCache()
+        entries = self.run_in_parallel(cache, [make_key(0) for i in range(10)])
+        self.assertEqual(1, len({id(e) for e in entries}))
+        self.assertEqual(1, len(cache.entry_list))
+        self.assertEqual({}, cache.key_locks)
+
+
+def instant_launch(cellxgene_loc, scripts, entry, port_allocator=None):
+    entry.set_loaded(1)
+
+
+@patch("cellxgene_gateway.backend_cache.process_backend.launch", new=instant_launch)
+@patch("cellxgene_gateway.env.evict_min_idle_seconds", new=60)
+@patch("cellxgene_gateway.env.max_backends", new=2)
+class TestBackendCacheAdmission(unittest.TestCase):
+    def create_loaded(self, cache, i, timestamp):
+        entry = cache.create_entry(make_key(i), [])
+        entry.timestamp = timestamp
+        entry.terminate = Mock()
+        return entry
+
+    def test_GIVEN_cap_reached_THEN_least_recently_used_idle_evicted(self):
+        cache = BackendCache()
+        now = current_time_stamp()
+        older = self.create_loaded(cache, 0, now - 600)
+        newer = self.create_loaded(cache, 1, now - 300)
+
+        entry = cache.create_entry(make_key(2), [])
+
+        self.assertEqual(CacheEntryStatus.loaded, entry.status)
+        older.terminate.assert_called_once()
+        newer.terminate.assert_not_called()
+        self.assertEqual([newer, entry], cache.entry_list)
+        self.assertIsNone(cache.check_entry(make_key(0)))
+
+    def test_GIVEN_cap_reached_and_all_busy_THEN_queued_until_slot_frees(self):
+        cache = BackendCache()
+        now = current_time_stamp()
+        first = self.create_loaded(cache, 0, now - 10)
+        self.create_loaded(cache, 1, now - 10)
+
+        queued = cache.create_entry(make_key(2), [])
+        second_queued = cache.create_entry(make_key(3), [])
+
+        self.assertEqual(CacheEntryStatus.queued, queued.status)
+        self.assertEqual(1, cache.queue_position(queued))
+        self.assertEqual(2, cache.queue_position(second_queued))
+        self.assertIsNone(queued.port)
+
+        cache.prune(first)
+
+        self.assertEqual(CacheEntryStatus.loaded, queued.status)
+        self.assertIsNone(cache.queue_position(queued))
+        self.assertEqual(1, cache.queue_position(second_queued))
+
+    def test_GIVEN_requests_in_flight_THEN_not_evicted(self):
+        cache = BackendCache()
+        now = current_time_stamp()
+        busy = self.create_loaded(cache, 0, now - 600)
+        busy.in_flight = 1
+        idle = self.create_loaded(cache, 1, now - 300)
+
+        cache.create_entry(make_key(2), [])
+
+        busy.terminate.assert_not_called()
+        idle.terminate.assert_called_once()
+
+    def test_GIVEN_queued_entry_terminated_THEN_removed_from_queue(self):
+        cache = BackendCache()
+        now = current_time_stamp()
+        self.create_loaded(cache, 0, now - 10)
+        self.create_loaded(cache, 1, now - 10)
+        queued = cache.create_entry(make_key(2), [])
+
+        cache.terminate(queued)
+
+        self.assertEqual(CacheEntryStatus.terminated, queued.status)
+        self.assertEqual(0, len(cache.admission_queue))
+
+
+@patch("cellxgene_gateway.backend_cache.process_backend.launch", new=instant_launch)
+@patch("cellxgene_gateway.env.replica_in_flight", new=2)
+class TestBackendCacheReplicas(unittest.TestCase):
+    def busy(self, entry, requests):
+        for _ in range(requests):
+            entry.begin_request()
+
+    @patch("cellxgene_gateway.env.replicas", new=2)
+    def test_GIVEN_replicas_THEN_launched_on_first_request(self):
+        cache = BackendCache()
+        first = cache.get_or_create_entry(make_key(0), [])
+
+        self.assertIs(first, cache.route(first, []))
+
+        replicas = cache.replicas(make_key(0))
+        self.assertEqual([0, 1], [r.replica for r in replicas])
+        self.assertIs(first, cache.check_entry(make_key(0)))
+        self.assertIs(first, cache.check_path(make_key(0).source, "czi/dataset0.h5ad"))
+        cache.route(first, [])
+        self.assertEqual(2, len(cache.replicas(make_key(0))))
+
+    @patch("cellxgene_gateway.env.max_replicas", new=3)
+    def test_GIVEN_replicas_busy_THEN_more_launched_up_to_max(self):
+        cache = BackendCache()
+        first = cache.get_or_create_entry(make_key(0), [])
+        self.assertIs(first, cache.route(first, []))
+        self.assertEqual(1, len(cache.replicas(make_key(0))))
+
+        self.busy(first, 2)
+        second = cache.route(first, [])
+        self.assertEqual(1, second.replica)
+
+        self.busy(second, 2)
+        third = cache.route(first, [])
+        self.assertEqual(2, third.replica)
+
+        self.busy(third, 2)
+        cache.route(first, [])
+        self.assertEqual(3, len(cache.replicas(make_key(0))))
+
+    @patch("cellxgene_gateway.env.replicas", new=3)
+    def test_GIVEN_requests_THEN_least_in_flight_or_affinity_chosen(self):
+        cache = BackendCache()
+        first = cache.get_or_create_entry(make_key(0), [])
+        cache.route(first, [])
+        cache.route(first, [])
+        first, second, third = cache.replicas(make_key(0))
+        self.busy(first, 2)
+        self.busy(third, 1)
+
+        self.assertIs(second, cache.route(first, []))
+        self.assertIs(third, cache.route(first, [], affinity=2))
+        # a replica that is gone is no longer chosen
+        cache.terminate(third)
+        self.assertIs(second, cache.route(first, [], affinity=2))
+
+    @patch("cellxgene_gateway.env.replicas", new=2)
+    def test_GIVEN_first_replica_pruned_THEN_its_number_reused(self):
+        cache = BackendCache()
+        first = cache.get_or_create_entry(make_key(0), [])
+        second = cache.route(first, []) and cache.replicas(make_key(0))[1]
+        first.terminate = Mock()
+        cache.prune(first)
+
+        self.assertIs(second, cache.check_entry(make_key(0)))
+        self.assertIs(second, cache.get_or_create_entry(make_key(0), []))
+        cache.route(second, [])
+        self.assertEqual([0, 1], [r.replica for r in cache.replicas(make_key(0))])
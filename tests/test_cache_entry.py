@@ -1,11 +1,21 @@
+import gzip
+import io
+import json
 import unittest
 import tempfile
 import os
 import shutil
+import subprocess
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from unittest.mock import patch
 
+import psutil
 from flask import Flask
 from cellxgene_gateway import flask_util
-from cellxgene_gateway.cache_entry import CacheEntry, CacheEntryStatus
+from cellxgene_gateway.cache_entry import CacheEntry, CacheEntryStatus, stream_body
+from cellxgene_gateway.cellxgene_exception import CellxgeneException
 from cellxgene_gateway.cache_key import CacheKey
 from cellxgene_gateway.items.item import ItemType
 from cellxgene_gateway.items.file.fileitem import FileItem
@@ -65,5 +75,244 @@ class TestRenderEntry(unittest.TestCase):
         self.assertEqual(actual, expected)
 
 
+binary_body = bytes(range(256)) * 4096
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.endswith("/index.html"):
+            content_type = "text/html"
+            body = b'<link href="/static/main.css">'
+        elif self.path.endswith("/binary"):
+            content_type = "application/octet-stream"
+            body = binary_body
+        else:
+            content_type = "application/json"
+            body = b"{}"
+        encoded = "gzip" in self.headers.get("accept-encoding", "")
+        if encoded:
+            body = gzip.compress(body)
+        self.send_response(200)
+        self.send_header("content-type", content_type)
+        if encoded:
+            self.send_header("content-encoding", "gzip")
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        chunked = self.headers.get("transfer-encoding") == "chunked"
+        if chunked:
+            received = b""
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                received += self.rfile.read(size)
+                self.rfile.readline()
+                if size == 0:
+                    break
+        else:
+            received = self.rfile.read(int(self.headers["content-length"]))
+        body = json.dumps({"length": len(received), "chunked": chunked}).encode()
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestHttpSession(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_GIVEN_new_entry_THEN_no_connections(self):
+        entry = CacheEntry.for_key(key, 8000)
+        self.assertEqual(
+            {"requests": 0, "connections": 0, "reused": 0}, entry.connection_stats()
+        )
+
+    def test_GIVEN_repeated_requests_THEN_connection_is_reused(self):
+        entry = CacheEntry.for_key(key, self.server.server_address[1])
+        entry.status = CacheEntryStatus.loaded
+        for _ in range(3):
+            with app.test_request_context("/view/czi/pbmc3k.h5ad/api/v0.2/config"):
+                response = entry.serve_content("czi/pbmc3k.h5ad/api/v0.2/config")
+                self.assertEqual(200, response.status_code)
+                self.assertEqual(b"{}", b"".join(response.response))
+                response.close()
+        self.assertEqual(
+            {"requests": 3, "connections": 1, "reused": 2}, entry.connection_stats()
+        )
+
+    def test_GIVEN_binary_response_THEN_streamed(self):
+        entry = CacheEntry.for_key(key, self.server.server_address[1])
+        entry.status = CacheEntryStatus.loaded
+        with app.test_request_context("/view/czi/pbmc3k.h5ad/binary"):
+            response = entry.serve_content("czi/pbmc3k.h5ad/binary")
+            self.assertTrue(response.is_streamed)
+            self.assertEqual(str(len(binary_body)), response.headers["content-length"])
+            self.assertEqual(binary_body, b"".join(response.response))
+            response.close()
+
+    def test_GIVEN_streamed_response_THEN_in_flight_until_closed(self):
+        entry = CacheEntry.for_key(key, self.server.server_address[1])
+        entry.status = CacheEntryStatus.loaded
+        with app.test_request_context("/view/czi/pbmc3k.h5ad/binary"):
+            response = entry.serve_content("czi/pbmc3k.h5ad/binary")
+            self.assertEqual(1, entry.in_flight)
+            b"".join(response.response)
+            response.close()
+            response.close()
+        self.assertEqual(0, entry.in_flight)
+        self.assertGreaterEqual(entry.last_used, entry.timestamp)
+
+    def test_GIVEN_buffered_response_THEN_not_in_flight_after_return(self):
+        entry = CacheEntry.for_key(key, self.server.server_address[1])
+        entry.status = CacheEntryStatus.loaded
+        with app.test_request_context("/view/czi/pbmc3k.h5ad/index.html"):
+            entry.serve_content("czi/pbmc3k.h5ad/index.html")
+        self.assertEqual(0, entry.in_flight)
+        self.assertIsNotNone(entry.last_activity)
+
+    def test_GIVEN_text_response_THEN_rewritten_and_buffered(self):
+        include_source_in_url = flask_util.include_source_in_url
+        flask_util.include_source_in_url = False
+        self.addCleanup(
+            setattr, flask_util, "include_source_in_url", include_source_in_url
+        )
+        entry = CacheEntry.for_key(key, self.server.server_address[1])
+        entry.status = CacheEntryStatus.loaded
+        with app.test_request_context("/view/czi/pbmc3k.h5ad/index.html"):
+            response = entry.serve_content("czi/pbmc3k.h5ad/index.html")
+            self.assertFalse(response.is_streamed)
+            self.assertEqual(
+                b'<link href="/view/czi/pbmc3k.h5ad/static/main.css">',
+                response.get_data(),
+            )
+            self.assertEqual(
+                str(len(response.get_data())), response.headers["content-length"]
+            )
+
+    def test_GIVEN_compressed_binary_response_THEN_passed_through(self):
+        entry = CacheEntry.for_key(key, self.server.server_address[1])
+        entry.status = CacheEntryStatus.loaded
+        with app.test_request_context(
+            "/view/czi/pbmc3k.h5ad/binary", headers={"Accept-Encoding": "gzip"}
+        ):
+            response = entry.serve_content("czi/pbmc3k.h5ad/binary")
+            body = b"".join(response.response)
+            response.close()
+        self.assertEqual("gzip", response.headers["content-encoding"])
+        self.assertEqual(str(len(body)), response.headers["content-length"])
+        self.assertEqual(binary_body, gzip.decompress(body))
+
+    @patch("cellxgene_gateway.env.compression_min_bytes", new=1)
+    def test_GIVEN_text_response_and_gzip_accepted_THEN_compressed_after_rewrite(
+        self,
+    ):
+        include_source_in_url = flask_util.include_source_in_url
+        flask_util.include_source_in_url = False
+        self.addCleanup(
+            setattr, flask_util, "include_source_in_url", include_source_in_url
+        )
+        entry = CacheEntry.for_key(key, self.server.server_address[1])
+        entry.status = CacheEntryStatus.loaded
+        with app.test_request_context(
+            "/view/czi/pbmc3k.h5ad/index.html", headers={"Accept-Encoding": "gzip"}
+        ):
+            response = entry.serve_content("czi/pbmc3k.h5ad/index.html")
+        self.assertEqual("gzip", response.headers["content-encoding"])
+        self.assertEqual(
+            b'<link href="/view/czi/pbmc3k.h5ad/static/main.css">',
+            gzip.decompress(response.get_data()),
+        )
+
+    def test_GIVEN_put_THEN_body_streamed_chunked(self):
+        entry = CacheEntry.for_key(key, self.server.server_address[1])
+        entry.status = CacheEntryStatus.loaded
+        with app.test_request_context(
+            "/view/czi/pbmc3k.h5ad/api/v0.2/annotations/obs",
+            method="PUT",
+            data=binary_body,
+        ):
+            response = entry.serve_content("czi/pbmc3k.h5ad/api/v0.2/annotations/obs")
+            self.assertEqual(
+                {"length": len(binary_body), "chunked": True},
+                json.loads(b"".join(response.response)),
+            )
+            response.close()
+
+    @patch("cellxgene_gateway.env.max_request_body_bytes", new=10)
+    def test_GIVEN_body_over_limit_THEN_raise_413(self):
+        entry = CacheEntry.for_key(key, self.server.server_address[1])
+        entry.status = CacheEntryStatus.loaded
+        with app.test_request_context(
+            "/view/czi/pbmc3k.h5ad/api/v0.2/annotations/obs",
+            method="PUT",
+            data=b"x" * 11,
+        ):
+            with self.assertRaises(CellxgeneException) as context:
+                entry.serve_content("czi/pbmc3k.h5ad/api/v0.2/annotations/obs")
+        self.assertEqual(
+            HTTPStatus.REQUEST_ENTITY_TOO_LARGE, context.exception.http_status
+        )
+
+    def test_GIVEN_stream_over_limit_THEN_raise_413(self):
+        chunks = stream_body(io.BytesIO(b"x" * 25), 10, 20)
+        self.assertEqual(b"x" * 10, next(chunks))
+        self.assertEqual(b"x" * 10, next(chunks))
+        with self.assertRaises(CellxgeneException):
+            next(chunks)
+
+    def test_GIVEN_terminate_THEN_session_closed(self):
+        entry = CacheEntry.for_key(key, 8000)
+        session = entry.http_session()
+        self.assertIs(session, entry.http_session())
+        entry.terminate()
+        self.assertIsNone(entry.session)
+        self.assertEqual(CacheEntryStatus.terminated, entry.status)
+
+    def test_GIVEN_process_group_THEN_terminate_stops_all_of_it(self):
+        process = subprocess.Popen(
+            ["sh", "-c", "sleep 60 & sleep 60"], start_new_session=True
+        )
+        self.addCleanup(process.wait)
+        entry = CacheEntry.for_key(key, 8000)
+        entry.set_loaded(process.pid)
+        children = psutil.Process(process.pid).children()
+
+        entry.terminate()
+        self.assertEqual(CacheEntryStatus.terminating, entry.status)
+        entry.wait_terminated(5)
+
+        self.assertIsNotNone(process.poll())
+        psutil.wait_procs(children, timeout=5)
+        self.assertFalse(any(c.is_running() for c in children))
+        self.assertEqual(CacheEntryStatus.terminated, entry.status)
+
+    def test_GIVEN_sigterm_ignored_THEN_killed_after_grace(self):
+        process = subprocess.Popen(
+            ["sh", "-c", "trap '' TERM; sleep 60 & wait"], start_new_session=True
+        )
+        self.addCleanup(process.wait)
+        entry = CacheEntry.for_key(key, 8000)
+        entry.set_loaded(process.pid)
+
+        entry.terminate()
+        entry.wait_terminated(0.2)
+
+        self.assertIsNotNone(process.poll())
+        self.assertEqual(CacheEntryStatus.terminated, entry.status)
+
+
 if __name__ == "__main__":
     unittest.main()
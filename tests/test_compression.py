@@ -0,0 +1,92 @@
+import gzip
+import unittest
+from unittest.mock import patch
+
+from flask import Response
+
+from cellxgene_gateway import compression
+from cellxgene_gateway.compression import (
+    CompressionCache,
+    choose_encoding,
+    compress_response,
+    upstream_accept_encoding,
+)
+
+
+class TestChooseEncoding(unittest.TestCase):
+    @patch("cellxgene_gateway.compression.brotli", new=None)
+    def test_GIVEN_gzip_accepted_THEN_gzip(self):
+        self.assertEqual("gzip", choose_encoding("gzip, deflate, br"))
+
+    @patch("cellxgene_gateway.compression.brotli", new=object())
+    def test_GIVEN_brotli_available_THEN_prefer_br(self):
+        self.assertEqual("br", choose_encoding("gzip, deflate, br"))
+
+    @patch("cellxgene_gateway.compression.brotli", new=object())
+    def test_GIVEN_quality_values_THEN_highest_quality_wins(self):
+        self.assertEqual("gzip", choose_encoding("br;q=0.5, gzip;q=0.8"))
+
+    def test_GIVEN_no_supported_encoding_THEN_none(self):
+        self.assertIsNone(choose_encoding("identity"))
+        self.assertIsNone(choose_encoding("gzip;q=0"))
+        self.assertIsNone(choose_encoding(""))
+
+    def test_GIVEN_wildcard_THEN_gzip_accepted(self):
+        self.assertIn(choose_encoding("*"), ["br", "gzip"])
+
+
+class TestUpstreamAcceptEncoding(unittest.TestCase):
+    @patch("cellxgene_gateway.compression.brotli", new=None)
+    def test_GIVEN_client_encodings_THEN_only_decodable_ones_forwarded(self):
+        self.assertEqual("gzip, deflate", upstream_accept_encoding("br, gzip, deflate"))
+
+    def test_GIVEN_no_encodings_THEN_identity(self):
+        self.assertEqual("identity", upstream_accept_encoding(None))
+
+
+class TestCompressionCache(unittest.TestCase):
+    def test_GIVEN_same_body_THEN_compressed_once(self):
+        cache = CompressionCache(1024 * 1024)
+        body = b"var x = 1;" * 1000
+        first = cache.compress(body, "gzip")
+        second = cache.compress(body, "gzip")
+        self.assertIs(first, second)
+        self.assertEqual(body, gzip.decompress(first))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def test_GIVEN_cache_full_THEN_least_recently_used_evicted(self):
+        cache = CompressionCache(60)
+        cache.compress(b"a" * 1000, "gzip")
+        cache.compress(b"b" * 1000, "gzip")
+        cache.compress(b"c" * 1000, "gzip")
+        self.assertLessEqual(cache.size, 60)
+        self.assertEqual(2, len(cache.entries))
+        cache.compress(b"a" * 1000, "gzip")
+        self.assertEqual(4, cache.misses)
+
+
+class TestCompressResponse(unittest.TestCase):
+    @patch("cellxgene_gateway.env.compression_min_bytes", new=100)
+    def test_GIVEN_small_body_THEN_not_compressed(self):
+        response = compress_response(Response("small"), "gzip")
+        self.assertNotIn("content-encoding", response.headers)
+        self.assertIn("Accept-Encoding", response.headers["vary"])
+
+    @patch("cellxgene_gateway.env.compression_min_bytes", new=100)
+    def test_GIVEN_large_body_THEN_compressed(self):
+        body = "<html></html>" * 100
+        response = compress_response(Response(body), "gzip")
+        self.assertEqual("gzip", response.headers["content-encoding"])
+        self.assertEqual(body.encode(), gzip.decompress(response.get_data()))
+        self.assertEqual(
+            str(len(response.get_data())), response.headers["content-length"]
+        )
+
+    @patch("cellxgene_gateway.env.enable_compression", new=False)
+    def test_GIVEN_compression_disabled_THEN_not_compressed(self):
+        response = compress_response(Response("x" * 10000), "gzip")
+        self.assertNotIn("content-encoding", response.headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+from types import SimpleNamespace
+
+from cellxgene_gateway.entry_index import DescriptorTrie, EntryIndex
+
+
+class Entry:
+    def __init__(self, key):
+        self.key = key
+
+
+def make_entry(source_name, dataset, annotation=None):
+    key = SimpleNamespace(
+        source=SimpleNamespace(name=source_name),
+        descriptor=annotation or dataset,
+        identity=(source_name, dataset, annotation),
+    )
+    return Entry(key)
+
+
+class TestDescriptorTrie(unittest.TestCase):
+    def test_GIVEN_descriptors_THEN_prefixes_of_path_found(self):
+        trie = DescriptorTrie()
+        trie.add("dir/a.h5ad", "a")
+        trie.add("dir/a_annotations", "a_dir")
+        trie.add("dir/a_annotations/x.csv", "x")
+        trie.add("dir/b.h5ad", "b")
+        self.assertEqual(["a"], trie.prefixes_of("dir/a.h5ad/api/v0.2/config"))
+        self.assertEqual(
+            ["a_dir", "x"], trie.prefixes_of("dir/a_annotations/x.csv/static/main.js")
+        )
+        self.assertEqual([], trie.prefixes_of("dir/c.h5ad/"))
+
+    def test_GIVEN_removed_descriptor_THEN_nodes_pruned(self):
+        trie = DescriptorTrie()
+        trie.add("dir/a.h5ad", "a")
+        trie.add("dir/b.h5ad", "b")
+        trie.remove("dir/a.h5ad", "a")
+        self.assertEqual([], trie.prefixes_of("dir/a.h5ad/"))
+        self.assertEqual(["b"], trie.prefixes_of("dir/b.h5ad/"))
+        trie.remove("dir/b.h5ad", "b")
+        self.assertEqual(0, len(trie))
+
+    def test_GIVEN_unknown_descriptor_THEN_remove_is_noop(self):
+        trie = DescriptorTrie()
+        trie.add("dir/a.h5ad", "a")
+        trie.remove("dir/b.h5ad", "b")
+        trie.remove("dir/a.h5ad", "b")
+        self.assertEqual(["a"], trie.prefixes_of("dir/a.h5ad/"))
+
+
+class TestEntryIndex(unittest.TestCase):
+    def test_GIVEN_entries_THEN_matched_by_key_and_path(self):
+        a = make_entry("local", "dir/a.h5ad")
+        b = make_entry("s3", "dir/a.h5ad")
+        index = EntryIndex([a, b])
+        self.assertEqual([a], index.matching_key(a.key))
+        self.assertEqual([b], index.matching_path("s3", "dir/a.h5ad/api"))
+        self.assertEqual([], index.matching_path("other", "dir/a.h5ad/api"))
+
+    def test_GIVEN_removed_entry_THEN_no_longer_matched(self):
+        a = make_entry("local", "dir/a.h5ad")
+        index = EntryIndex([a])
+        self.assertIn(a, index)
+        index.remove(a)
+        self.assertNotIn(a, index)
+        self.assertEqual([], index.matching_key(a.key))
+        self.assertEqual([], index.matching_path("local", "dir/a.h5ad/api"))
+        self.assertEqual({}, index.by_key)
+        self.assertEqual({}, index.by_source)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import time
+import unittest
+from unittest.mock import Mock, patch
+
+from cellxgene_gateway.backend_cache import BackendCache
+from cellxgene_gateway.cache_entry import CacheEntryStatus
+from tests.test_backend_cache import make_key
+
+
+def failing_launch(cellxgene_loc, scripts, entry, port_allocator=None):
+    entry.all_output = "loading\n"
+    entry.set_error("File was invalid.", "not an h5ad file\n", 400)
+
+
+def instant_launch(cellxgene_loc, scripts, entry, port_allocator=None):
+    entry.set_loaded(1)
+
+
+def wait_started(entry):
+    while not entry.started:
+        time.sleep(0.01)
+    return entry
+
+
+@patch("cellxgene_gateway.env.failure_backoff_seconds", new=60)
+@patch("cellxgene_gateway.env.failure_backoff_max_seconds", new=200)
+@patch("cellxgene_gateway.failure_cache.fingerprint", new=Mock(return_value=(1, 2)))
+class TestFailureCache(unittest.TestCase):
+    def fail(self, cache):
+        with patch(
+            "cellxgene_gateway.backend_cache.process_backend.launch",
+            new=failing_launch,
+        ):
+            return wait_started(cache.get_or_create_entry(make_key(0), []))
+
+    def view(self, cache, launch=instant_launch):
+        mock = Mock(side_effect=launch)
+        with patch("cellxgene_gateway.backend_cache.process_backend.launch", new=mock):
+            entry = wait_started(cache.get_or_create_entry(make_key(0), []))
+        return entry, mock
+
+    def test_GIVEN_failed_launch_THEN_error_served_without_launching(self):
+        cache = BackendCache()
+        failed = self.fail(cache)
+        self.assertFalse(cache.expire_failure(failed))
+
+        cache.terminate(failed)
+        entry, launch = self.view(cache)
+
+        launch.assert_not_called()
+        self.assertIsNot(failed, entry)
+        self.assertEqual(CacheEntryStatus.error, entry.status)
+        self.assertEqual("File was invalid.", entry.message)
+        self.assertEqual("not an h5ad file\n", entry.stderr)
+        self.assertEqual("loading\n", entry.all_output)
+        self.assertEqual(400, entry.http_status)
+        self.assertEqual("open", cache.failures.status()[0]["state"])
+
+    def test_GIVEN_repeated_failures_THEN_backoff_doubles_up_to_max(self):
+        cache = BackendCache()
+        with patch("cellxgene_gateway.failure_cache.current_time_stamp") as now:
+            now.return_value = 1000
+            failed = self.fail(cache)
+            self.assertEqual(1060, cache.failures.status()[0]["retry_at"])
+
+            now.return_value = 1060
+            self.assertTrue(cache.expire_failure(failed))
+            failed = self.fail(cache)
+            self.assertEqual(1180, cache.failures.status()[0]["retry_at"])
+
+            now.return_value = 1180
+            self.assertTrue(cache.expire_failure(failed))
+            self.fail(cache)
+            status = cache.failures.status()[0]
+            self.assertEqual(3, status["failures"])
+            self.assertEqual(1380, status["retry_at"])
+
+    def test_GIVEN_backoff_over_THEN_launched_again_and_closed_on_success(self):
+        cache = BackendCache()
+        with patch("cellxgene_gateway.failure_cache.current_time_stamp") as now:
+            now.return_value = 1000
+            self.fail(cache)
+            now.return_value = 1060
+            self.assertEqual("half_open", cache.failures.status()[0]["state"])
+            entry, launch = self.view(cache)
+
+        launch.assert_called_once()
+        self.assertEqual(CacheEntryStatus.loaded, entry.status)
+        self.assertEqual([], cache.failures.status())
+
+    def test_GIVEN_file_changed_THEN_launched_again(self):
+        cache = BackendCache()
+        self.fail(cache)
+
+        with patch("cellxgene_gateway.failure_cache.fingerprint", return_value=(3, 4)):
+            entry, launch = self.view(cache)
+
+        launch.assert_called_once()
+        self.assertEqual(CacheEntryStatus.loaded, entry.status)
@@ -0,0 +1,95 @@
+import os
+import subprocess
+import unittest
+from unittest.mock import patch
+
+from cellxgene_gateway.backend_cache import BackendCache
+from cellxgene_gateway.cache_entry import CacheEntryStatus
+from cellxgene_gateway.health_checker import HealthChecker
+from tests.test_backend_cache import instant_launch, make_key
+
+
+def exited_pid():
+    process = subprocess.Popen(["true"])
+    process.wait()
+    return process.pid
+
+
+@patch("cellxgene_gateway.backend_cache.process_backend.launch", new=instant_launch)
+@patch("cellxgene_gateway.env.health_check_failures", new=2)
+class TestHealthChecker(unittest.TestCase):
+    def create_loaded(self, cache, pid):
+        entry = cache.get_or_create_entry(make_key(0), [])
+        entry.set_loaded(pid)
+        return entry
+
+    @patch("cellxgene_gateway.health_checker.is_serving", return_value=True)
+    def test_GIVEN_healthy_backend_THEN_kept(self, is_serving):
+        cache = BackendCache()
+        entry = self.create_loaded(cache, os.getpid())
+
+        HealthChecker(cache).check()
+
+        is_serving.assert_called_once_with(entry.port)
+        self.assertEqual(CacheEntryStatus.loaded, entry.status)
+        self.assertIs(entry, cache.check_entry(make_key(0)))
+
+    @patch("cellxgene_gateway.health_checker.is_serving", return_value=True)
+    def test_GIVEN_process_exited_THEN_relaunched_on_next_request(self, is_serving):
+        cache = BackendCache()
+        entry = self.create_loaded(cache, exited_pid())
+
+        HealthChecker(cache).check()
+
+        self.assertEqual(CacheEntryStatus.terminated, entry.status)
+        self.assertEqual([], cache.entry_list)
+        self.assertEqual([], cache.port_allocator.allocated_ports())
+        relaunched = cache.get_or_create_entry(make_key(0), [])
+        self.assertIsNot(entry, relaunched)
+
+    @patch("cellxgene_gateway.health_checker.is_serving", return_value=False)
+    def test_GIVEN_not_responding_THEN_failed_after_consecutive_failures(
+        self, is_serving
+    ):
+        cache = BackendCache()
+        entry = self.create_loaded(cache, os.getpid())
+        entry.terminate = lambda: None
+        checker = HealthChecker(cache)
+
+        checker.check()
+        self.assertEqual([entry], cache.entry_list)
+
+        is_serving.return_value = True
+        checker.check()
+        is_serving.return_value = False
+        checker.check()
+        self.assertEqual([entry], cache.entry_list)
+
+        checker.check()
+        self.assertEqual([], cache.entry_list)
+
+    @patch("cellxgene_gateway.health_checker.is_serving", return_value=False)
+    def test_GIVEN_requests_in_flight_THEN_not_pinged(self, is_serving):
+        cache = BackendCache()
+        entry = self.create_loaded(cache, os.getpid())
+        end_request = entry.begin_request()
+        checker = HealthChecker(cache)
+
+        for i in range(3):
+            checker.check()
+
+        is_serving.assert_not_called()
+        self.assertEqual([entry], cache.entry_list)
+        end_request()
+
+    @patch("cellxgene_gateway.env.health_relaunch", new=False)
+    def test_GIVEN_no_relaunch_THEN_error_kept(self):
+        cache = BackendCache()
+        entry = self.create_loaded(cache, exited_pid())
+
+        HealthChecker(cache).check()
+
+        self.assertEqual(CacheEntryStatus.error, entry.status)
+        self.assertEqual("Cellxgene exited unexpectedly.", entry.message)
+        self.assertIs(entry, cache.check_entry(make_key(0)))
+        self.assertEqual([], cache.port_allocator.allocated_ports())
@@ -0,0 +1,130 @@
+import threading
+import time
+import unittest
+
+from cellxgene_gateway.cache_entry import CacheEntry, CacheEntryStatus
+from cellxgene_gateway.launch_scheduler import LaunchScheduler
+from tests.test_backend_cache import make_key
+
+
+class FakeLaunch:
+    # loads until ready is set, then serves until exited is set
+    def __init__(self, entry, started):
+        self.entry = entry
+        self.started = started
+        self.ready = threading.Event()
+        self.exited = threading.Event()
+
+    def __call__(self):
+        self.started.append(self.entry)
+        self.ready.wait(5)
+        self.entry.set_loaded(1)
+        self.exited.wait(5)
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + 5
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+class TestLaunchScheduler(unittest.TestCase):
+    def submit(self, scheduler, entries):
+        started = []
+        launches = []
+        for entry in entries:
+            launch = FakeLaunch(entry, started)
+            launches.append(launch)
+            scheduler.submit(entry, launch)
+        self.addCleanup(lambda: [l.ready.set() or l.exited.set() for l in launches])
+        return started, launches
+
+    def entries(self, n):
+        return [CacheEntry.for_key(make_key(i), None) for i in range(n)]
+
+    def test_GIVEN_limit_THEN_next_launch_starts_when_one_is_ready(self):
+        scheduler = LaunchScheduler(max_parallel=2, order="fifo")
+        entries = self.entries(4)
+        started, launches = self.submit(scheduler, entries)
+
+        wait_until(lambda: len(started) == 2)
+        time.sleep(0.05)
+        self.assertEqual(entries[:2], started)
+        self.assertEqual(2, scheduler.status()["queued"])
+        self.assertEqual(1, scheduler.position(entries[2]))
+
+        # the first backend keeps running, but no longer counts as starting
+        launches[0].ready.set()
+        wait_until(lambda: len(started) == 3)
+        self.assertEqual(entries[:3], started)
+        self.assertFalse(launches[0].exited.is_set())
+        self.assertEqual(2, scheduler.status()["starting"])
+
+    def test_GIVEN_failed_launch_THEN_slot_released(self):
+        scheduler = LaunchScheduler(max_parallel=1, order="fifo")
+        entries = self.entries(2)
+        started = []
+
+        def failing_launch():
+            started.append(entries[0])
+            entries[0].set_error("Cellxgene failed to launch dataset.", "", 500)
+
+        scheduler.submit(entries[0], failing_launch)
+        started_later, _ = self.submit(scheduler, entries[1:])
+
+        wait_until(lambda: len(started_later) == 1)
+        self.assertEqual([entries[1]], started_later)
+
+    def test_GIVEN_priority_order_THEN_viewed_datasets_before_warm_ones(self):
+        scheduler = LaunchScheduler(max_parallel=1, order="priority")
+        entries = self.entries(4)
+        entries[1].warm = True
+        entries[3].hits = 5
+        started, launches = self.submit(scheduler, entries)
+
+        self.assertEqual(
+            [3, 2, 1],
+            [scheduler.position(entry) for entry in entries[1:]],
+        )
+        for i in range(4):
+            wait_until(lambda: len(started) == i + 1)
+            launches[entries.index(started[-1])].ready.set()
+        self.assertEqual([entries[0], entries[3], entries[2], entries[1]], started)
+
+    def test_GIVEN_cancelled_THEN_not_launched(self):
+        scheduler = LaunchScheduler(max_parallel=1, order="fifo")
+        entries = self.entries(3)
+        started, launches = self.submit(scheduler, entries)
+
+        self.assertTrue(scheduler.cancel(entries[1]))
+        launches[0].ready.set()
+
+        wait_until(lambda: len(started) == 2)
+        self.assertEqual([entries[0], entries[2]], started)
+        self.assertFalse(scheduler.cancel(entries[1]))
+
+    def test_GIVEN_stopped_while_queued_THEN_skipped(self):
+        scheduler = LaunchScheduler(max_parallel=1, order="fifo")
+        entries = self.entries(3)
+        started, launches = self.submit(scheduler, entries)
+
+        entries[1].status = CacheEntryStatus.terminated
+        launches[0].ready.set()
+
+        wait_until(lambda: len(started) == 2)
+        self.assertEqual([entries[0], entries[2]], started)
+
+    def test_GIVEN_launches_THEN_wait_times_reported(self):
+        scheduler = LaunchScheduler(max_parallel=1, order="fifo")
+        entries = self.entries(2)
+        started, launches = self.submit(scheduler, entries)
+        time.sleep(0.1)
+        self.assertGreaterEqual(scheduler.status()["oldest_wait_seconds"], 0.1)
+
+        launches[0].ready.set()
+        wait_until(lambda: len(started) == 2)
+
+        status = scheduler.status()
+        self.assertIsNone(status["oldest_wait_seconds"])
+        self.assertGreaterEqual(status["max_wait_seconds"], 0.1)
+        self.assertGreaterEqual(entries[1].launch_wait_seconds, 0.1)
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+from io import BytesIO
+from unittest.mock import MagicMock, Mock, patch
+
+from cellxgene_gateway.log_pump import LogPump, OutputBuffer
+
+
+class TestOutputBuffer(unittest.TestCase):
+    def test_GIVEN_no_output_THEN_text_is_none(self):
+        self.assertIsNone(OutputBuffer(3).text())
+
+    def test_GIVEN_more_lines_than_capacity_THEN_oldest_dropped(self):
+        buffer = OutputBuffer(2)
+        for line in ["a\n", "b\n", "c\n"]:
+            buffer.append(line)
+        self.assertEqual(2, len(buffer))
+        self.assertEqual("[1 earlier lines omitted]\nb\nc\n", buffer.text())
+
+
+class TestLogPump(unittest.TestCase):
+    def make_entry(self):
+        entry = Mock()
+        entry.source_name = "local"
+        entry.key.descriptor = "czi/pbmc3k.h5ad"
+        entry.output = OutputBuffer(10)
+        entry.error_output = OutputBuffer(10)
+        return entry
+
+    def test_GIVEN_process_output_THEN_both_streams_drained(self):
+        process = MagicMock()
+        process.stdout = BytesIO(b"loading\nserving\n")
+        process.stderr = BytesIO(b"\xffwarning\n")
+        entry = self.make_entry()
+
+        LogPump(process, entry).join()
+
+        self.assertEqual("loading\nserving\n", entry.output.text())
+        self.assertEqual("\ufffdwarning\n", entry.error_output.text())
+        self.assertTrue(process.stdout.closed)
+
+    def test_GIVEN_log_dir_THEN_output_written_to_file(self):
+        log_dir = tempfile.mkdtemp()
+        process = MagicMock()
+        process.stdout = BytesIO(b"loading\n")
+        process.stderr = BytesIO(b"warning\n")
+
+        with patch("cellxgene_gateway.env.backend_log_dir", new=log_dir):
+            pump = LogPump(process, self.make_entry())
+            pump.join()
+
+        with open(os.path.join(log_dir, "local_czi_pbmc3k.h5ad.log")) as f:
+            log = f.read()
+        self.assertIn("stdout loading\n", log)
+        self.assertIn("stderr warning\n", log)
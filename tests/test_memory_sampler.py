@@ -0,0 +1,119 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+
+from cellxgene_gateway.backend_cache import BackendCache
+from cellxgene_gateway.cache_entry import CacheEntryStatus
+from cellxgene_gateway.memory_sampler import (
+    MemorySampler,
+    gdsf_priority,
+    process_tree_memory,
+    read_cgroup_memory,
+)
+from cellxgene_gateway.util import current_time_stamp
+from tests.test_backend_cache import instant_launch, make_key
+
+
+def make_entry(hits, load_seconds, memory_bytes):
+    entry = Mock()
+    entry.hits = hits
+    entry.load_seconds = load_seconds
+    entry.memory_bytes = memory_bytes
+    return entry
+
+
+class TestProcessTreeMemory(unittest.TestCase):
+    def test_GIVEN_running_process_THEN_memory_reported(self):
+        self.assertGreater(process_tree_memory(os.getpid()), 0)
+
+    def test_GIVEN_missing_process_THEN_none(self):
+        self.assertIsNone(process_tree_memory(2**22 + 1))
+
+
+class TestReadCgroupMemory(unittest.TestCase):
+    def write_files(self, usage, limit):
+        directory = tempfile.mkdtemp()
+        usage_path = os.path.join(directory, "memory.current")
+        limit_path = os.path.join(directory, "memory.max")
+        with open(usage_path, "w") as f:
+            f.write(usage)
+        with open(limit_path, "w") as f:
+            f.write(limit)
+        return [("/nonexistent/memory.current", "/nonexistent/memory.max")] + [
+            (usage_path, limit_path)
+        ]
+
+    def test_GIVEN_limit_THEN_usage_and_limit_returned(self):
+        files = self.write_files("1000\n", "4000\n")
+        with patch("cellxgene_gateway.memory_sampler.cgroup_files", new=files):
+            self.assertEqual((1000, 4000), read_cgroup_memory())
+
+    def test_GIVEN_no_limit_THEN_limit_is_none(self):
+        files = self.write_files("1000\n", "max\n")
+        with patch("cellxgene_gateway.memory_sampler.cgroup_files", new=files):
+            self.assertEqual((1000, None), read_cgroup_memory())
+
+    def test_GIVEN_no_cgroup_THEN_nothing_returned(self):
+        with patch("cellxgene_gateway.memory_sampler.cgroup_files", new=[]):
+            self.assertEqual((None, None), read_cgroup_memory())
+
+
+class TestGdsfPriority(unittest.TestCase):
+    def test_GIVEN_larger_dataset_THEN_lower_priority(self):
+        small = make_entry(hits=1, load_seconds=10, memory_bytes=100)
+        large = make_entry(hits=1, load_seconds=10, memory_bytes=1000)
+        self.assertLess(gdsf_priority(large, 0), gdsf_priority(small, 0))
+
+    def test_GIVEN_more_hits_or_slower_load_THEN_higher_priority(self):
+        base = make_entry(hits=1, load_seconds=10, memory_bytes=100)
+        popular = make_entry(hits=5, load_seconds=10, memory_bytes=100)
+        slow = make_entry(hits=1, load_seconds=60, memory_bytes=100)
+        self.assertGreater(gdsf_priority(popular, 0), gdsf_priority(base, 0))
+        self.assertGreater(gdsf_priority(slow, 0), gdsf_priority(base, 0))
+
+
+@patch("cellxgene_gateway.backend_cache.process_backend.launch", new=instant_launch)
+@patch("cellxgene_gateway.env.evict_min_idle_seconds", new=60)
+@patch("cellxgene_gateway.env.memory_use_cgroup", new=False)
+@patch("cellxgene_gateway.env.memory_budget_bytes", new=1000)
+class TestMemorySamplerRelievePressure(unittest.TestCase):
+    def create_loaded(self, cache, i, memory_bytes, idle_seconds=600):
+        entry = cache.create_entry(make_key(i), [])
+        entry.timestamp = current_time_stamp() - idle_seconds
+        entry.memory_bytes = memory_bytes
+        entry.terminate = Mock()
+        return entry
+
+    def test_GIVEN_over_budget_THEN_largest_idle_backend_evicted(self):
+        cache = BackendCache()
+        small = self.create_loaded(cache, 0, 300)
+        large = self.create_loaded(cache, 1, 700)
+        sampler = MemorySampler(cache)
+
+        sampler.relieve_pressure()
+
+        large.terminate.assert_called_once()
+        small.terminate.assert_not_called()
+        self.assertEqual([small], cache.entry_list)
+
+    def test_GIVEN_under_budget_THEN_nothing_evicted(self):
+        cache = BackendCache()
+        entry = self.create_loaded(cache, 0, 500)
+        MemorySampler(cache).relieve_pressure()
+        entry.terminate.assert_not_called()
+
+    def test_GIVEN_over_budget_and_backends_busy_THEN_nothing_evicted(self):
+        cache = BackendCache()
+        entry = self.create_loaded(cache, 0, 2000, idle_seconds=0)
+        MemorySampler(cache).relieve_pressure()
+        entry.terminate.assert_not_called()
+        self.assertEqual(CacheEntryStatus.loaded, entry.status)
+
+    def test_GIVEN_loaded_backend_THEN_sample_records_memory(self):
+        cache = BackendCache()
+        entry = cache.create_entry(make_key(0), [])
+        entry.pid = os.getpid()
+        MemorySampler(cache).sample()
+        self.assertGreater(entry.memory_bytes, 0)
+        self.assertIsNotNone(entry.memory_sampled_at)
@@ -0,0 +1,56 @@
+import unittest
+from http import HTTPStatus
+from unittest.mock import patch
+
+from cellxgene_gateway.cellxgene_exception import CellxgeneException
+from cellxgene_gateway.port_allocator import PortAllocator
+
+
+class TestPortAllocator(unittest.TestCase):
+    def test_GIVEN_range_THEN_ports_allocated_in_turn(self):
+        allocator = PortAllocator(8000, 8002)
+        a, b = object(), object()
+        self.assertEqual(8000, allocator.allocate(a))
+        self.assertEqual(8001, allocator.allocate(b))
+        self.assertEqual([8000, 8001], allocator.allocated_ports())
+
+    def test_GIVEN_released_port_THEN_reused_after_others(self):
+        allocator = PortAllocator(8000, 8001)
+        a, b, c = object(), object(), object()
+        allocator.allocate(a)
+        allocator.allocate(b)
+        allocator.release(8000, a)
+        self.assertEqual(8000, allocator.allocate(c))
+
+    def test_GIVEN_range_exhausted_THEN_raise_service_unavailable(self):
+        allocator = PortAllocator(8000, 8000)
+        allocator.allocate(object())
+        with self.assertRaises(CellxgeneException) as context:
+            allocator.allocate(object())
+        self.assertEqual(HTTPStatus.SERVICE_UNAVAILABLE, context.exception.http_status)
+
+    def test_GIVEN_release_by_previous_owner_THEN_port_kept(self):
+        allocator = PortAllocator(8000, 8000)
+        a, b = object(), object()
+        allocator.allocate(a)
+        allocator.release(8000, a)
+        allocator.allocate(b)
+        allocator.release(8000, a)
+        self.assertEqual([8000], allocator.allocated_ports())
+
+    def test_GIVEN_port_in_use_THEN_quarantined(self):
+        allocator = PortAllocator(8000, 8001, quarantine_seconds=60)
+        a = object()
+        with patch("cellxgene_gateway.port_allocator.current_time_stamp") as now:
+            now.return_value = 100
+            allocator.allocate(a)
+            allocator.release(8000, a, in_use=True)
+            self.assertEqual(8001, allocator.allocate(object()))
+            with self.assertRaises(CellxgeneException):
+                allocator.allocate(object())
+            now.return_value = 161
+            self.assertEqual(8000, allocator.allocate(object()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,7 @@
+import time
 import unittest
-from unittest.mock import patch, seal
+from threading import Thread
+from unittest.mock import Mock, patch, seal
 
 from cellxgene_gateway.backend_cache import BackendCache
 from cellxgene_gateway.cache_key import CacheKey
@@ -13,6 +15,10 @@ key = CacheKey(
 )
 
 
+def make_entry(last_used, in_flight=0, launchtime=0):
+    return Mock(last_used=last_used, in_flight=in_flight, launchtime=launchtime)
+
+
 class TestPruneProcessCache(unittest.TestCase):
     @patch("cellxgene_gateway.util.current_time_stamp", new=lambda: 0)
     @patch("cellxgene_gateway.env.expire_seconds", new=10)
@@ -23,14 +29,19 @@ class TestPruneProcessCache(unittest.TestCase):
 
         cache = BackendCache()
         old.timestamp = -100
+        old.last_used = -100
+        old.in_flight = 0
         old.foo = 12
         old.pid = 1
+        old.port = 8000
         old.key = key
         old.terminate.return_value = None
+        old.wait_terminated.return_value = None
         seal(old)
         new.key = key
         cache.entry_list.append(old)
         new.timestamp = -5
+        new.last_used = -5
         seal(new)
         cache.entry_list.append(new)
         self.assertEqual(len(cache.entry_list), 2)
@@ -41,6 +52,94 @@ class TestPruneProcessCache(unittest.TestCase):
         self.assertEqual(cache.entry_list[0], new)
         self.assertTrue(old.terminate.called)
 
+    @patch("cellxgene_gateway.env.expire_seconds", new=10)
+    def test_GIVEN_entry_used_again_THEN_rescheduled_instead_of_pruned(self):
+        from cellxgene_gateway.prune_process_cache import PruneProcessCache
+
+        cache = BackendCache()
+        entry = make_entry(last_used=0)
+        cache.entry_list.append(entry)
+        ppc = PruneProcessCache(cache)
+        entry.last_used = 20
+
+        with patch("cellxgene_gateway.util.current_time_stamp", new=lambda: 15):
+            ppc.prune()
+        self.assertEqual([entry], cache.entry_list)
+        self.assertEqual([(30, 1, entry)], ppc.deadlines)
+
+        with patch("cellxgene_gateway.util.current_time_stamp", new=lambda: 31):
+            ppc.prune()
+        self.assertEqual([], cache.entry_list)
+        self.assertEqual([], ppc.deadlines)
+
+    @patch("cellxgene_gateway.env.expire_seconds", new=10)
+    def test_GIVEN_entry_already_removed_THEN_dropped_from_schedule(self):
+        from cellxgene_gateway.prune_process_cache import PruneProcessCache
+
+        cache = BackendCache()
+        entry = make_entry(last_used=0)
+        cache.entry_list.append(entry)
+        ppc = PruneProcessCache(cache)
+        cache.prune(entry)
+
+        with patch("cellxgene_gateway.util.current_time_stamp", new=lambda: 11):
+            ppc.prune()
+        self.assertEqual([], ppc.deadlines)
+        entry.terminate.assert_called_once()
+
+    @patch("cellxgene_gateway.env.expire_seconds", new=0.2)
+    def test_GIVEN_new_entry_THEN_pruner_wakes_at_its_deadline(self):
+        from cellxgene_gateway.prune_process_cache import PruneProcessCache
+        from cellxgene_gateway.util import current_time_stamp
+
+        cache = BackendCache()
+        ppc = PruneProcessCache(cache)
+        Thread(target=ppc, daemon=True).start()
+
+        entry = make_entry(last_used=current_time_stamp())
+        cache.entry_list.append(entry)
+        for listener in cache.creation_listeners:
+            listener(entry)
+
+        start = time.monotonic()
+        while len(cache.entry_list) > 0 and time.monotonic() - start < 5:
+            time.sleep(0.01)
+        self.assertEqual([], cache.entry_list)
+        self.assertLess(time.monotonic() - start, 1)
+
+    @patch("cellxgene_gateway.env.expire_seconds", new=10)
+    def test_GIVEN_requests_in_flight_THEN_not_pruned(self):
+        from cellxgene_gateway.prune_process_cache import PruneProcessCache
+
+        cache = BackendCache()
+        entry = make_entry(last_used=0, in_flight=1)
+        cache.entry_list.append(entry)
+        ppc = PruneProcessCache(cache)
+
+        with patch("cellxgene_gateway.util.current_time_stamp", new=lambda: 100):
+            ppc.prune()
+        self.assertEqual([entry], cache.entry_list)
+        self.assertEqual(105, ppc.deadlines[0][0])
+
+        entry.in_flight = 0
+        with patch("cellxgene_gateway.util.current_time_stamp", new=lambda: 105):
+            ppc.prune()
+        self.assertEqual([], cache.entry_list)
+
+    @patch("cellxgene_gateway.env.max_lifetime_seconds", new=50)
+    @patch("cellxgene_gateway.env.expire_seconds", new=10)
+    def test_GIVEN_max_lifetime_THEN_pruned_although_used(self):
+        from cellxgene_gateway.prune_process_cache import PruneProcessCache
+
+        cache = BackendCache()
+        entry = make_entry(last_used=45, launchtime=0)
+        cache.entry_list.append(entry)
+        ppc = PruneProcessCache(cache)
+
+        with patch("cellxgene_gateway.util.current_time_stamp", new=lambda: 50):
+            ppc.prune()
+        self.assertEqual([], cache.entry_list)
+
 
 if __name__ == "__main__":
     unittest.main()
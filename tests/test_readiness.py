@@ -0,0 +1,58 @@
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+from unittest.mock import MagicMock, patch
+
+from cellxgene_gateway.readiness import Readiness, is_serving, wait_until_ready
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(404 if self.path == "/missing" else 200)
+        self.send_header("content-length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestIsServing(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), HealthHandler)
+        self.port = self.server.server_address[1]
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_GIVEN_http_server_THEN_serving(self):
+        self.assertTrue(is_serving(self.port, "/health"))
+
+    def test_GIVEN_health_path_missing_THEN_still_serving(self):
+        self.assertTrue(is_serving(self.port, "/missing"))
+
+    def test_GIVEN_nothing_listening_THEN_not_serving(self):
+        self.server.server_close()
+        self.assertFalse(is_serving(self.port, "/health"))
+
+
+class TestWaitUntilReady(unittest.TestCase):
+    @patch("cellxgene_gateway.readiness.is_serving", side_effect=[False, False, True])
+    def test_GIVEN_server_starts_THEN_ready(self, is_serving):
+        process = MagicMock()
+        process.poll.return_value = None
+        self.assertEqual(Readiness.ready, wait_until_ready(process, 8000, timeout=5))
+        self.assertEqual(3, is_serving.call_count)
+
+    @patch("cellxgene_gateway.readiness.is_serving", return_value=True)
+    def test_GIVEN_process_exited_THEN_exited_even_if_port_serves(self, is_serving):
+        process = MagicMock()
+        process.poll.return_value = 1
+        self.assertEqual(Readiness.exited, wait_until_ready(process, 8000, timeout=5))
+
+    @patch("cellxgene_gateway.readiness.is_serving", return_value=False)
+    def test_GIVEN_server_never_starts_THEN_timed_out(self, is_serving):
+        process = MagicMock()
+        process.poll.return_value = None
+        self.assertEqual(
+            Readiness.timed_out, wait_until_ready(process, 8000, timeout=0.2)
+        )
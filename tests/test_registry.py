@@ -0,0 +1,218 @@
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from cellxgene_gateway.backend_cache import BackendCache
+from cellxgene_gateway.cache_entry import CacheEntry, CacheEntryStatus
+from cellxgene_gateway.readiness import is_serving
+from cellxgene_gateway.registry import Registry
+from tests.test_backend_cache import instant_launch, make_key
+
+
+def claim_in_process(path, queue, done):
+    entry = CacheEntry.for_key(make_key(0), None)
+    queue.put(Registry(path).claim(entry) is None)
+    # a claim by a process that is gone would be stale
+    done.wait()
+
+
+def wait_for_loaded(registry, entry):
+    while registry.get(entry.claim).status != "loaded":
+        time.sleep(0.01)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_serving(port):
+    while not is_serving(port, "/"):
+        time.sleep(0.05)
+
+
+@patch("cellxgene_gateway.backend_cache.process_backend.launch", new=instant_launch)
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "registry.sqlite")
+        self.registry = Registry(self.path)
+
+    def worker(self):
+        # every worker process opens the registry on its own
+        return BackendCache(Registry(self.path))
+
+    def test_GIVEN_dataset_launched_by_one_worker_THEN_adopted_by_another(self):
+        first, second = self.worker(), self.worker()
+        launched = first.get_or_create_entry(make_key(0), [])
+        wait_for_loaded(self.registry, launched)
+
+        with patch.object(second, "launch") as launch:
+            adopted = second.get_or_create_entry(make_key(0), [])
+
+        launch.assert_not_called()
+        self.assertIsNot(launched, adopted)
+        self.assertEqual(launched.claim, adopted.claim)
+        self.assertEqual(launched.port, adopted.port)
+        self.assertEqual(CacheEntryStatus.loaded, adopted.status)
+        self.assertIs(adopted, second.check_entry(make_key(0)))
+
+    def test_GIVEN_status_changed_by_owner_THEN_seen_by_other_worker(self):
+        first, second = self.worker(), self.worker()
+        with patch.object(first, "launch"):
+            launched = first.get_or_create_entry(make_key(0), [])
+        adopted = second.get_or_create_entry(make_key(0), [])
+        self.assertEqual(CacheEntryStatus.loading, adopted.status)
+
+        launched.set_loaded(os.getpid())
+        self.assertTrue(second.sync(adopted))
+        self.assertEqual(CacheEntryStatus.loaded, adopted.status)
+        self.assertEqual(os.getpid(), adopted.pid)
+
+    def test_GIVEN_backend_stopped_by_other_worker_THEN_forgotten(self):
+        first, second = self.worker(), self.worker()
+        launched = first.get_or_create_entry(make_key(0), [])
+        wait_for_loaded(self.registry, launched)
+        adopted = second.get_or_create_entry(make_key(0), [])
+        launched.pid = None
+
+        first.terminate(launched)
+
+        self.assertEqual([], self.registry.rows())
+        self.assertFalse(second.sync(adopted))
+        self.assertEqual(CacheEntryStatus.terminated, adopted.status)
+        self.assertEqual([], second.entry_list)
+        self.assertIsNone(second.check_entry(make_key(0)))
+
+    def test_GIVEN_port_held_by_other_worker_THEN_next_port_used(self):
+        first, second = self.worker(), self.worker()
+        a = first.get_or_create_entry(make_key(0), [])
+        b = second.get_or_create_entry(make_key(1), [])
+        self.assertEqual(8000, a.port)
+        self.assertEqual(8001, b.port)
+
+    def test_GIVEN_owner_of_loading_entry_died_THEN_claimed_again(self):
+        process = subprocess.Popen(["true"])
+        process.wait()
+        entry = CacheEntry.for_key(make_key(0), None)
+        with patch("os.getpid", return_value=process.pid):
+            self.assertIsNone(self.registry.claim(entry))
+
+        self.assertIsNone(self.registry.claim(CacheEntry.for_key(make_key(0), None)))
+        self.assertEqual(1, len(self.registry.rows()))
+
+    def test_GIVEN_concurrent_claims_from_processes_THEN_only_one_succeeds(self):
+        context = multiprocessing.get_context("fork")
+        queue = context.Queue()
+        done = context.Event()
+        processes = [
+            context.Process(target=claim_in_process, args=(self.path, queue, done))
+            for i in range(8)
+        ]
+        for process in processes:
+            process.start()
+        results = [queue.get(timeout=30) for process in processes]
+        done.set()
+        for process in processes:
+            process.join()
+
+        self.assertEqual(1, results.count(True))
+
+
+class TestRecover(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.registry = Registry(os.path.join(directory, "registry.sqlite"))
+        exited = subprocess.Popen(["true"])
+        exited.wait()
+        self.dead_pid = exited.pid
+
+    def spawn(self, args):
+        # a backend left running by a gateway process that is gone
+        process = subprocess.Popen(args, start_new_session=True)
+        self.addCleanup(process.wait)
+        self.addCleanup(process.kill)
+        return process
+
+    def register(self, process, port, owner):
+        entry = CacheEntry.for_key(make_key(0), port)
+        with patch("os.getpid", return_value=owner):
+            self.registry.claim(entry)
+        entry.set_loaded(process.pid)
+        self.registry.update(entry)
+        return entry
+
+    def test_GIVEN_serving_backend_of_dead_gateway_THEN_adopted(self):
+        port = free_port()
+        process = self.spawn(
+            [sys.executable, "-m", "http.server", str(port), "--bind", "127.0.0.1"]
+        )
+        wait_for_serving(port)
+        entry = self.register(process, port, self.dead_pid)
+        cache = BackendCache(self.registry)
+
+        recovered = cache.recover(lambda row: make_key(0))
+
+        self.assertEqual([cache.check_entry(make_key(0))], recovered)
+        self.assertEqual(entry.claim, recovered[0].claim)
+        self.assertEqual(port, recovered[0].port)
+        self.assertEqual(process.pid, recovered[0].pid)
+        self.assertEqual(CacheEntryStatus.loaded, recovered[0].status)
+        self.assertEqual(os.getpid(), self.registry.get(entry.claim).owner)
+        self.assertIsNone(process.poll())
+
+    def test_GIVEN_backend_not_serving_THEN_killed_and_removed(self):
+        port = free_port()
+        process = self.spawn(
+            [sys.executable, "-c", "import time; time.sleep(60)", str(port)]
+        )
+        self.register(process, port, self.dead_pid)
+        cache = BackendCache(self.registry)
+
+        self.assertEqual([], cache.recover(lambda row: make_key(0)))
+
+        self.assertEqual(-9, process.wait(timeout=10))
+        self.assertEqual([], self.registry.rows())
+        self.assertEqual([], cache.entry_list)
+
+    def test_GIVEN_dataset_gone_THEN_backend_killed(self):
+        port = free_port()
+        process = self.spawn(
+            [sys.executable, "-m", "http.server", str(port), "--bind", "127.0.0.1"]
+        )
+        wait_for_serving(port)
+        self.register(process, port, self.dead_pid)
+
+        self.assertEqual([], BackendCache(self.registry).recover(lambda row: None))
+
+        self.assertEqual(-9, process.wait(timeout=10))
+        self.assertEqual([], self.registry.rows())
+
+    def test_GIVEN_pid_reused_by_other_process_THEN_not_killed(self):
+        process = self.spawn([sys.executable, "-c", "import time; time.sleep(60)"])
+        self.register(process, free_port(), self.dead_pid)
+
+        BackendCache(self.registry).recover(lambda row: make_key(0))
+
+        self.assertIsNone(process.poll())
+        self.assertEqual([], self.registry.rows())
+
+    def test_GIVEN_owner_alive_THEN_left_alone(self):
+        port = free_port()
+        process = self.spawn([sys.executable, "-c", "import time; time.sleep(60)"])
+        self.register(process, port, os.getppid())
+
+        self.assertEqual([], BackendCache(self.registry).recover(lambda row: None))
+
+        self.assertIsNone(process.poll())
+        self.assertEqual(1, len(self.registry.rows()))
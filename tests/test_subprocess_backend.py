@@ -1,7 +1,9 @@
 import unittest
+from http import HTTPStatus
+from io import BytesIO
 from unittest.mock import MagicMock, patch
 
-from cellxgene_gateway.cache_entry import CacheEntry
+from cellxgene_gateway.cache_entry import CacheEntry, CacheEntryStatus
 from cellxgene_gateway.cache_key import CacheKey
 from cellxgene_gateway.items.file.fileitem import FileItem
 from cellxgene_gateway.items.file.fileitem_source import FileItemSource
@@ -13,8 +15,9 @@ class TestSubprocessBackend(unittest.TestCase):
     @patch("subprocess.Popen")
     def test_launch_GIVEN_no_stdout_THEN_throw_ProcessException(self, popen):
         subprocess = MagicMock()
-        subprocess.stdout.readline().decode.return_value = ""
-        subprocess.stderr.read().decode.return_value = "An unexpected error"
+        subprocess.stdout = BytesIO(b"")
+        subprocess.stderr = BytesIO(b"An unexpected error")
+        subprocess.poll.return_value = 1
         popen.return_value = subprocess
 
         key = CacheKey(
@@ -32,21 +35,34 @@ class TestSubprocessBackend(unittest.TestCase):
             backend.launch(cellxgene_loc, scripts, entry)
         popen.assert_called_once_with(
             [
-                "yes | /some/cellxgene launch /tmp/czi/pbmc3k.h5ad --port 8000 --host 127.0.0.1 --disable-annotations --disable-gene-sets-save --scripts http://example.com/script.js --scripts http://example.com/script2.js"
+                "/some/cellxgene",
+                "launch",
+                "/tmp/czi/pbmc3k.h5ad",
+                "--port",
+                "8000",
+                "--host",
+                "127.0.0.1",
+                "--disable-annotations",
+                "--disable-gene-sets-save",
+                "--scripts",
+                "http://example.com/script.js",
+                "--scripts",
+                "http://example.com/script2.js",
             ],
-            shell=True,
-            stderr=-1,
+            stdin=-1,
             stdout=-1,
+            stderr=-1,
+            start_new_session=True,
         )
         self.assertEqual("An unexpected error", context.exception.stderr)
 
+    @patch("cellxgene_gateway.readiness.is_serving", return_value=True)
     @patch("subprocess.Popen")
-    def test_launch_GIVEN_annotations_enabled_THEN_set_flags(self, popen):
+    def test_launch_GIVEN_annotations_enabled_THEN_set_flags(self, popen, is_serving):
         subprocess = MagicMock()
-        subprocess.stdout.readline().decode.return_value = (
-            "[cellxgene] Type CTRL-C at any time to exit.\n"
-        )
-        subprocess.stderr.read().decode.return_value = ""
+        subprocess.stdout = BytesIO(b"[cellxgene] Type CTRL-C at any time to exit.\n")
+        subprocess.stderr = BytesIO(b"")
+        subprocess.poll.return_value = None
         popen.return_value = subprocess
 
         key = CacheKey(
@@ -69,9 +85,137 @@ class TestSubprocessBackend(unittest.TestCase):
             cellxgene_gateway.subprocess_backend.enable_annotations = False
         popen.assert_called_once_with(
             [
-                "yes | /some/cellxgene launch /tmp/czi/pbmc3k.h5ad --port 8000 --host 127.0.0.1 --annotations-file /tmp/czi/pbmc3k_annotations/foo.csv --gene-sets-file /tmp/czi/pbmc3k_annotations/foo_gene_sets.csv"
+                "/some/cellxgene",
+                "launch",
+                "/tmp/czi/pbmc3k.h5ad",
+                "--port",
+                "8000",
+                "--host",
+                "127.0.0.1",
+                "--annotations-file",
+                "/tmp/czi/pbmc3k_annotations/foo.csv",
+                "--gene-sets-file",
+                "/tmp/czi/pbmc3k_annotations/foo_gene_sets.csv",
             ],
-            shell=True,
-            stderr=-1,
+            stdin=-1,
             stdout=-1,
+            stderr=-1,
+            start_new_session=True,
+        )
+        subprocess.stdin.write.assert_called_once_with(b"y\n" * 16)
+        subprocess.stdin.close.assert_called_once()
+
+    @patch("cellxgene_gateway.readiness.is_serving", return_value=True)
+    @patch("subprocess.Popen")
+    def test_launch_GIVEN_port_in_use_THEN_retry_on_new_port(self, popen, is_serving):
+        taken = MagicMock()
+        taken.stdout = BytesIO(b"")
+        taken.stderr = BytesIO(b"Error: The port selected 8000 is in use\n")
+        # another process serves on the port, but the launched one exited
+        taken.poll.return_value = 1
+        started = MagicMock()
+        started.stdout = BytesIO(b"[cellxgene] Type CTRL-C at any time to exit.\n")
+        started.stderr = BytesIO(b"")
+        started.poll.return_value = None
+        popen.side_effect = [taken, started]
+
+        from cellxgene_gateway.port_allocator import PortAllocator
+        from cellxgene_gateway.subprocess_backend import SubprocessBackend
+
+        key = CacheKey(
+            FileItem("/czi/", name="pbmc3k.h5ad", type=ItemType.h5ad),
+            FileItemSource("/tmp", "local"),
+        )
+        entry = CacheEntry.for_key(key, None)
+        allocator = PortAllocator(8000, 8010)
+        entry.port = allocator.allocate(entry)
+
+        SubprocessBackend().launch("/some/cellxgene", [], entry, allocator)
+
+        self.assertEqual(2, popen.call_count)
+        self.assertIn("8001", popen.call_args[0][0])
+        self.assertEqual(8001, entry.port)
+        self.assertEqual([8001], allocator.allocated_ports())
+        self.assertEqual(CacheEntryStatus.loaded, entry.status)
+
+    @patch("cellxgene_gateway.readiness.is_serving", return_value=True)
+    @patch("subprocess.Popen")
+    def test_launch_GIVEN_chatty_process_THEN_only_last_lines_kept(
+        self, popen, is_serving
+    ):
+        subprocess = MagicMock()
+        subprocess.poll.return_value = None
+        subprocess.stdout = BytesIO(
+            b"".join(f"loading {i}\n".encode() for i in range(10))
+        )
+        subprocess.stderr = BytesIO(
+            b"".join(f"warning {i}\n".encode() for i in range(10))
+        )
+        popen.return_value = subprocess
+
+        from cellxgene_gateway.subprocess_backend import SubprocessBackend
+
+        key = CacheKey(
+            FileItem("/czi/", name="pbmc3k.h5ad", type=ItemType.h5ad),
+            FileItemSource("/tmp", "local"),
+        )
+        with patch("cellxgene_gateway.env.output_buffer_lines", new=3):
+            entry = CacheEntry.for_key(key, 8000)
+            SubprocessBackend().launch("/some/cellxgene", [], entry)
+
+        self.assertEqual(CacheEntryStatus.loaded, entry.status)
+        self.assertIsNotNone(entry.time_to_ready)
+        self.assertEqual(
+            "[7 earlier lines omitted]\nloading 7\nloading 8\nloading 9\n",
+            entry.all_output,
+        )
+        self.assertEqual(
+            "[7 earlier lines omitted]\nwarning 7\nwarning 8\nwarning 9\n",
+            entry.stderr,
+        )
+
+    @patch("cellxgene_gateway.subprocess_backend.SubprocessBackend.kill")
+    @patch("cellxgene_gateway.subprocess_backend.wait_until_ready")
+    @patch("subprocess.Popen")
+    def test_launch_GIVEN_not_ready_in_time_THEN_killed(
+        self, popen, wait_until_ready, kill
+    ):
+        from cellxgene_gateway.readiness import Readiness
+        from cellxgene_gateway.subprocess_backend import SubprocessBackend
+
+        subprocess = MagicMock()
+        subprocess.stdout = BytesIO(b"loading\n")
+        subprocess.stderr = BytesIO(b"")
+        popen.return_value = subprocess
+        wait_until_ready.return_value = Readiness.timed_out
+
+        key = CacheKey(
+            FileItem("/czi/", name="pbmc3k.h5ad", type=ItemType.h5ad),
+            FileItemSource("/tmp", "local"),
+        )
+        entry = CacheEntry.for_key(key, 8000)
+
+        with self.assertRaises(ProcessException) as context:
+            SubprocessBackend().launch("/some/cellxgene", [], entry)
+
+        kill.assert_called_once_with(subprocess)
+        self.assertEqual(HTTPStatus.GATEWAY_TIMEOUT, context.exception.http_status)
+        self.assertEqual(CacheEntryStatus.error, entry.status)
+        self.assertIsNone(entry.time_to_ready)
+
+    def test_create_cmd_GIVEN_cellxgene_args_THEN_split_into_argv(self):
+        import cellxgene_gateway.subprocess_backend
+
+        cellxgene_gateway.subprocess_backend.cellxgene_args = (
+            "--title 'My datasets' --max-category-items 500"
+        )
+        try:
+            cmd = cellxgene_gateway.subprocess_backend.SubprocessBackend().create_cmd(
+                "/some/cellxgene", "/tmp/a b.h5ad", 8000, [], None
+            )
+        finally:
+            cellxgene_gateway.subprocess_backend.cellxgene_args = None
+        self.assertEqual("/tmp/a b.h5ad", cmd[2])
+        self.assertEqual(
+            ["--title", "My datasets", "--max-category-items", "500"], cmd[-4:]
         )
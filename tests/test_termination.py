@@ -0,0 +1,40 @@
+import time
+import unittest
+from unittest.mock import Mock, patch
+
+from cellxgene_gateway.termination import TerminationExecutor
+
+
+def slow_wait(grace_seconds):
+    time.sleep(0.3)
+
+
+class TestTerminationExecutor(unittest.TestCase):
+    def test_GIVEN_entries_THEN_signalled_at_once_and_waited_in_parallel(self):
+        executor = TerminationExecutor(max_workers=10)
+        entries = [Mock(wait_terminated=Mock(side_effect=slow_wait)) for i in range(10)]
+        exited = []
+
+        start = time.monotonic()
+        futures = [executor.submit(e, exited.append) for e in entries]
+        submitted = time.monotonic() - start
+        for future in futures:
+            future.result()
+        elapsed = time.monotonic() - start
+
+        self.assertLess(submitted, 0.3)
+        self.assertLess(elapsed, 1.5)
+        for entry in entries:
+            entry.terminate.assert_called_once()
+        self.assertCountEqual(entries, exited)
+
+    @patch("cellxgene_gateway.env.termination_grace_seconds", new=7)
+    def test_GIVEN_wait_fails_THEN_on_exit_still_called(self):
+        executor = TerminationExecutor(max_workers=1)
+        entry = Mock(wait_terminated=Mock(side_effect=OSError("boom")))
+        on_exit = Mock()
+
+        executor.submit(entry, on_exit).result()
+
+        entry.wait_terminated.assert_called_once_with(7)
+        on_exit.assert_called_once_with(entry)
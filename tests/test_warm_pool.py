@@ -0,0 +1,143 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from cellxgene_gateway.backend_cache import BackendCache
+from cellxgene_gateway.registry import Registry
+from cellxgene_gateway.warm_pool import (
+    AccessHistory,
+    WarmPool,
+    next_run,
+    parse_datasets,
+    parse_schedule,
+)
+from tests.test_backend_cache import instant_launch, make_key
+
+
+def key_for(source_name, descriptor):
+    # descriptors of make_key are czi/dataset<i>.h5ad
+    if not descriptor.startswith("czi/dataset"):
+        return None
+    return make_key(int(descriptor[len("czi/dataset") : -len(".h5ad")]))
+
+
+class TestSchedule(unittest.TestCase):
+    def test_GIVEN_times_THEN_sorted(self):
+        self.assertEqual(
+            [datetime.time(7, 0), datetime.time(13, 30)],
+            parse_schedule("13:30, 07:00"),
+        )
+
+    def test_GIVEN_no_schedule_THEN_empty(self):
+        self.assertEqual([], parse_schedule(None))
+
+    def test_GIVEN_later_time_today_THEN_runs_today(self):
+        times = parse_schedule("07:00,13:30")
+        now = datetime.datetime(2024, 1, 1, 8, 0)
+        self.assertEqual(datetime.datetime(2024, 1, 1, 13, 30), next_run(times, now))
+
+    def test_GIVEN_all_times_passed_THEN_runs_tomorrow(self):
+        times = parse_schedule("07:00,13:30")
+        now = datetime.datetime(2024, 1, 1, 14, 0)
+        self.assertEqual(datetime.datetime(2024, 1, 2, 7, 0), next_run(times, now))
+
+    def test_GIVEN_datasets_THEN_descriptors_of_default_source(self):
+        self.assertEqual(
+            [(None, "a.h5ad"), (None, "b/c.h5ad")], parse_datasets("a.h5ad, b/c.h5ad,")
+        )
+
+
+class TestAccessHistory(unittest.TestCase):
+    def record(self, history):
+        for i in [1, 0, 1, 2, 1, 2]:
+            history.record(make_key(i))
+
+    def test_GIVEN_accesses_THEN_most_accessed_first(self):
+        history = AccessHistory()
+        self.record(history)
+        self.assertEqual(
+            [("local", "czi/dataset1.h5ad"), ("local", "czi/dataset2.h5ad")],
+            history.most_accessed(2),
+        )
+
+    def test_GIVEN_registry_THEN_accesses_persisted(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "registry.sqlite")
+        self.record(AccessHistory(Registry(path)))
+
+        self.assertEqual(
+            [("local", "czi/dataset1.h5ad"), ("local", "czi/dataset2.h5ad")],
+            AccessHistory(Registry(path)).most_accessed(2),
+        )
+
+
+@patch("cellxgene_gateway.backend_cache.process_backend.launch", new=instant_launch)
+class TestWarmPool(unittest.TestCase):
+    def warm_pool(self, cache, history=None):
+        return WarmPool(cache, key_for, lambda: [], history or AccessHistory())
+
+    @patch("cellxgene_gateway.env.warm_datasets", new="czi/dataset0.h5ad,missing.h5ad")
+    def test_GIVEN_warm_list_THEN_datasets_launched_and_marked(self):
+        cache = BackendCache()
+        self.warm_pool(cache).warm()
+
+        entry = cache.check_entry(make_key(0))
+        self.assertTrue(entry.warm)
+        self.assertEqual(1, len(cache.entry_list))
+
+    @patch("cellxgene_gateway.env.warm_datasets", new=None)
+    @patch("cellxgene_gateway.env.warm_top_n", new=1)
+    def test_GIVEN_access_history_THEN_most_accessed_launched(self):
+        cache = BackendCache()
+        history = AccessHistory()
+        for i in [0, 1, 1]:
+            history.record(make_key(i))
+
+        self.warm_pool(cache, history).warm()
+
+        self.assertIsNone(cache.check_entry(make_key(0)))
+        self.assertTrue(cache.check_entry(make_key(1)).warm)
+
+    @patch("cellxgene_gateway.env.warm_datasets", new="czi/dataset0.h5ad")
+    def test_GIVEN_dataset_running_THEN_not_marked_warm(self):
+        cache = BackendCache()
+        running = cache.get_or_create_entry(make_key(0), [])
+
+        self.warm_pool(cache).warm()
+
+        self.assertFalse(running.warm)
+        self.assertEqual([running], cache.entry_list)
+
+    @patch("cellxgene_gateway.env.max_backends", new=2)
+    @patch(
+        "cellxgene_gateway.env.warm_datasets",
+        new="czi/dataset1.h5ad,czi/dataset2.h5ad",
+    )
+    def test_GIVEN_max_backends_THEN_nothing_evicted(self):
+        cache = BackendCache()
+        running = cache.get_or_create_entry(make_key(0), [])
+        running.timestamp = 0
+
+        self.warm_pool(cache).warm()
+
+        self.assertEqual(2, len(cache.entry_list))
+        self.assertIs(running, cache.check_entry(make_key(0)))
+        self.assertIsNone(cache.check_entry(make_key(2)))
+
+    @patch(
+        "cellxgene_gateway.env.warm_datasets",
+        new="czi/dataset0.h5ad,czi/dataset1.h5ad",
+    )
+    def test_GIVEN_warm_backend_used_THEN_counted(self):
+        cache = BackendCache()
+        warm_pool = self.warm_pool(cache)
+        warm_pool.warm()
+        cache.check_entry(make_key(0)).hits += 1
+
+        status = warm_pool.status()
+        self.assertEqual(2, status["launched"])
+        self.assertEqual(1, status["used"])
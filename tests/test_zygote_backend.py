@@ -0,0 +1,120 @@
+import http.server
+import os
+import signal
+import socket
+import sys
+import threading
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import psutil
+
+from cellxgene_gateway.cache_entry import CacheEntry, CacheEntryStatus
+from cellxgene_gateway.process_exception import ProcessException
+from cellxgene_gateway.subprocess_backend import SubprocessBackend
+from cellxgene_gateway.zygote_backend import ZygoteBackend, default_python
+from tests.test_backend_cache import make_key
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def fake_cellxgene():
+    # stands in for the cellxgene cli in the zygote: launch <file> --port <port>
+    port = int(sys.argv[sys.argv.index("--port") + 1])
+    print(f"[cellxgene] Loading data from {sys.argv[2]}", flush=True)
+    if sys.argv[2].endswith("missing.h5ad"):
+        print("Could not open file", file=sys.stderr, flush=True)
+        sys.exit(2)
+    print(f"answered {sys.stdin.readline().strip()}", flush=True)
+    http.server.HTTPServer(
+        ("127.0.0.1", port), http.server.SimpleHTTPRequestHandler
+    ).serve_forever()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@patch.dict(os.environ, {"PYTHONPATH": root})
+@patch("cellxgene_gateway.env.enable_annotations", new=False)
+class TestZygoteBackend(unittest.TestCase):
+    def backend(self, entry_point="tests.test_zygote_backend:fake_cellxgene"):
+        backend = ZygoteBackend(
+            python=sys.executable, entry_point=entry_point, preload=["json"]
+        )
+
+        def stop_zygote():
+            if backend.zygote is not None:
+                backend.zygote.kill()
+                backend.zygote.wait()
+
+        self.addCleanup(stop_zygote)
+        return backend
+
+    def launch(self, backend, entry):
+        errors = []
+
+        def run():
+            try:
+                backend.launch("cellxgene", [], entry)
+            except ProcessException as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread, errors
+
+    def wait_for_status(self, entry):
+        deadline = time.monotonic() + 10
+        while entry.status == CacheEntryStatus.loading:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+
+    def test_GIVEN_zygote_THEN_backend_forked_in_its_own_session(self):
+        backend = self.backend()
+        entry = CacheEntry.for_key(make_key(0), free_port())
+        thread, errors = self.launch(backend, entry)
+        self.wait_for_status(entry)
+
+        self.assertEqual(CacheEntryStatus.loaded, entry.status)
+        self.assertEqual(backend.zygote.pid, psutil.Process(entry.pid).ppid())
+        self.assertEqual(entry.pid, os.getpgid(entry.pid))
+        self.assertIn("answered y", entry.all_output)
+
+        os.killpg(entry.pid, signal.SIGTERM)
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([], errors)
+
+    def test_GIVEN_backend_exits_THEN_error_reported(self):
+        backend = self.backend()
+        entry = CacheEntry.for_key(make_key(0), free_port())
+        entry.key.h5ad_item.name = "missing.h5ad"
+        thread, errors = self.launch(backend, entry)
+        thread.join(10)
+
+        self.assertEqual(CacheEntryStatus.error, entry.status)
+        self.assertEqual("File was invalid.", entry.message)
+        self.assertEqual(1, len(errors))
+
+    def test_GIVEN_zygote_cannot_start_THEN_started_directly(self):
+        backend = self.backend(entry_point="tests.nonexistent:main")
+        with patch.object(SubprocessBackend, "spawn") as spawn:
+            self.assertIs(
+                spawn.return_value, backend.spawn(["cellxgene", "launch"], "cellxgene")
+            )
+        spawn.assert_called_once_with(["cellxgene", "launch"], "cellxgene")
+
+    def test_GIVEN_python_script_THEN_its_interpreter_used(self):
+        with tempfile.NamedTemporaryFile("w", suffix="cellxgene") as script:
+            script.write("#!/opt/cellxgene/bin/python3.8 -u\nimport sys\n")
+            script.flush()
+            os.chmod(script.name, 0o755)
+            self.assertEqual(
+                "/opt/cellxgene/bin/python3.8", default_python(script.name)
+            )
+        self.assertEqual(sys.executable, default_python("/nonexistent/cellxgene"))